@@ -3,187 +3,173 @@ import matplotlib.pyplot as plt
 import json
 import os
 import sys
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from model.stp_store import load_stp_recording
+from model import stp_reconstruction
+from model.spike_store import load_spikes
+from model.rate_monitor import load_rates
+from model.rates import firing_rates, rate_difference
+from model.stimulus import StimulusTimeline, shade_stimuli
+from model.raster import draw_raster
+
+
+def load_spike_data(overlap = False, pops = None, t_start = None, t_stop = None):
+    # spike data are loaded only for the populations in pops (all the recorded ones by default)
+    # and only in the time window [t_start, t_stop) if given
+    if pops is None:
+        pops = simulation_params["recording_params"]["pop_recorded"]
+    srs = [load_spikes(data_path, i, t_start, t_stop) for i in pops]
+
+    # change neuron id so that each selective population has ids [n_E*i, n_E*(i+1)), i.e. the rank
+    # of the neuron in the population plus n_E*i, with a lookup table from the NEST id
+    if(overlap==True):
+        ids = np.loadtxt(data_path + "selective_pop_ids.dat", ndmin=2).astype(np.int64) + 1
+        lut = np.full(network_params["N_exc"] + 1, -1, dtype=np.int64)
+        for i in range(len(srs)):
+            sorted_ids = np.sort(ids[:,pops[i]])
+            lut[sorted_ids] = np.arange(len(sorted_ids)) + n_E*pops[i]
+            senders = srs[i][:,0].astype(np.int64)
+            new_ids = lut[senders]
+            srs[i][:,0] = np.where(new_ids >= 0, new_ids, senders)
+            lut[sorted_ids] = -1
 
-
-def load_spike_data(overlap = False):
-    if(overlap==False):
-        srs = [np.loadtxt(data_path + "spikedata"+str(i)+".dat") for i in range(network_params["p"])]
-        
-    # change neuron id so that each selective population has ids [800*(i-1), 800*i]
-    else:
-        sr0_dum = np.loadtxt(data_path + "spikedata0.dat")
-        sr1_dum = np.loadtxt(data_path + "spikedata1.dat")
-        sr2_dum = np.loadtxt(data_path + "spikedata2.dat")
-        sr3_dum = np.loadtxt(data_path + "spikedata3.dat")
-        sr4_dum = np.loadtxt(data_path + "spikedata4.dat")
-        old_data = [sr0_dum, sr1_dum, sr2_dum, sr3_dum, sr4_dum]
-        ids = np.loadtxt(data_path + "selective_pop_ids.dat")
-        srs = []
-        for i in range(len(old_data)):
-            sorted_ids = np.sort(ids[:,i]) + 1
-            sr = old_data[i]
-            for idx in sorted_ids:
-                pos_old_ids = np.where(old_data[i][:,0]==idx)
-                if(list(pos_old_ids[0])!=[]):
-                    for r in list(pos_old_ids[0]):
-                        sr[r,0]=np.where(sorted_ids==idx)[0][0] + 800*i
-            srs.append(sr)
-    
     return(srs)
 
-def raster_plot():
+def shown_spikes(sr, i, n_rows):
+    # spikes of the first n_rows neurons of the i-th population of srs, placed in the i-th band of n_show rows
+    shown = sr[:,0] < n_rows + n_E*i
+    return({"y": sr[shown,0] - (n_E - n_show)*i, "times": sr[shown,1], "y_range": (n_show*i, n_show*(i+1))})
+
+
+def raster_plot(mode = "auto"):
+    # mode: "markers", "density" or "auto" (see model/raster.py)
     labelsize=19
     titlesize=20
-    f = network_params["f"]
-    N_E = network_params["N_exc"]
-    # number of neurons belonging to a selective populaiton
-    n_E = int(N_E * f)
-    n_E_frac = int(n_E * 0.1)
     colors = ["blue", "red", "green", "orange", "olive", "cornflowerblue", "salmon", "lime", "gold", "yellowgreen"]
     fig, ax = plt.subplots(figsize=(15,10))
-    for i in range(len(srs)):
-        dum = srs[i]
-        dumx = []
-        dumy = []
-        for j in range(len(dum[:,0])):
-            if(srs[i][j,0]<n_E_frac+n_E*i):
-                dumx.append(dum[j,1])
-                dumy.append(dum[j,0]-(n_E-n_E_frac)*i)
-        ax.plot(dumx, dumy, '.', color=colors[i])
+    layers = [dict(shown_spikes(srs[i], i, n_show), color=colors[i%len(colors)]) for i in range(len(srs))]
+    draw_raster(ax, layers, 0, 20000, mode)
     ax.set_ylabel("# cell", fontsize=labelsize)
     ax.set_xlabel("Time [ms]", fontsize=labelsize)
     ax.set_xlim(0,20000)
-    ax.set_ylim(0,n_E_frac*len(srs))
+    ax.set_ylim(0,n_show*len(srs))
     ax.tick_params(labelsize=labelsize)
-    for i in range(network_params["item_loading"]["nstim"]):
-        ax.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], (1./len(srs))*i, (1./len(srs))*(i+1), alpha=0.5, color='grey')
-    if("nonspecific_readout_signals" in network_params):
-        for i in range(network_params["nonspecific_readout_signals"]["nstim"]):
-            if(i==0):
-                ax.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='cornflowerblue', label="Readout signal")
-            else:
-                ax.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='cornflowerblue')
-    if("nonspecific_noise" in network_params):
-        for i in range(network_params["nonspecific_noise"]["nstim"]):
-            if(i==0):
-                ax.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='turquoise', label="Noise")
-            else:
-                ax.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='turquoise')
+    shade_stimuli(ax, stimuli, {"item_loading": {"color": "grey", "band": lambda ev: ((1./len(srs))*ev.target, (1./len(srs))*(ev.target+1))},
+                                "nonspecific_readout_signal": {"color": "cornflowerblue", "label": "Readout signal"},
+                                "nonspecific_noise": {"color": "turquoise", "label": "Noise"}}, 0, 20000)
     plt.subplots_adjust(left=0.07, right=0.976, top=0.925, bottom=0.1)
     plt.savefig(simulation_params['data_path']+"raster_plot_analysis.png")
     plt.draw()
 
 
+def population_rate_plot():
+    # population rates saved by the online rate monitor (see model/rate_monitor.py),
+    # available also when the spikes are not saved
+    times, rates = load_rates(data_path)
+    labelsize=19
+    fig, ax = plt.subplots(figsize=(15,6))
+    for name, rate in rates.items():
+        ax.plot(times, rate, label=name)
+    ax.set_ylabel("Rate [spikes/s]", fontsize=labelsize)
+    ax.set_xlabel("Time [ms]", fontsize=labelsize)
+    ax.tick_params(labelsize=labelsize)
+    shade_stimuli(ax, stimuli, {"item_loading": {"color": "grey", "label": "Item Loading"},
+                                "nonspecific_readout_signal": {"color": "cornflowerblue", "label": "Readout signal"},
+                                "nonspecific_noise": {"color": "turquoise", "label": "Noise"}}, times[0], times[-1])
+    ax.legend(fontsize=labelsize-4)
+    plt.savefig(simulation_params['data_path']+"population_rates.png")
+    plt.draw()
+
+
+def recorded_ids(npop):
+    # ids of the neurons recorded in the selective population npop, after the remapping of load_spike_data
+    N_neurons_recorded = int(network_params["N_exc"]*network_params["f"]*simulation_params["recording_params"]["fraction_pop_recorded"])
+    first = n_E*npop if overlap else n_E*npop + 1
+    return(np.arange(first, first + N_neurons_recorded))
+
+
 def firing_rate(t_start, t_stop):
-    
-    SE = sr0
-    dum = SE[:,1]
-    dum = (dum > t_start) & (dum < t_stop )
+    # firing rate of each recorded neuron of the first recorded population, array with ids and rates in the columns
     print("Start firing rate calculation at {} ms and stop at {} ms".format(t_start, t_stop))
-    # neuron that emitted the spikes in that range
-    senders = [i for (i, dum) in zip(SE[:,0], dum) if dum]
-    N_neurons_recorded = int(network_params["N_exc"]*network_params["f"]*simulation_params["recording_params"]["fraction_pop_recorded"])
-    ids = np.arange(np.min(senders),np.min(senders)+N_neurons_recorded)
-    #print(len(ids))
-    # count firing rate for each neuron
-    occ = [[x,1000.0*senders.count(x)/(t_stop-t_start)] for x in ids]
-    print("Average firing rate: {:.2} Hz".format((len(senders)*1000.0/(t_stop-t_start))/len(ids)))
-    #dum = SE["times"]
-    return(occ)
+    ids = recorded_ids(simulation_params["recording_params"]["pop_recorded"][0])
+    rates = firing_rates(sr0, ids, [(t_start, t_stop)])[0]
+    print("Average firing rate: {:.2} Hz".format(np.mean(rates)))
+    return(np.column_stack([ids, rates]))
 
 
 def firing_rate_hist(t_start1, t_stop1, t_start2, t_stop2, plot):
-    occurrencies1 = firing_rate(t_start1, t_stop1, spike_recorder)
-    occurrencies2 = firing_rate(t_start2, t_stop2, spike_recorder)
-    SE = sr0
-    dum = np.min(SE[:,0])
-    N_neurons_recorded = int(network_params["N_exc"]*network_params["f"]*simulation_params["recording_params"]["fraction_pop_recorded"])
-    ids = np.arange(dum,dum+N_neurons_recorded)
-    delta_fr = [[id, occurrencies1[id-1][1]-occurrencies2[id-1][1]] for id in ids]
+    # firing rate difference of the recorded neurons of the first recorded population between
+    # the windows (t_start1, t_stop1) and (t_start2, t_stop2)
+    ids = recorded_ids(simulation_params["recording_params"]["pop_recorded"][0])
+    delta_fr = rate_difference(sr0, ids, [(t_start1, t_stop1)], [(t_start2, t_stop2)])
     if plot == True:
         labelsize=19
         titlesize=20
-        df_hist = [delta_fr[i-1][1] for i in ids]
         plt.figure()
         plt.title(r"$\Delta$ fr between delay period and spontaneous state in the target population", fontsize=titlesize)
-        plt.hist(df_hist, color = "crimson",bins="auto", density=True)
+        plt.hist(delta_fr, color = "crimson",bins="auto", density=True)
         plt.xlabel("Firing rate difference [Hz]", fontsize=labelsize)
         plt.ylabel("Fraction of cells", fontsize=labelsize)
         plt.tick_params(labelsize=labelsize)
         plt.draw()
+    return(delta_fr)
+
+
+def delay_period():
+    # the delay period starts at the end of the first item loading and stops at the first nonspecific
+    # stimulus (readout signal or noise) after it, or when the background input is diminished
+    first_item = stimuli.select("item_loading")[0]
+    t_start = first_item.onset + first_item.duration
+    onsets = [stimuli.first_onset(kind, after=t_start) for kind in ["nonspecific_readout_signal", "nonspecific_noise"]]
+    onsets = [t for t in onsets if t is not None]
+    t_stop = min(onsets) if onsets else simulation_params["eta_end_origin"]
+    return(t_start, t_stop)
 
 
 def get_firing_rate_plot():
-    
-    spike_recorder = spike_recorders[0]
     # spontaneous rate
     t_start2 = simulation_params["recording_params"]["spike_recording_params"]["start"]
-    t_stop2 = network_params["item_loading"]["origin"][0]
+    t_stop2 = stimuli.first_onset("item_loading")
     # delay period
-    t_start1 = network_params["item_loading"]["origin"][0] + network_params["stimulation_params"]["T_cue"]
-    if("nonspecific_readout_signals" in network_params):
-        t_stop1 = network_params["nonspecific_readout_signals"]["origin"][0]
-    if("nonspecific_noise" in network_params):
-        t_stop1 = network_params["nonspecific_noise"]["origin"][0]
-    if("nonspecific_readout_signals" in network_params and "nonspecific_noise" in network_params):
-        t_stop1 = min(network_params["nonspecific_readout_signals"]["origin"][0], network_params["nonspecific_noise"]["origin"][0])
-    else:
-        t_stop1 = simulation_params["eta_end_origin"]
+    t_start1, t_stop1 = delay_period()
     
-    
-    firing_rate_hist(spike_recorder, t_start1, t_stop1, t_start2, t_stop2, plot=True)
+    firing_rate_hist(t_start1, t_stop1, t_start2, t_stop2, plot=True)
     #fr_diff = fr_difference(sr1, item_origin + stim_params["T_cue"], 3000.0, 20, item_origin,  True)
 
 
-def figure2(stp = False, t=[], x=[], u=[], panel="A"):
+def figure2(stp = False, t=[], x=[], u=[], panel="A", bands=None):
+    # bands: optional dict with the lower and upper bounds of the spread of "x" and "u" over the neurons
     labelsize=19
     titlesize=20
     f, (ax0, ax1) = plt.subplots(1, 2, figsize=(15,4.2), gridspec_kw={'wspace': 0.4,'width_ratios': [2.5, 1]})
 
-    for i in range(network_params["item_loading"]["nstim"]):
-        if(i==0):
-            ax0.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='grey', label="Item Loading")
-        else:
-            ax1.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='grey')
-    if("nonspecific_readout_signals" in network_params):
-        for i in range(network_params["nonspecific_readout_signals"]["nstim"]):
-            if(i==0):
-                ax0.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='lightgrey', label="Readout signal")
-            else:
-                ax0.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='lightgrey')
-    if("nonspecific_noise" in network_params):
-        for i in range(network_params["nonspecific_noise"]["nstim"]):
-            if(i==0):
-                ax0.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise', label="Noise")
-            else:
-                ax0.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise')
-    if("periodic_sequence" in network_params):
-            for i in range(len(network_params["periodic_sequence"]["times"])):
-                if(i==0):
-                    ax0.axvspan(network_params["periodic_sequence"]["times"][i], network_params["periodic_sequence"]["times"][i]+network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey', label="Periodic stimuli")
-                else:
-                    ax0.axvspan(network_params["periodic_sequence"]["times"][i], network_params["periodic_sequence"]["times"][i]+network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey')
+    x_min = 2000.0
+    x_max=6000.0
+    shade_stimuli(ax0, stimuli, {"item_loading": {"color": "grey", "label": "Item Loading"},
+                                 "nonspecific_readout_signal": {"color": "lightgrey", "label": "Readout signal"},
+                                 "nonspecific_noise": {"color": "turquoise", "label": "Noise"},
+                                 "periodic_sequence": {"color": "lightgrey", "label": "Periodic stimuli"}}, x_min, x_max)
     
     #plt.title("Raster plot for a subset of Pop {} and Pop {} neurons".format(simulation_params["recording_params"]["pop_recorded"][0], simulation_params["recording_params"]["pop_recorded"][1]), fontsize=titlesize)
     ax0.plot(sr0[:,1], sr0[:,0], '.', color = "limegreen", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][0]))
-    ax0.plot(sr1[:,1], sr1[:,0]-[800 for i in sr1[:,0]], '.', color = "k", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][1]))
+    ax0.plot(sr1[:,1], sr1[:,0]-[n_E for i in sr1[:,0]], '.', color = "k", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][1]))
     ax0.set_ylabel("# cell", color="k", fontsize=labelsize)
     ax0.set_xlabel("Time [ms]", fontsize=labelsize)
     ax0.tick_params(labelsize=labelsize, pad=10, axis ='x')
     ax0.tick_params(labelsize=labelsize, axis ='y')
-    ax0.set_yticks([0,80])
-    ax0.set_ylim(0.0, 80.0)
-    x_min = 2000.0
-    x_max=6000.0
+    ax0.set_yticks([0,n_show])
+    ax0.set_ylim(0.0, n_show)
     ax0.set_xlim(x_min, x_max)
-    ax0.set_yticklabels(['0','80'])
+    ax0.set_yticklabels(['0',str(n_show)])
     ax0.text(-0.095,1.0,panel, transform=ax0.transAxes, weight="bold", fontsize=labelsize+3)
     ax02=ax0.twinx()
     ax02.set_navigate(False)
     if(stp==True):
         ax02.plot(t, x, 'r', linewidth = 2.5, label="x")
         ax02.plot(t, u, "b", linewidth = 2.5, label="u")
+        if bands is not None:
+            ax02.fill_between(t, bands["x"][0], bands["x"][1], color="r", alpha=0.2, linewidth=0)
+            ax02.fill_between(t, bands["u"][0], bands["u"][1], color="b", alpha=0.2, linewidth=0)
         ax02.set_ylim(0,1.0)
     
     #ax02.set_ylabel("x, u", fontsize=labelsize)
@@ -197,30 +183,15 @@ def figure2(stp = False, t=[], x=[], u=[], panel="A"):
 
     # spontaneous rate
     t_start2 = simulation_params["recording_params"]["spike_recording_params"]["start"] + 450.0
-    t_stop2 = network_params["item_loading"]["origin"][0]
+    t_stop2 = stimuli.first_onset("item_loading")
     # delay period
-    t_start1 = network_params["item_loading"]["origin"][0] + network_params["stimulation_params"]["T_cue"]
-    if("nonspecific_readout_signals" in network_params):
-        t_stop1 = network_params["nonspecific_readout_signals"]["origin"][0]
-    elif("nonspecific_noise" in network_params):
-        t_stop1 = network_params["nonspecific_noise"]["origin"][0]
-    elif("nonspecific_readout_signals" in network_params and "nonspecific_noise" in network_params):
-        t_stop1 = min(network_params["nonspecific_readout_signals"]["origin"][0], network_params["nonspecific_noise"]["origin"][0])
-    else:
-        t_stop1 = simulation_params["eta_end_origin"]
+    t_start1, t_stop1 = delay_period()
 
     # put arrows indicating spontaneous activity and delay periods
     ax0.hlines(y=0.0, xmin=t_start1, xmax=t_stop1, color="orange", linewidth=7)
     ax0.hlines(y=0.0, xmin=t_start2, xmax=t_stop2, color="skyblue", linewidth=7)
 
-    occurrencies1 = firing_rate(t_start1, t_stop1)
-    occurrencies2 = firing_rate(t_start2, t_stop2)
-    SE = sr0
-    dum = int(np.min(SE[:,0]))
-    N_neurons_recorded = int(network_params["N_exc"]*network_params["f"]*simulation_params["recording_params"]["fraction_pop_recorded"])
-    ids = np.arange(dum,dum+N_neurons_recorded)
-    delta_fr = [[id, occurrencies1[id-1][1]-occurrencies2[id-1][1]] for id in ids]
-    df_hist = [delta_fr[i-1][1] for i in ids]
+    df_hist = firing_rate_hist(t_start1, t_stop1, t_start2, t_stop2, plot=False)
     counts, bins = np.histogram(df_hist, bins=40, range=(-5,15))
     norm = np.sum(counts)
     counts = [counts[i]/norm for i in range(len(counts))]
@@ -247,41 +218,22 @@ def figure3(stp=False, stp0= [], stp1 =[], panel="A"):
     titlesize=20
     f, (ax0) = plt.subplots(1, 1, figsize=(15,6.))
 
-    for i in range(network_params["item_loading"]["nstim"]):
-        if(i==0):
-            ax0.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], 0, 0.5, alpha=0.5, color='grey', label="Item Loading")
-        else:
-            ax0.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], 0.5, 1, alpha=0.5, color='grey')
-    if("nonspecific_readout_signals" in network_params):
-        for i in range(network_params["nonspecific_readout_signals"]["nstim"]):
-            if(i==0):
-                ax0.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='lightgrey', label="Readout signal")
-            else:
-                ax0.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='lightgrey')
-    if("nonspecific_noise" in network_params):
-        for i in range(network_params["nonspecific_noise"]["nstim"]):
-            if(i==0):
-                ax0.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise', label="Noise")
-            else:
-                ax0.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise')
-    if("periodic_sequence" in network_params):
-            for i in range(len(network_params["periodic_sequence"]["times"])):
-                if(i==0):
-                    ax0.axvspan(network_params["periodic_sequence"]["times"][i], network_params["periodic_sequence"]["times"][i]+network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey', label="Periodic stimuli")
-                else:
-                    ax0.axvspan(network_params["periodic_sequence"]["times"][i], network_params["periodic_sequence"]["times"][i]+network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey')
-
-    ax0.plot(sr0[:,1], sr0[:,0]-[720 for i in sr0[:,0]], '.', color = "limegreen", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][0]))
-    ax0.plot(sr1[:,1], sr1[:,0]-[720 for i in sr1[:,0]], '.', color = "k", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][1]))
+    shade_stimuli(ax0, stimuli, {"item_loading": {"color": "grey", "label": "Item Loading", "band": lambda ev: (0.5*ev.target, 0.5*(ev.target+1))},
+                                 "nonspecific_readout_signal": {"color": "lightgrey", "label": "Readout signal"},
+                                 "nonspecific_noise": {"color": "turquoise", "label": "Noise"},
+                                 "periodic_sequence": {"color": "lightgrey", "label": "Periodic stimuli"}}, 2000.0, 8000.0)
+
+    ax0.plot(sr0[:,1], sr0[:,0]-[n_E-n_show for i in sr0[:,0]], '.', color = "limegreen", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][0]))
+    ax0.plot(sr1[:,1], sr1[:,0]-[n_E-n_show for i in sr1[:,0]], '.', color = "k", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][1]))
     ax0.set_ylabel("# cell", color="k", fontsize=labelsize)
     ax0.set_xlim(2000.0, 8000.0)
     if network_params["overlap"]:
         ax0.set_xlim(2000.0, 8000.0)
     ax0.tick_params(labelsize=labelsize, pad=10, axis ='x')
     ax0.tick_params(labelsize=labelsize, axis ='y')
-    ax0.set_yticks([0,80,160])
-    ax0.set_yticklabels(['0','80', '160'])
-    ax0.set_ylim(0.0, 160.0)
+    ax0.set_yticks([0,n_show,2*n_show])
+    ax0.set_yticklabels(['0',str(n_show), str(2*n_show)])
+    ax0.set_ylim(0.0, 2*n_show)
     if network_params["overlap"]==False:
         ax0.text(-0.095,1.0,panel, transform=ax0.transAxes, weight="bold", fontsize=labelsize+3)
     ax02=ax0.twinx()
@@ -313,64 +265,28 @@ def figure3(stp=False, stp0= [], stp1 =[], panel="A"):
     plt.savefig(simulation_params['data_path']+"fig3{panel}.png".format(panel=panel))
 
 
-def figure4(stp=False, stp0= [], stp1 =[], stp2 = []):
+def figure4(stp=False, stp0= [], stp1 =[], stp2 = [], mode = "auto"):
     labelsize=19
     titlesize=20
     f, (ax0) = plt.subplots(1, 1, figsize=(15,9.))
 
-    for i in range(network_params["item_loading"]["nstim"]):
-        if(i==0):
-            ax0.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], 0, 0.33, alpha=0.5, color='grey', label="Item Loading")
-        elif(i==1):
-            ax0.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], 0.33, 0.66, alpha=0.5, color='grey')
-        else:
-            ax0.axvspan(network_params["item_loading"]["origin"][i], network_params["item_loading"]["origin"][i]+network_params["stimulation_params"]["T_cue"], 0.66, 1., alpha=0.5, color='grey')
-    if("nonspecific_readout_signals" in network_params):
-        for i in range(network_params["nonspecific_readout_signals"]["nstim"]):
-            if(i==0):
-                ax0.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='lightgrey', label="Readout signal")
-            else:
-                ax0.axvspan(network_params["nonspecific_readout_signals"]["origin"][i], network_params["nonspecific_readout_signals"]["origin"][i]+network_params["stimulation_params"]["T_reac"], alpha=0.5, color='lightgrey')
-    if("nonspecific_noise" in network_params):
-        for i in range(network_params["nonspecific_noise"]["nstim"]):
-            if(i==0):
-                ax0.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise', label="Noise")
-            else:
-                ax0.axvspan(network_params["nonspecific_noise"]["origin"][i], network_params["nonspecific_noise"]["origin"][i]+network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise')
-    if("periodic_sequence" in network_params):
-            for i in range(len(network_params["periodic_sequence"]["times"])):
-                if(i==0):
-                    ax0.axvspan(network_params["periodic_sequence"]["times"][i], network_params["periodic_sequence"]["times"][i]+network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey', label="Periodic stimuli")
-                else:
-                    ax0.axvspan(network_params["periodic_sequence"]["times"][i], network_params["periodic_sequence"]["times"][i]+network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey')
-
-    x0 = []; y0 = []
-    x1 = []; y1 = []
-    x2 = []; y2 = []
-
-    for i in range(len(sr0[:,1])):
-        if(sr0[i,0]<80):
-            x0.append(sr0[i,1])
-            y0.append(sr0[i,0])
-    for i in range(len(sr1[:,1])):
-        if(sr1[i,0]<880):
-            x1.append(sr1[i,1])
-            y1.append(sr1[i,0] - 720)
-    for i in range(len(sr2[:,1])):
-        if(sr2[i,0]<1680):
-            x2.append(sr2[i,1])
-            y2.append(sr2[i,0] - 1440)
-        
-    ax0.plot(x0, y0, '.', color = "limegreen", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][0]))
-    ax0.plot(x1, y1, '.', color = "k", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][1]))
-    ax0.plot(x2, y2, '.', color = "steelblue", label="Sel Pop {}".format(simulation_params["recording_params"]["pop_recorded"][1]))
+    shade_stimuli(ax0, stimuli, {"item_loading": {"color": "grey", "label": "Item Loading", "band": lambda ev: [(0, 0.33), (0.33, 0.66), (0.66, 1.)][min(ev.target, 2)]},
+                                 "nonspecific_readout_signal": {"color": "lightgrey", "label": "Readout signal"},
+                                 "nonspecific_noise": {"color": "turquoise", "label": "Noise"},
+                                 "periodic_sequence": {"color": "lightgrey", "label": "Periodic stimuli"}}, 1500.0, 11000.0)
+
+    colors = ["limegreen", "k", "steelblue"]
+    pops = simulation_params["recording_params"]["pop_recorded"]
+    layers = [dict(shown_spikes(sr, i, n_show), color=colors[i], label="Sel Pop {}".format(pops[i] if i < len(pops) else i))
+              for i, sr in enumerate([sr0, sr1, sr2])]
+    draw_raster(ax0, layers, 1500.0, 11000.0, mode)
     ax0.set_ylabel("# cell", color="k", fontsize=labelsize)
     ax0.set_xlim(1500.0, 11000.0)
     ax0.tick_params(labelsize=labelsize, pad=10, axis ='x')
     ax0.tick_params(labelsize=labelsize, axis ='y')
-    ax0.set_yticks([0,80,160,240])
-    ax0.set_yticklabels(['0','80', '160', '240'])
-    ax0.set_ylim(0.0, 240.0)
+    ax0.set_yticks([0,n_show,2*n_show,3*n_show])
+    ax0.set_yticklabels(['0',str(n_show), str(2*n_show), str(3*n_show)])
+    ax0.set_ylim(0.0, 3*n_show)
     #ax0.text(-0.095,1.0,panel, transform=ax0.transAxes, weight="bold", fontsize=labelsize+3)
     ax02=ax0.twinx()
     ax02.set_navigate(False)
@@ -414,96 +330,127 @@ def evolution(t_start = 0.0, t_stop = 1.0, x_start = 1.0, u_start = 0.3, dt = 0.
     return(t,x,u)
 
 
-def save_stp_data(npop):
-    record_interval = simulation_params["recording_params"]["stp_record_interval"]
-    sim_steps = np.arange(record_interval, simulation_params["t_sim"]+record_interval, record_interval)
-    stp_pop_rec = simulation_params["recording_params"]["stp_pop_recorded"]
-    fn = "stp_params_tot_"+str(npop)+".csv"
-    lenght = int(network_params["N_exc"]*network_params["f"]*simulation_params["recording_params"]["stp_fraction_recorded"])
-    xtot = np.zeros((lenght, len(sim_steps)))
-    utot = np.zeros((lenght, len(sim_steps)))
-    t_last_spike = np.zeros((lenght, len(sim_steps)+1))
-    
-    df = pd.read_csv(data_path + "stp_params/" + fn)
+def load_stp_data(npop):
+    """
+    Loads the STP recording of population npop from the columnar store written by the model.
+    Returns the (neuron x time) arrays of x, u and of the last spike times, the latter with
+    an additional last column equal to the simulation time.
+    """
+    rec = load_stp_recording(data_path + "stp_params/", npop)
+    xtot = rec["x"].T
+    utot = rec["u"].T
+    t_last_spike = np.concatenate([rec["t_last_spike"].T, np.full((len(rec["source"]), 1), simulation_params["t_sim"])], axis=1)
 
-    for step, time in enumerate(sim_steps):
-        dum = df[df["time"] == time]
-        t_last_spike[:, step] = list(dum["t_last_spike"])
-        xtot[:, step] = list(dum["x"])
-        utot[:, step] = list(dum["u"])
-    
-    t_last_spike[:, step+1] = [simulation_params["t_sim"] for i in range(len(dum["t_last_spike"]))]
-            
-    np.savetxt(data_path + "stp_params/" + "std_x_"+str(npop)+".dat", xtot)
-    np.savetxt(data_path + "stp_params/" + "std_u_"+str(npop)+".dat", utot)
-    np.savetxt(data_path + "stp_params/" + "stp_t_last_spike_"+str(npop)+".dat", t_last_spike)
+    return(xtot, utot, t_last_spike)
 
 
-def get_stp_data_evol(xtot, utot, t_last):
-    record_interval = simulation_params["recording_params"]["stp_record_interval"]
-    sim_steps = np.arange(record_interval, simulation_params["t_sim"]+record_interval, record_interval)
+def stp_segments(xtot, utot, t_last):
+    # segments of the traces of x and u of the recorded neurons on the 0.1 ms grid. The segments of a neuron
+    # start at the recording steps at which x changes (the first one at step 0); in each of them x and u
+    # relax towards 1 and U from their recorded values, starting at the (rounded) last spike time.
+    # The samples of a segment are the ones of np.arange(t_start, t_stop, 0.1) and the trace of a neuron
+    # is made of the first samples of its segments, one after the other.
     lenght = int(network_params["N_exc"]*network_params["f"]*simulation_params["recording_params"]["stp_fraction_recorded"])
-    t = np.arange(0.0, simulation_params["t_sim"], 0.1)
-    xnew = np.ones((lenght, len(t)))
-    unew = np.ones((lenght, len(t)))
-    for row in range(lenght):
-        print("{}/{}".format(row, lenght), end = '\r')
-        x = xtot[row,:]
-        u = utot[row,:]
-        t_last[row][0] = 0.0   
-        diffx = np.diff(x)
-        diffx_null = (diffx != 0)
-        ids = []
-        for i in range(len(diffx_null)):
-            if diffx_null[i]:
-                ids.append(i)
-
-        ids.append(len(diffx_null))
-        ids[0]=0
-        times = []
-        x1 = []
-        u1 = []
-        for i in ids:
-            times.append(round(t_last[row][i],1))
-            x1.append(x[i])
-            u1.append(u[i])
-
-        times.append(simulation_params["t_sim"])
-
-        x2 = np.asarray([])
-        u2 = np.asarray([])
-        for timestep in range(len(times)-1):
-            t_start = times[timestep]
-            t_stop = times[timestep+1]
-            x_start = x1[timestep]
-            u_start = u1[timestep]
-            tdum, xdum, udum = evolution(t_start, t_stop, x_start, u_start)
-            x2 = np.concatenate([x2, xdum], axis=0)
-            u2 = np.concatenate([u2, udum], axis=0)
-        
-        xnew[row,:] = x2[0:len(t)]
-        unew[row,:] = u2[0:len(t)]
+    t_sim = simulation_params["t_sim"]
+    n_t = len(np.arange(0.0, t_sim, 0.1))
+    n_steps = xtot.shape[1]
+    t_last[0:lenght, 0] = 0.0
+    # steps after which x changes and last step, sorted by neuron and step
+    rows, cols = np.nonzero(np.diff(xtot[0:lenght], axis=1) != 0)
+    rows = np.concatenate([rows, np.arange(lenght)])
+    cols = np.concatenate([cols, np.full(lenght, n_steps - 1)])
+    order = np.lexsort((cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    first = np.concatenate([[True], rows[1:] != rows[:-1]])
+    last = np.concatenate([rows[1:] != rows[:-1], [True]])
+    cols[first] = 0
+    seg_start = np.round(t_last[rows, cols], 1)
+    seg_stop = np.where(last, t_sim, np.roll(seg_start, -1))
+    n = np.maximum(np.ceil((seg_stop - seg_start)/0.1), 0).astype(np.int64)
+    offset = np.cumsum(n) - n
+    if np.any(np.add.reduceat(n, np.nonzero(first)[0]) < n_t):
+        raise ValueError("The STP recording does not cover the whole simulation.")
+    return({"start": seg_start,
+            # np.arange(t_start, t_stop, dt) gives t_start, t_start + dt, t_start + k*(t_start + dt - t_start)
+            "step": (seg_start + 0.1) - seg_start,
+            "offset": offset,
+            "row_offset": offset[first],
+            "x": xtot[rows, cols],
+            "u": utot[rows, cols],
+            "n_t": n_t})
+
+
+def stp_traces(segs, rows, j0, j1):
+    # x and u of the recorded neurons rows at the steps [j0, j1) of the 0.1 ms grid
+    g = (segs["row_offset"][rows][:, None] + np.arange(j0, j1)[None, :]).ravel()
+    seg = np.searchsorted(segs["offset"], g, side="right") - 1
+    k = g - segs["offset"][seg]
+    t_start = segs["start"][seg]
+    dt = t_start + k*segs["step"][seg]
+    k1 = k == 1
+    dt[k1] = t_start[k1] + 0.1
+    dt -= t_start
+    shape = (len(rows), j1 - j0)
+    x = (1.0 + (segs["x"][seg] - 1.0)*np.exp(-dt/tauD)).reshape(shape)
+    u = (U + (segs["u"][seg] - U)*np.exp(-dt/tauF)).reshape(shape)
+    return(x, u)
+
+
+def get_stp_data_evol(xtot, utot, t_last, block = 64):
+    # (neuron x time) arrays of x and u of the recorded neurons on the 0.1 ms grid, computed for blocks of neurons
+    segs = stp_segments(xtot, utot, t_last)
+    lenght = len(segs["row_offset"])
+    xnew = np.ones((lenght, segs["n_t"]))
+    unew = np.ones((lenght, segs["n_t"]))
+    for r0 in range(0, lenght, block):
+        r1 = min(r0 + block, lenght)
+        xnew[r0:r1], unew[r0:r1] = stp_traces(segs, np.arange(r0, r1), 0, segs["n_t"])
 
     return(xnew, unew)
 
 
-def stp_data(npop):
+def stp_stats(npop, std = False, percentiles = ()):
+    # population statistics of x, u and u*x (mean and, optionally, standard deviation and percentiles over
+    # the neurons) computed in blocks of time steps, without the (neuron x time) arrays of get_stp_data_evol
     sim_steps = np.arange(0.0, simulation_params["t_sim"], 0.1)
-    xtot = np.loadtxt(data_path + "stp_params/" + "std_x_"+str(npop)+".dat")
-    utot = np.loadtxt(data_path + "stp_params/" + "std_u_"+str(npop)+".dat")
-    t_last = np.loadtxt(data_path + "stp_params/" + "stp_t_last_spike_"+str(npop)+".dat")
+    if simulation_params["recording_params"]["stp_recording"]:
+        xtot, utot, t_last = load_stp_data(npop)
+        segs = stp_segments(xtot, utot, t_last)
+        rows = np.arange(len(segs["row_offset"]))
+        traces = lambda i0, i1: stp_traces(segs, rows, i0, i1)
+        block_size = max(1, 2000000//len(rows))
+        stats = stp_reconstruction.population_stats(traces, len(sim_steps), block_size, std, percentiles)
+    else:
+        rec = stp_reconstruction.from_spike_data(data_path, npop)
+        stats = rec.population_stats(sim_steps, max(1, 2000000//rec.n_neurons), std, percentiles)
+
+    return(sim_steps, stats)
+
 
-    xnew, unew = get_stp_data_evol(xtot, utot, t_last)
+def stp_data(npop):
+    sim_steps, stats = stp_stats(npop)
+
+    return(sim_steps, stats["x"]["mean"], stats["u"]["mean"])
 
-    xavg = np.zeros(len(sim_steps))
-    uavg = np.zeros(len(sim_steps))
-    for i in range(len(sim_steps)):
-        xavg[i] = np.mean(xnew[:,i])
-        uavg[i] = np.mean(unew[:,i])
+
+def stp_data_from_spikes(npop):
+    """
+    Population average of x and u reconstructed from the spike data of population npop,
+    so that the STP recording during the simulation is not needed.
+    """
+    sim_steps = np.arange(0.0, simulation_params["t_sim"], 0.1)
+    rec = stp_reconstruction.from_spike_data(data_path, npop)
+    xavg, uavg = rec.population_mean(sim_steps)
 
     return(sim_steps, xavg, uavg)
 
 
+def stp_data_parallel(npops):
+    # STP data of several populations, computed concurrently in threads
+    # (the NumPy operations release the GIL, and the data of the script are shared)
+    with ThreadPoolExecutor(max_workers=len(npops)) as executor:
+        return(list(executor.map(get_stp_data, npops)))
 
 
 data_path = os.path.join(os.getcwd(), "data/")
@@ -517,6 +464,14 @@ with open(data_path+'network_params.json', 'r') as f:
 with open(data_path+'simulation_params.json', 'r') as f:
     simulation_params = json.load(f)
 
+# timeline of the stimuli
+stimuli = StimulusTimeline.from_network_params(network_params)
+
+# layout of the raster plots, derived from the size of the (possibly scaled) network:
+# neurons of a selective population and neurons shown for each population in the figures
+n_E = int(network_params["N_exc"]*network_params["f"])
+n_show = int(0.1*n_E)
+
 
 tauD = network_params["stp_params"]["tau_D"]
 tauF = network_params["stp_params"]["tau_F"]
@@ -526,27 +481,31 @@ U = network_params["stp_params"]["U"]
 # loading spike data
 overlap = network_params["overlap"]
 srs = load_spike_data(overlap)
-sr0 = srs[0]
-sr1 = srs[1]
-sr2 = srs[2]
-sr3 = srs[3]
-sr4 = srs[4]
+# populations used in the figures (empty if not recorded)
+sr0, sr1, sr2 = [srs[i] if i < len(srs) else np.zeros((0, 2)) for i in range(3)]
 
 raster_plot()
+# population rates of the online rate monitor, if enabled in the simulation
+if simulation_params.get("rate_monitor") is not None:
+    population_rate_plot()
 
 figure = 2
-stp = simulation_params["recording_params"]["stp_recording"]
+# plot STP variables
+stp = True
+# shade the 10th-90th percentile band of x and u over the neurons (Figure 2)
+stp_bands = False
 panel = "B"
 
+# STP data are taken from the STP recording if available, otherwise they are reconstructed from the spike data
+if simulation_params["recording_params"]["stp_recording"]:
+    get_stp_data = stp_data
+else:
+    get_stp_data = stp_data_from_spikes
+
 
 if figure == 4:
     if stp:
-        save_stp_data(0)
-        save_stp_data(1)
-        save_stp_data(2)
-        t0, x0, u0 = stp_data(0)
-        t1, x1, u1 = stp_data(1)
-        t2, x2, u2 = stp_data(2)
+        (t0, x0, u0), (t1, x1, u1), (t2, x2, u2) = stp_data_parallel([0, 1, 2])
         figure4(stp, stp0 = [t0, x0, u0], stp1 = [t1, x1, u1], stp2 = [t2, x2, u2])
     else:
         print("Please load correct data.")
@@ -555,19 +514,19 @@ if figure == 4:
 
 if figure == 3:
     if stp:
-        save_stp_data(0)
-        save_stp_data(1)
-        t0, x0, u0 = stp_data(0)
-        t1, x1, u1 = stp_data(1)
+        (t0, x0, u0), (t1, x1, u1) = stp_data_parallel([0, 1])
         figure3(stp, stp0 = [t0, x0, u0], stp1 = [t1, x1, u1], panel=panel)
     else:
         figure3(stp, panel=panel)
 
 
 if figure == 2:
-    if stp:
-        save_stp_data(0)
-        t, x, u = stp_data(0)
+    if stp and stp_bands:
+        t, stats = stp_stats(0, percentiles=[10, 90])
+        figure2(stp = True, t=t, x=stats["x"]["mean"], u=stats["u"]["mean"], panel=panel,
+                bands={var: (stats[var]["p10"], stats[var]["p90"]) for var in ["x", "u"]})
+    elif stp:
+        t, x, u = get_stp_data(0)
         figure2(stp = True, t=t, x=x, u=u, panel=panel)
     else:
         figure2(stp = False, panel=panel)
@@ -0,0 +1,109 @@
+"""
+Build time of the network for increasing number of memories
+-----------------------------------------------------------
+
+Measures the time needed to generate and connect the recurrent connectivity
+for increasing numbers of memories p, keeping the fraction of selective
+neurons p*f fixed (i.e. f = coverage/p). For each p the NumPy generation of
+model/connectivity.py is timed, and if NEST is available the whole network
+build is timed with both connection methods ("nest" and "arrays").
+
+Type
+
+    python3 benchmarks/build_time.py [--p 5 50 200] [--coverage 0.5] [--no-nest] [--output FILE]
+
+from the repository root. The results are printed as a table and, if
+--output is given, saved in JSON format.
+
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+from copy import deepcopy
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model.default_params import default_network_params, default_simulation_params
+from model.connectivity import generate_connectivity
+
+
+def network_spec(p, coverage):
+    """
+    Returns the network parameters with p memories covering the fraction coverage of the excitatory neurons.
+
+    """
+    return {"p": p, "f": coverage/p}
+
+
+def time_generation(p, coverage, seed):
+    """
+    Times the NumPy generation of the connectivity of a network with p memories.
+
+    """
+    net = deepcopy(default_network_params)
+    net.update(network_spec(p, coverage))
+    N_exc = net["N_exc"]
+    n_sel = int(net["f"]*N_exc)
+    # non-overlapping populations as in WMModel.create_populations
+    exc_populations = [np.arange(i*n_sel, (i+1)*n_sel) + 1 for i in range(p)] + [np.arange(p*n_sel, N_exc) + 1]
+    inh_ids = np.arange(N_exc, N_exc + net["N_inh"]) + 1
+    t0 = time.perf_counter()
+    classes, arrays = generate_connectivity(exc_populations, inh_ids, net, default_simulation_params["dt"],
+                                            np.random.default_rng(seed))
+    return time.perf_counter() - t0, len(arrays["source"])
+
+
+def time_build(p, coverage, method, threads):
+    """
+    Times the build of a network with p memories with the given connection method.
+
+    """
+    from model.model import WMModel
+    sim_spec = {"data_path": tempfile.mkdtemp(prefix="build_time_") + "/",
+                "threads": threads,
+                "confirm_overwrite": False,
+                "connectivity_cache": False,
+                "connection_method": method}
+    network = WMModel(network_spec(p, coverage), sim_spec)
+    network.add_background_input(start=0.0, stop=default_simulation_params["t_sim"])
+    t0 = time.perf_counter()
+    network.build_network()
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--p", type=int, nargs="+", default=[5, 20, 50, 100, 200], help="numbers of memories")
+    parser.add_argument("--coverage", type=float, default=0.5, help="fraction of excitatory neurons in selective populations (p*f)")
+    parser.add_argument("--threads", type=int, default=default_simulation_params["threads"], help="number of NEST threads")
+    parser.add_argument("--no-nest", action="store_true", help="time only the NumPy generation")
+    parser.add_argument("--output", default=None, help="JSON file in which the results are saved")
+    args = parser.parse_args()
+
+    has_nest = not args.no_nest
+    if has_nest and importlib.util.find_spec("nest") is None:
+        print("NEST not available, timing only the NumPy generation.")
+        has_nest = False
+
+    results = []
+    print("{:>6} {:>12} {:>14} {:>14} {:>14}".format("p", "connections", "generation [s]", "build nest [s]", "build arrays [s]"))
+    for p in args.p:
+        res = {"p": p, "f": args.coverage/p}
+        res["generation_time"], res["n_connections"] = time_generation(p, args.coverage, default_simulation_params["master_seed"])
+        if has_nest:
+            res["build_time_nest"] = time_build(p, args.coverage, "nest", args.threads)
+            res["build_time_arrays"] = time_build(p, args.coverage, "arrays", args.threads)
+        results.append(res)
+        print("{:>6} {:>12} {:>14.3f} {:>14} {:>14}".format(p, res["n_connections"], res["generation_time"],
+              "{:.3f}".format(res["build_time_nest"]) if has_nest else "-",
+              "{:.3f}".format(res["build_time_arrays"]) if has_nest else "-"))
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1)
@@ -0,0 +1,78 @@
+"""
+Import-time budget of the model package
+---------------------------------------
+
+Measures the time needed to import the model modules in a fresh Python
+interpreter and checks that no heavy dependency (NEST, NESTML, matplotlib,
+pandas) is loaded at import time.
+
+Type
+
+    python3 benchmarks/import_time.py [--budget SECONDS] [--repeat N]
+
+from the repository root. The script exits with a non-zero status if the
+median import time exceeds the budget or if a heavy module is imported.
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# modules that must be imported only when they are actually needed
+HEAVY_MODULES = ["nest", "pynestml", "matplotlib", "pandas"]
+
+MODULES = ["model.default_params", "model.model_helpers", "model.model"]
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+probe = """
+import json, sys, time
+t0 = time.perf_counter()
+for m in {modules}:
+    __import__(m)
+t1 = time.perf_counter()
+heavy = [m for m in {heavy} if m in sys.modules]
+print(json.dumps({{"time": t1 - t0, "heavy": heavy}}))
+"""
+
+
+def measure(modules, repeat=5):
+    """
+    Imports modules in repeat fresh interpreters.
+
+    Returns the list of import times [s] and the heavy modules found in sys.modules.
+
+    """
+    times = []
+    heavy = set()
+    code = probe.format(modules=modules, heavy=HEAVY_MODULES)
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=repo_path,
+                             check=True, capture_output=True, text=True).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        times.append(res["time"])
+        heavy.update(res["heavy"])
+    return times, sorted(heavy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=0.5, help="maximum median import time [s]")
+    parser.add_argument("--repeat", type=int, default=5, help="number of fresh interpreters")
+    args = parser.parse_args()
+
+    times, heavy = measure(MODULES, args.repeat)
+    median = sorted(times)[len(times)//2]
+    print("Import of {}: median {:.1f} ms, min {:.1f} ms, max {:.1f} ms (budget {:.1f} ms)".format(
+        ", ".join(MODULES), 1000.0*median, 1000.0*min(times), 1000.0*max(times), 1000.0*args.budget))
+    ok = True
+    if heavy:
+        print("Heavy modules imported at import time: {}".format(", ".join(heavy)))
+        ok = False
+    if median > args.budget:
+        print("Import time budget exceeded.")
+        ok = False
+    sys.exit(0 if ok else 1)
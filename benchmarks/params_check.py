@@ -0,0 +1,73 @@
+"""
+Smoke check of the parameter handling
+-------------------------------------
+
+Constructs WMModel instances (without NEST, the network is not built) with
+custom parameters given as dicts, including the ones that are disabled by
+default (None) such as the rate monitor and the early stopping criteria,
+and checks the resulting parameters.
+
+Type
+
+    python3 benchmarks/params_check.py
+
+from the repository root. The script exits with a non-zero status if a check fails.
+
+"""
+
+import os
+import sys
+import tempfile
+import traceback
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model.model import WMModel
+
+
+def build(tmp, network_spec, sim_spec):
+    sim = {"data_path": os.path.join(tmp, "data", ""), "confirm_overwrite": False}
+    sim.update(sim_spec)
+    return WMModel(network_spec, sim)
+
+
+def check_rate_monitor(tmp):
+    monitor = {"bin_size": 5.0, "drain_interval": 100.0}
+    network = build(tmp, {}, {"rate_monitor": monitor})
+    assert network.simulation_params["rate_monitor"] == monitor
+
+
+def check_early_stop(tmp):
+    criteria = [{"type": "rate_below", "pop": 0, "threshold": 5.0, "duration": 300.0, "after": 1350.0, "name": "item_lost"}]
+    network = build(tmp, {}, {"early_stop": {"criteria": criteria}})
+    assert network.simulation_params["early_stop"]["criteria"] == criteria
+    # the rate monitor is enabled automatically
+    assert network.simulation_params["rate_monitor"] is not None
+
+
+def check_nested(tmp):
+    network = build(tmp, {"stp_params": {"U": 0.3}}, {"recording_params": {"pop_recorded": [0]}})
+    assert network.network_params["stp_params"]["U"] == 0.3
+    assert network.network_params["stp_params"]["tau_D"] == 200.0
+    assert network.simulation_params["recording_params"]["pop_recorded"] == [0]
+
+
+def check_unknown_key(tmp):
+    try:
+        build(tmp, {}, {"recording_params": {"unknown": 1}})
+    except KeyError:
+        return
+    raise AssertionError("unknown parameter accepted")
+
+
+if __name__ == "__main__":
+    failed = []
+    for check in [check_rate_monitor, check_early_stop, check_nested, check_unknown_key]:
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                check(tmp)
+            except Exception:
+                failed.append(check.__name__)
+                traceback.print_exc()
+    print("Parameter checks: {} failed".format(len(failed)) + (" ({})".format(", ".join(failed)) if failed else ""))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,198 @@
+"""
+Build and simulation benchmark suite
+------------------------------------
+
+Runs standard configurations of the model across thread counts and network
+scales and records, for every run, the time spent in each phase of the
+build (including each block of connections) and of the simulation
+(WMModel.timings), the time needed to save
+the spike data and to load them back as done by the analysis, the number
+of spikes recorded, the number of connections of each synapse model and
+the real time factor (simulation wall-clock time / simulated time).
+
+Configurations:
+
+    spontaneous   background input only
+    fig2b         item loading of population 0 (protocol of Fig 2B)
+    fig3a         item loading of populations 0 and 1, periodic readout and noise (protocol of Fig 3A)
+
+each run with STP recording and overlap of the selective populations on or off.
+
+Type
+
+    python3 benchmarks/suite.py [--configs fig2b] [--threads 1 4 8] [--scales 0.1 1.0]
+                                [--stp-recording 0 1] [--overlap 0 1] [--output FILE] [--compare FILE]
+
+from the repository root. The results are saved in JSON format together with
+a description of the machine. With --compare, the real time factors are
+compared with the ones of a previous result file and the script exits with
+a non-zero status if any of them got worse by more than --tolerance.
+
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_path)
+
+# presimulation time of the protocols [ms]
+T_PRESIM = 1000.0
+
+CONFIGS = {
+    "spontaneous": {"network_spec": {"eta_exc": 23.7},
+                    "t_sim": T_PRESIM + 2000.0,
+                    "protocol": []},
+    "fig2b": {"network_spec": {"eta_exc": 23.7, "stp_params": {"u0": 0.19}},
+              "t_sim": T_PRESIM + 3000.0,
+              "protocol": [{"method": "add_item_loading_signals", "kwargs": {"pop_id": [0], "origin": [T_PRESIM]}}]},
+    "fig3a": {"network_spec": {"eta_exc": 23.7, "stp_params": {"u0": 0.19}},
+              "t_sim": T_PRESIM + 6000.0,
+              "protocol": [{"method": "add_item_loading_signals", "kwargs": {"pop_id": [0, 1], "origin": [T_PRESIM, T_PRESIM+3000.0]}},
+                           {"method": "add_periodic_sequence", "kwargs": {"intervals": [[T_PRESIM+700.0, T_PRESIM+1300.0],
+                                                                                        [T_PRESIM+2000.0, T_PRESIM+2900.0],
+                                                                                        [T_PRESIM+3400.0, T_PRESIM+5000.0]]}},
+                           {"method": "add_random_nonspecific_noise", "kwargs": {"origin": [T_PRESIM+1550.0], "frac": 0.15}}]},
+}
+
+
+def machine_info():
+    """
+    Returns a description of the machine and of the software in use.
+
+    """
+    info = {"hostname": platform.node(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version()}
+    try:
+        from model.nestml_cache import _nest_version
+        info["nest"] = _nest_version()
+    except ImportError:
+        info["nest"] = None
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_path, check=True,
+                                        capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        info["commit"] = None
+    return info
+
+
+def run(config, scale, threads, stp_recording, overlap, data_root):
+    """
+    Runs a benchmark configuration and returns the dict of its results.
+
+    """
+    import nest
+    from model.model import WMModel
+    from model.spike_store import load_spikes
+
+    spec = CONFIGS[config]
+    res = {"config": config, "scale": scale, "threads": threads,
+           "stp_recording": stp_recording, "overlap": overlap, "t_sim": spec["t_sim"]}
+    network_spec = json.loads(json.dumps(spec["network_spec"]))
+    network_spec.update({"scale": scale, "overlap": overlap})
+    sim_spec = {"data_path": tempfile.mkdtemp(prefix="{}_".format(config), dir=data_root) + "/",
+                "threads": threads,
+                "t_sim": spec["t_sim"],
+                # the offset of the background input is not part of the protocols
+                "eta_end_origin": spec["t_sim"] + 1.0,
+                "confirm_overwrite": False,
+                "connectivity_cache": False,
+                "recording_params": {"stp_recording": stp_recording}}
+    t_start = time.time()
+    try:
+        network = WMModel(network_spec, sim_spec)
+        network.add_background_input(start=0.0, stop=spec["t_sim"])
+        for call in spec["protocol"]:
+            getattr(network, call["method"])(**call["kwargs"])
+        network.build_network()
+        network.simulate_network()
+        network.save_spike_data()
+        for pop_id in network.simulation_params["recording_params"]["pop_recorded"]:
+            network.timed("analysis_load", load_spikes, network.data_path, pop_id)
+
+        res["timings"] = network.timings
+        res["n_spikes"] = int(sum(sr.get("n_events") for sr in network.spike_recorders))
+        res["n_connections"] = {model: nest.GetDefaults(model, "num_connections") for model in ["stp_synapse", "static_synapse"]}
+        res["n_connections"]["total"] = nest.GetKernelStatus("num_connections")
+        res["real_time_factor"] = network.timings["simulate"]/(spec["t_sim"]/1000.0)
+        res["status"] = "done"
+    except Exception:
+        res["status"] = "failed"
+        res["error"] = traceback.format_exc()
+    res["wall_time"] = time.time() - t_start
+    return res
+
+
+def compare(results, reference, tolerance):
+    """
+    Compares the real time factors of results with the ones of the runs with the same
+    parameters in reference. Returns the list of the runs that got slower than allowed.
+
+    """
+    keys = ["config", "scale", "threads", "stp_recording", "overlap"]
+    ref = {tuple(r[k] for k in keys): r for r in reference if r.get("status") == "done"}
+    regressions = []
+    for r in results:
+        key = tuple(r[k] for k in keys)
+        if r.get("status") != "done" or key not in ref:
+            continue
+        ratio = r["real_time_factor"]/ref[key]["real_time_factor"]
+        if ratio > 1.0 + tolerance:
+            regressions.append((key, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS), help="configurations to be run")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4], help="numbers of NEST threads")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.1, 1.0], help="network scale factors")
+    parser.add_argument("--stp-recording", type=int, nargs="+", default=[0, 1], choices=[0, 1], help="STP recording off (0) and/or on (1)")
+    parser.add_argument("--overlap", type=int, nargs="+", default=[0, 1], choices=[0, 1], help="overlap off (0) and/or on (1)")
+    parser.add_argument("--data-root", default=None, help="directory in which the data of the runs are written (a temporary one by default)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file in which the results are saved")
+    parser.add_argument("--compare", default=None, help="JSON file of previous results to be compared with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative increase of the real time factor")
+    args = parser.parse_args()
+
+    data_root = args.data_root or tempfile.mkdtemp(prefix="wm_benchmark_")
+    os.makedirs(data_root, exist_ok=True)
+    output = {"machine": machine_info(), "results": []}
+    runs = list(itertools.product(args.configs, args.scales, args.threads, args.stp_recording, args.overlap))
+    for n, (config, scale, threads, stp_recording, overlap) in enumerate(runs):
+        print("\n##### BENCHMARK {}/{}: {}, scale {}, {} threads, STP recording {}, overlap {} #####".format(
+            n+1, len(runs), config, scale, threads, bool(stp_recording), bool(overlap)))
+        res = run(config, scale, threads, bool(stp_recording), bool(overlap), data_root)
+        output["results"].append(res)
+        # written after every run, so that partial results are kept
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=1)
+
+    print("\n{:>12} {:>6} {:>8} {:>4} {:>8} {:>10} {:>12} {:>10}".format("config", "scale", "threads", "stp", "overlap", "build [s]", "spikes", "RTF"))
+    for r in output["results"]:
+        if r["status"] != "done":
+            print("{:>12} {:>6} {:>8} {:>4} {:>8} failed".format(r["config"], r["scale"], r["threads"], int(r["stp_recording"]), int(r["overlap"])))
+            continue
+        build = r["timings"]["build_network"]
+        print("{:>12} {:>6} {:>8} {:>4} {:>8} {:>10.2f} {:>12} {:>10.3f}".format(r["config"], r["scale"], r["threads"], int(r["stp_recording"]),
+              int(r["overlap"]), build, r["n_spikes"], r["real_time_factor"]))
+
+    ok = all(r["status"] == "done" for r in output["results"])
+    if args.compare is not None:
+        with open(args.compare, 'r') as fp:
+            regressions = compare(output["results"], json.load(fp)["results"], args.tolerance)
+        for key, ratio in regressions:
+            print("Regression: {} is {:.0f}% slower.".format(key, 100.0*(ratio - 1.0)))
+        ok = ok and not regressions
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,222 @@
+"""
+Array-based generation of the recurrent connectivity
+====================================================
+
+Generates with NumPy the same connectivity as the fixed_indegree rules of
+WMModel.connect_populations: every neuron of a target group receives a
+fixed number of connections from each source group (J_p within a selective
+population, J_b across selective populations, a fraction gamma_0 of
+potentiated connections from the non-selective population, static
+connections from and to the inhibitory population).
+
+The sources of all the targets of a projection are drawn with a single
+vectorized call, and projections from the different selective populations
+onto all the selective targets are drawn together, so the number of Python
+calls grows linearly with the number of memories p (instead of the p*p
+nest.Connect calls of connect_populations) and the network is connected
+with one array-based nest.Connect call per connection class.
+
+The output has the format of the connectivity cache (see model/connectivity_cache.py).
+
+"""
+
+import numpy as np
+from model.model_helpers import get_weight
+
+# connection classes, i.e. the distinct (synapse model, weight) pairs of the network
+# (the names follow the ones of the efficacies, e.g. J_EI is the efficacy of I->E synapses)
+CLS_EE_P, CLS_EE_B, CLS_EI, CLS_IE_SEL, CLS_IE_NONSEL, CLS_II = range(6)
+
+
+def connection_classes(network_params):
+    """
+    Returns the list of the connection classes with the weights given by the network parameters.
+    The weights are computed as in WMModel.connect_populations.
+
+    """
+    syn = network_params["syn_params"]
+    tau = network_params["neur_params"]["tau"]
+    return [{"name": "exc_exc_potentiated", "synapse_model": "stp_synapse", "weight": get_weight(syn["J_p"], tau[0])},
+            {"name": "exc_exc_baseline", "synapse_model": "stp_synapse", "weight": get_weight(syn["J_b"], tau[0])},
+            {"name": "inh_exc", "synapse_model": "static_synapse", "weight": get_weight(-syn["J_EI"], tau[1])},
+            {"name": "sel_inh", "synapse_model": "static_synapse", "weight": get_weight(syn["J_IE"], tau[1])},
+            {"name": "nonsel_inh", "synapse_model": "static_synapse", "weight": get_weight(syn["J_IE"], tau[0])},
+            {"name": "inh_inh", "synapse_model": "static_synapse", "weight": get_weight(-syn["J_II"], tau[1])}]
+
+
+def indegrees(network_params):
+    """
+    Returns the indegrees of the fixed_indegree rules of WMModel.connect_populations, i.e. the number of
+    connections that a neuron receives from a selective population ('sel'), from the non-selective population
+    with baseline ('nonsel_b') and potentiated ('nonsel_p') efficacy (excitatory targets), from the
+    non-selective population (inhibitory targets, 'nonsel') and from the inhibitory population ('inh').
+    For a network scaled with indegree_scaling "fixed" the indegrees are the ones of the network with
+    scale 1.0, computed from its parameters (see WMModel.scale_network).
+
+    """
+    p = network_params["p"]
+    f = network_params["f"]
+    gamma_0 = network_params["syn_params"]["gamma_0"]
+    if "reference_params" in network_params and network_params["indegree_scaling"] == "fixed":
+        reference = network_params["reference_params"]
+    else:
+        reference = network_params
+    c = reference["c"]
+    N_exc = reference["N_exc"]
+    N_inh = reference["N_inh"]
+    return {"sel": int(f*c*N_exc),
+            "nonsel_b": int((1.0-gamma_0)*c*(1.0-f*p)*N_exc),
+            "nonsel_p": int(gamma_0*c*(1.0-f*p)*N_exc),
+            "nonsel": int(c*(1.0-f*p)*N_exc),
+            "inh": int(c*N_inh)}
+
+
+def fixed_indegree(rng, n_pool, n_rows, indegree, exclude=None, multapses=True):
+    """
+    Draws the sources of n_rows targets, each receiving indegree connections from a pool of n_pool neurons.
+
+    Parameters
+    ----------
+    rng : Generator
+        NumPy random generator.
+    n_pool : int
+        Number of neurons in the source pool.
+    n_rows : int
+        Number of targets.
+    indegree : int
+        Number of connections received by each target.
+    exclude : array
+        For each target, index in the pool that must not be drawn (i.e. the target itself, when
+        autapses are not allowed), -1 if the target is not in the pool. If None, all the neurons can be drawn.
+    multapses : bool
+        If False, each source is drawn at most once for each target.
+
+    Returns
+    -------
+    idx : ndarray
+        Array of shape (n_rows, indegree) with the indices of the sources in the pool.
+
+    """
+    n_allowed = n_pool - (1 if exclude is not None and np.any(exclude >= 0) else 0)
+    if indegree == 0 or n_rows == 0:
+        return np.zeros((n_rows, indegree), dtype=np.int64)
+    if n_allowed <= 0 or (not multapses and indegree > n_allowed):
+        raise ValueError("Indegree {} too large for a pool of {} neurons.".format(indegree, n_pool))
+
+    if not multapses and 2*indegree > n_pool:
+        # dense case, the first indegree elements of a random permutation of each row
+        keys = rng.random((n_rows, n_pool))
+        if exclude is not None:
+            rows = np.nonzero(exclude >= 0)[0]
+            keys[rows, exclude[rows]] = np.inf
+        return np.argpartition(keys, indegree - 1, axis=1)[:, :indegree]
+
+    idx = rng.integers(0, n_pool, size=(n_rows, indegree))
+    if exclude is None and multapses:
+        return idx
+    # rows in which forbidden sources may still be present, redrawn until none is left
+    rows = np.arange(n_rows)
+    while len(rows) > 0:
+        sub = idx[rows]
+        bad = np.zeros(sub.shape, dtype=bool)
+        if exclude is not None:
+            bad |= sub == exclude[rows, None]
+        if not multapses:
+            order = np.argsort(sub, axis=1, kind="stable")
+            s = np.take_along_axis(sub, order, axis=1)
+            dup = np.zeros(sub.shape, dtype=bool)
+            dup[:, 1:] = s[:, 1:] == s[:, :-1]
+            np.put_along_axis(bad, order, dup | np.take_along_axis(bad, order, axis=1), axis=1)
+        n_bad = int(bad.sum())
+        sub[bad] = rng.integers(0, n_pool, size=n_bad)
+        idx[rows] = sub
+        rows = rows[np.any(bad, axis=1)]
+    return idx
+
+
+def pool_position(pool, ids):
+    """
+    Returns the position of each of ids in the sorted array pool, -1 if it is not in the pool.
+
+    """
+    pos = np.clip(np.searchsorted(pool, ids), 0, max(len(pool) - 1, 0))
+    found = pool[pos] == ids if len(pool) > 0 else np.zeros(len(ids), dtype=bool)
+    return np.where(found, pos, -1)
+
+
+def generate_connectivity(exc_populations, inh_ids, network_params, dt, rng):
+    """
+    Generates the recurrent connectivity of the network.
+
+    Parameters
+    ----------
+    exc_populations : list
+        Sorted arrays with the ids of the neurons of the p selective populations, followed by
+        the one of the non-selective population (as WMModel.exc_populations).
+    inh_ids : array
+        Sorted ids of the inhibitory neurons.
+    network_params : dict
+        Network parameters.
+    dt : float
+        Simulation resolution [ms], the delays are returned in units of dt.
+    rng : Generator
+        NumPy random generator.
+
+    Returns
+    -------
+    classes : list
+        Connection classes (see connection_classes).
+    arrays : dict
+        Dict with the arrays 'source', 'target', 'delay' (in units of dt) and 'cls' of the connections.
+
+    """
+    p = network_params["p"]
+    syn = network_params["syn_params"]
+    multapses = syn["multapses"]
+    K_sel, K_nonsel_b, K_nonsel_p, K_nonsel, K_inh = (indegrees(network_params)[K] for K in
+                                                      ["sel", "nonsel_b", "nonsel_p", "nonsel", "inh"])
+
+    exc_populations = [np.asarray(pop, dtype=np.int64) for pop in exc_populations]
+    inh_ids = np.asarray(inh_ids, dtype=np.int64)
+    nonsel = exc_populations[-1]
+    # all the targets in the selective populations, a neuron belonging to more populations
+    # receives the inputs of each of them as in connect_populations
+    sel_targets = np.concatenate(exc_populations[:p]) if p > 0 else np.zeros(0, dtype=np.int64)
+    sel_target_pop = np.repeat(np.arange(p), [len(pop) for pop in exc_populations[:p]])
+
+    parts = []
+
+    def project(pool, targets, indegree, cls):
+        exclude = None if syn["autapses"] else pool_position(pool, targets)
+        idx = fixed_indegree(rng, len(pool), len(targets), indegree, exclude, multapses)
+        source = pool[idx].ravel()
+        target = np.repeat(targets, indegree)
+        cls = np.repeat(np.broadcast_to(cls, len(targets)), indegree)
+        parts.append((source, target, cls))
+
+    # selective targets: J_p from their own population, J_b from the others,
+    # one draw for every source population onto all the selective targets
+    for j in range(p):
+        project(exc_populations[j], sel_targets, K_sel, np.where(sel_target_pop == j, CLS_EE_P, CLS_EE_B))
+    project(nonsel, sel_targets, K_nonsel_b, CLS_EE_B)
+    project(nonsel, sel_targets, K_nonsel_p, CLS_EE_P)
+    project(inh_ids, sel_targets, K_inh, CLS_EI)
+
+    # inhibitory targets
+    for j in range(p):
+        project(exc_populations[j], inh_ids, K_sel, CLS_IE_SEL)
+    project(nonsel, inh_ids, K_nonsel, CLS_IE_NONSEL)
+    project(inh_ids, inh_ids, K_inh, CLS_II)
+
+    # non-selective targets
+    for j in range(p):
+        project(exc_populations[j], nonsel, K_sel, CLS_EE_B)
+    project(nonsel, nonsel, K_nonsel_b, CLS_EE_B)
+    project(nonsel, nonsel, K_nonsel_p, CLS_EE_P)
+    project(inh_ids, nonsel, K_inh, CLS_EI)
+
+    source = np.concatenate([part[0] for part in parts])
+    target = np.concatenate([part[1] for part in parts])
+    cls = np.concatenate([part[2] for part in parts]).astype(np.uint8)
+    delay = np.rint(rng.uniform(syn["delay"][0], syn["delay"][1], size=len(source))/dt)
+    return connection_classes(network_params), {"source": source, "target": target, "delay": delay, "cls": cls}
@@ -0,0 +1,187 @@
+"""
+Persistent cache for the recurrent connectivity
+===============================================
+
+For a given set of structural parameters (population sizes, connection
+probability, selective populations, synaptic parameters, master seed and
+resolution) the NumPy generation of model/connectivity.py (connection_method
+"arrays") produces exactly the same graph on every run. This module stores the
+generated connectivity on disk, in a directory keyed by a hash of these
+parameters and of the NEST version, so that later builds (e.g. the points of a
+sweep over eta_exc, u0 or the stimulus timing) connect the network in bulk from
+the stored arrays instead of generating the connections again. Since the
+generation does not use the random generators of the NEST kernel, a build from
+the cache draws the same kernel random numbers (delays of the external inputs,
+noise) as the build that stored it.
+
+Each cache entry contains a JSON manifest with the connection classes, i.e.
+the distinct (synapse model, weight) pairs, and the arrays
+
+    source.npy   source id of each connection
+    target.npy   target id of each connection
+    delay.npy    delay of each connection in units of the resolution
+    cls.npy      index of the connection class of each connection
+
+The cache directory defaults to ``~/.cache/wm_spiking_network/connectivity``
+and can be changed through the environment variable ``WM_CONNECTIVITY_CACHE``.
+Its size is capped (10 GB by default, or the number of GB given by the
+environment variable ``WM_CONNECTIVITY_CACHE_MAX_GB``): after an entry is
+stored, the least recently used entries are removed until the cache fits.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+CONNECTIVITY_CACHE_DIR = os.environ.get("WM_CONNECTIVITY_CACHE",
+                                        os.path.join(os.path.expanduser("~"), ".cache", "wm_spiking_network", "connectivity"))
+
+# maximum size of the cache [bytes]
+CONNECTIVITY_CACHE_MAX_BYTES = float(os.environ.get("WM_CONNECTIVITY_CACHE_MAX_GB", 10.0))*1e9
+
+CONNECTIVITY_ARRAYS = ["source", "target", "delay", "cls"]
+
+
+def cache_key(structure):
+    """
+    Computes the hash identifying the connectivity of a network.
+
+    Parameters
+    ----------
+    structure : dict
+        Parameters that determine the connectivity (see WMModel.connectivity_params).
+
+    Returns
+    -------
+    key : str
+        Hexadecimal SHA-256 digest of the parameters and of the NEST version.
+
+    """
+    from model.nestml_cache import _nest_version
+    h = hashlib.sha256()
+    h.update(json.dumps(structure, sort_keys=True).encode("utf-8"))
+    h.update(str(_nest_version()).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_connectivity(key, cache_dir=None):
+    """
+    Loads the connectivity stored under key.
+
+    Returns
+    -------
+    classes : list
+        List of dicts with the 'name', the 'synapse_model' and the 'weight' of each connection class.
+    arrays : dict
+        Dict with the memory-mapped arrays 'source', 'target', 'delay' (in units of the resolution) and 'cls'.
+        None is returned instead of (classes, arrays) if the entry is not in the cache.
+
+    """
+    entry = os.path.join(cache_dir or CONNECTIVITY_CACHE_DIR, key)
+    manifest_fn = os.path.join(entry, "connectivity.json")
+    if not os.path.isfile(manifest_fn):
+        return None
+    with open(manifest_fn, 'r') as fp:
+        manifest = json.load(fp)
+    # the modification time of the manifest marks the last use of the entry (see evict)
+    try:
+        os.utime(manifest_fn)
+    except OSError:
+        pass
+    arrays = {name: np.load(os.path.join(entry, name + ".npy"), mmap_mode='r') for name in CONNECTIVITY_ARRAYS}
+    return manifest["classes"], arrays
+
+
+def save_connectivity(key, classes, source, target, delay, cls, structure=None, cache_dir=None):
+    """
+    Stores the connectivity under key. The arrays are written with the smallest unsigned integer
+    type that holds their values. The entry is written in a temporary directory and then renamed,
+    so concurrent processes storing the same connectivity do not corrupt the cache.
+
+    Parameters
+    ----------
+    classes : list
+        List of dicts with the 'name', the 'synapse_model' and the 'weight' of each connection class.
+    source, target : array
+        Source and target ids of the connections.
+    delay : array
+        Delays of the connections in units of the resolution.
+    cls : array
+        Index of the connection class of each connection.
+    structure : dict
+        Parameters that determine the connectivity, stored in the manifest for reference.
+
+    """
+    cache_dir = cache_dir or CONNECTIVITY_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_entry = tempfile.mkdtemp(prefix=key[:16] + "_", dir=cache_dir)
+    try:
+        for name, values in zip(CONNECTIVITY_ARRAYS, [source, target, delay, cls]):
+            values = np.asarray(values)
+            dtype = np.min_scalar_type(int(values.max())) if len(values) > 0 else np.uint8
+            np.save(os.path.join(tmp_entry, name + ".npy"), values.astype(dtype))
+        manifest = {"classes": classes,
+                    "n_connections": int(len(source)),
+                    "structure": structure}
+        with open(os.path.join(tmp_entry, "connectivity.json"), 'w') as fp:
+            json.dump(manifest, fp)
+        try:
+            os.rename(tmp_entry, os.path.join(cache_dir, key))
+        except OSError:
+            # another process already stored the same connectivity
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        raise
+    evict(cache_dir, keep=key)
+
+
+def entry_size(entry):
+    """
+    Returns the size of the files of a cache entry [bytes].
+
+    """
+    size = 0
+    for name in os.listdir(entry):
+        try:
+            size += os.path.getsize(os.path.join(entry, name))
+        except OSError:
+            pass
+    return size
+
+
+def evict(cache_dir=None, max_bytes=None, keep=None):
+    """
+    Removes the least recently used entries until the cache is not larger than max_bytes
+    (CONNECTIVITY_CACHE_MAX_BYTES if None). The entry keep is never removed.
+
+    Returns the keys of the removed entries.
+
+    """
+    cache_dir = cache_dir or CONNECTIVITY_CACHE_DIR
+    max_bytes = CONNECTIVITY_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for key in os.listdir(cache_dir):
+        manifest_fn = os.path.join(cache_dir, key, "connectivity.json")
+        # temporary entries being written by other processes have no manifest yet
+        if not os.path.isfile(manifest_fn):
+            continue
+        try:
+            entries.append((os.path.getmtime(manifest_fn), key, entry_size(os.path.join(cache_dir, key))))
+        except OSError:
+            continue
+    total = sum(size for _, _, size in entries)
+    removed = []
+    for _, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
+        removed.append(key)
+    return removed
@@ -21,6 +21,12 @@ default_network_params = {
     "N_exc": 8000,
     # number of inh cells 
     "N_inh": 2000,
+    # scale factor of the number of neurons (1.0 is the network of the publication)
+    "scale": 1.0,
+    # indegrees of the scaled network: "fixed" keeps the indegrees of the network with scale 1.0
+    # (the connection probability is divided by scale), "scaled" keeps the connection probability
+    # and divides the synaptic efficacies by scale, so that the mean recurrent input does not change
+    "indegree_scaling": "fixed",
     #mean external current [mV for exc population]
     # needed to reproduce case A: single stable activity
     "eta_excA": 22.70,
@@ -138,6 +144,10 @@ Simulation parameters
 default_simulation_params = {
     # master seed for random number generators
     "master_seed" : 143202461,
+    # seed of the structure of the network, i.e. of the overlapping selective populations and of the
+    # connectivity generated with connection_method "arrays"; None to use master_seed. Networks with the
+    # same structure_seed and different master_seed differ only in the dynamics (external input, noise)
+    "structure_seed": None,
     # number of threads
     "threads" : 8,
     # simulation step (in ms)
@@ -165,7 +175,33 @@ default_simulation_params = {
         "stp_fraction_recorded" : 0.1},
     # path in which simulation data will be saved 
     "data_path" : os.path.join(os.getcwd(), 'data/'),
-    "overwrite_files": True
+    "overwrite_files": True,
+    # ask for confirmation before overwriting the data directory
+    "confirm_overwrite": True,
+    # generation of the recurrent connectivity: "nest" (fixed_indegree rules of the NEST kernel,
+    # one nest.Connect call per projection) or "arrays" (NumPy generation and bulk connection,
+    # with a number of calls not growing as p*p, see model/connectivity.py)
+    "connection_method": "nest",
+    # store the recurrent connectivity in the on-disk cache and reuse it in later builds
+    # of networks with the same structure (see model/connectivity_cache.py); used only with
+    # connection_method "arrays", whose generation does not draw from the kernel random generators
+    "connectivity_cache": False,
+    # snapshot file (saved by WMModel.save_snapshot) from which the simulation continues,
+    # None to start from the initial state
+    "snapshot": None,
+    # collect the NEST kernel statistics, memory and CPU time of each phase of the run and save
+    # them in trace.json together with the spike data (see model/instrumentation.py)
+    "trace": True,
+    # comparison of the estimated memory with the one available before the build (see WMModel.dry_run):
+    # "warn" prints a warning, "refuse" raises a MemoryError if the network does not fit the machine, None skips it
+    "resource_check": "warn",
+    # online monitor of the rates of all the populations, e.g. {"bin_size": 5.0, "drain_interval": 100.0} [ms]:
+    # the spikes are binned every drain_interval and not stored (see model/rate_monitor.py), None to disable it
+    "rate_monitor": None,
+    # criteria for stopping the simulation before t_sim once the outcome of the trial is decided, e.g.
+    # {"criteria": [{"type": "rate_below", "pop": 0, "threshold": 5.0, "duration": 300.0, "after": 1350.0, "name": "item_lost"}]}
+    # (see model/early_stop.py), None to always simulate t_sim; the rate monitor is enabled if needed
+    "early_stop": None
 }
 
 """
@@ -174,7 +210,8 @@ Update default parameters with custom parameters
 
 def update_params(d, d2):
     for key in d2:
-        if isinstance(d2[key], dict) and key in d:
+        # parameters disabled by default (None) take the whole dict of the custom parameters
+        if isinstance(d2[key], dict) and isinstance(d.get(key), dict):
             update_params(d[key], d2[key])
         else:
             d[key] = d2[key]
@@ -183,10 +220,9 @@ def update_params(d, d2):
 # check custom params correctness
 def check_params(d, def_d):
     for key, val in d.items():
-        if isinstance(val, dict):
-            check_params(d[key], def_d[key])
-        else:
-            try:
-                def_val = def_d[key]
-            except KeyError:
-                raise KeyError('Custom key {} not used.'.format(key))
+        try:
+            def_val = def_d[key]
+        except KeyError:
+            raise KeyError('Custom key {} not used.'.format(key))
+        if isinstance(val, dict) and isinstance(def_val, dict):
+            check_params(val, def_val)
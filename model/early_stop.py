@@ -0,0 +1,102 @@
+"""
+Early termination of the simulation
+===================================
+
+Stopping criteria evaluated on the population rates of the online rate
+monitor (see model/rate_monitor.py) after every chunk of the simulation.
+The simulation stops as soon as one of the criteria is met, e.g. when the
+item is lost (the rate of the loaded population has returned to the
+spontaneous level) or when it is clearly kept (persistent activity past a
+horizon), so that the outcome of a trial is known without simulating the
+whole t_sim.
+
+The criteria are given in the simulation parameter "early_stop" as
+
+    {"criteria": [{"type": "rate_below", "pop": 0, "threshold": 5.0, "duration": 300.0, "after": 1350.0, "name": "item_lost"},
+                  {"type": "rate_above", "pop": 0, "threshold": 10.0, "duration": 500.0, "after": 4000.0, "name": "item_kept"}]}
+
+where pop is the id of a selective population or one of the names of the
+rate monitor ("nonsel", "inh"), and all the times are in ms of the
+stimulation protocol. New types of criteria can be added with the decorator
+criterion: the function receives the rate monitor, the time reached by the
+simulation and the parameters of the criterion, and returns True if the
+simulation has to stop.
+
+"""
+
+import numpy as np
+
+CRITERIA = {}
+
+
+def criterion(name):
+    """
+    Decorator registering a stopping criterion under name.
+
+    """
+    def register(function):
+        CRITERIA[name] = function
+        return function
+    return register
+
+
+def window_rate(monitor, pop, t0, t1):
+    """
+    Returns the mean rate [spikes/s] of the population pop of the rate monitor in the bins within [t0, t1),
+    None if no bin is complete within the window.
+
+    """
+    i = monitor.names.index(pop if isinstance(pop, str) else "sel_{}".format(pop))
+    b0 = max(int(np.ceil((t0 - monitor.t_start)/monitor.bin_size - 1e-9)), 0)
+    b1 = min(int(np.floor((t1 - monitor.t_start)/monitor.bin_size + 1e-9)), monitor.counts.shape[1])
+    if b1 <= b0:
+        return None
+    return monitor.counts[i, b0:b1].sum()*1000.0/(monitor.sizes[i]*(b1 - b0)*monitor.bin_size)
+
+
+@criterion("rate_below")
+def rate_below(monitor, t, pop, threshold, duration, after=0.0, **kwargs):
+    """
+    The mean rate of pop in the last duration ms, all after the time after, is below threshold.
+
+    """
+    if t - duration < after:
+        return False
+    rate = window_rate(monitor, pop, t - duration, t)
+    return rate is not None and rate < threshold
+
+
+@criterion("rate_above")
+def rate_above(monitor, t, pop, threshold, duration, after=0.0, **kwargs):
+    """
+    The mean rate of pop in the last duration ms is above threshold, at a time later than after.
+
+    """
+    if t < after:
+        return False
+    rate = window_rate(monitor, pop, t - duration, t)
+    return rate is not None and rate > threshold
+
+
+def validate(criteria):
+    """
+    Checks that the types of the criteria are known.
+
+    """
+    for c in criteria:
+        if c.get("type") not in CRITERIA:
+            raise ValueError("Unknown stopping criterion {}, available: {}.".format(c.get("type"), sorted(CRITERIA)))
+
+
+def check(criteria, monitor, t):
+    """
+    Evaluates the criteria at time t (in the time of the stimulation protocol).
+
+    Returns the name (or the type) of the first criterion met, None if the simulation has to go on.
+
+    """
+    for c in criteria:
+        params = {key: value for key, value in c.items() if key not in ["type", "name"]}
+        if CRITERIA[c["type"]](monitor, t, **params):
+            return c.get("name", c["type"])
+    return None
@@ -0,0 +1,259 @@
+"""
+Memory and run time estimates
+=============================
+
+Estimates the resources needed by a network configuration without building it:
+the number of connections of each projection and synapse model (from the
+indegrees of the fixed_indegree rules), the memory needed by the NEST kernel
+in total and per thread, the volume of the spike and STP recordings and the
+wall-clock time of the build and of the simulation.
+
+The memory per connection and per neuron and the coefficients of the time
+model are rough figures for NEST 3 on a 64-bit machine. The stp_synapse
+carries its state (u, x, t_ls) and parameters (w, U, tau_rec, tau_fac, delay)
+as doubles on top of the target and synapse id of every NEST connection. The
+time coefficients can be calibrated on the traces of previous runs of the same
+machine (see model/instrumentation.py and calibrate).
+
+"""
+
+import json
+import os
+import numpy as np
+from model.connectivity import indegrees
+
+# memory of a connection [bytes]: connection data, plus the entry of the source table
+BYTES_PER_CONNECTION = {"static_synapse": 16 + 8,
+                        "stp_synapse": 16 + 8*8 + 8}
+# memory of a neuron (iaf_psc_exp with its ring buffers) and of a device [bytes]
+BYTES_PER_NODE = 1500
+# memory of the Python interpreter, of the NEST kernel and of the loaded modules [bytes]
+BYTES_BASE = 300e6
+# memory of the kernel buffers of each thread [bytes]
+BYTES_PER_THREAD = 20e6
+# memory of the NumPy arrays of a connection during the generation with connection_method "arrays"
+# (source, target, delay, connection class and the indices drawn) [bytes]
+BYTES_PER_GENERATED_CONNECTION = 8 + 8 + 8 + 1 + 8
+# memory of a recorded spike in the kernel (sender, time) and in the spike files [bytes]
+BYTES_PER_SPIKE = 16
+BYTES_PER_SAVED_SPIKE = 8
+
+# coefficients of the time model [s], on a single thread:
+#   build    = connect*connections
+#   simulate = update*neurons*steps + deliver*synaptic events
+DEFAULT_CALIBRATION = {"connect": 1.0e-6,
+                       "update": 5.0e-8,
+                       "deliver": 2.0e-8}
+
+
+def population_sizes(network_params):
+    """
+    Returns the sizes of the selective, non-selective and inhibitory populations.
+    With overlap the size of the non-selective population is the expected one.
+
+    """
+    N_exc = network_params["N_exc"]
+    p = network_params["p"]
+    f = network_params["f"]
+    n_sel = int(f*N_exc)
+    if network_params["overlap"]:
+        n_nonsel = int(round(N_exc*(1.0 - f)**p))
+    else:
+        n_nonsel = N_exc - p*n_sel
+    return {"sel": n_sel, "nonsel": n_nonsel, "inh": network_params["N_inh"]}
+
+
+def projections(network_params):
+    """
+    Returns the list of the recurrent projections of the network, each a dict with
+    'source', 'target', 'synapse_model' and 'n_connections'.
+
+    """
+    p = network_params["p"]
+    K = indegrees(network_params)
+    n = population_sizes(network_params)
+    n_sel_targets = p*n["sel"]
+    return [{"source": "E_sel (same)", "target": "E_sel", "synapse_model": "stp_synapse", "n_connections": n_sel_targets*K["sel"]},
+            {"source": "E_sel (other)", "target": "E_sel", "synapse_model": "stp_synapse", "n_connections": n_sel_targets*(p-1)*K["sel"]},
+            {"source": "E_nonsel", "target": "E_sel", "synapse_model": "stp_synapse", "n_connections": n_sel_targets*(K["nonsel_b"] + K["nonsel_p"])},
+            {"source": "I", "target": "E_sel", "synapse_model": "static_synapse", "n_connections": n_sel_targets*K["inh"]},
+            {"source": "E_sel", "target": "E_nonsel", "synapse_model": "stp_synapse", "n_connections": n["nonsel"]*p*K["sel"]},
+            {"source": "E_nonsel", "target": "E_nonsel", "synapse_model": "stp_synapse", "n_connections": n["nonsel"]*(K["nonsel_b"] + K["nonsel_p"])},
+            {"source": "I", "target": "E_nonsel", "synapse_model": "static_synapse", "n_connections": n["nonsel"]*K["inh"]},
+            {"source": "E_sel", "target": "I", "synapse_model": "static_synapse", "n_connections": n["inh"]*p*K["sel"]},
+            {"source": "E_nonsel", "target": "I", "synapse_model": "static_synapse", "n_connections": n["inh"]*K["nonsel"]},
+            {"source": "I", "target": "I", "synapse_model": "static_synapse", "n_connections": n["inh"]*K["inh"]}]
+
+
+def external_connections(network_params, stimuli):
+    """
+    Returns the number of connections of the external inputs: background input, one current
+    source per stimulated group (including the offset of the background input) and one
+    generator per nonspecific noise stimulus.
+
+    """
+    N_exc = network_params["N_exc"]
+    n_sel = int(network_params["f"]*N_exc)
+    targets = {"exc"}
+    n_noise = 0
+    for ev in stimuli:
+        if ev.kind == "nonspecific_noise":
+            n_noise += int(ev.frac*N_exc)
+        else:
+            targets.add(ev.target)
+    n_sources = sum(N_exc if target == "exc" else n_sel for target in targets)
+    return N_exc + network_params["N_inh"] + n_sources + n_noise
+
+
+def estimate(network_params, simulation_params, stimuli=(), t_offset=0.0, rate_exc=5.0, rate_inh=10.0, calibration=None):
+    """
+    Estimates the resources needed to build and simulate a network.
+
+    Parameters
+    ----------
+    network_params, simulation_params : dict
+        Parameters of the network (after scaling) and of the simulation.
+    stimuli : StimulusTimeline
+        Stimuli of the protocol.
+    t_offset : float
+        Time of the snapshot the simulation continues from [ms].
+    rate_exc, rate_inh : float
+        Expected mean firing rate of the excitatory and inhibitory neurons [spikes/s],
+        used for the recording volume and the simulation time.
+    calibration : dict
+        Coefficients of the time model, DEFAULT_CALIBRATION if None.
+
+    Returns
+    -------
+    est : dict
+        Connection counts per projection and per synapse model, memory [bytes] in total,
+        per thread and of the recordings, and wall-clock times [s] of build and simulation.
+
+    """
+    calibration = dict(DEFAULT_CALIBRATION, **(calibration or {}))
+    threads = simulation_params["threads"]
+    rec = simulation_params["recording_params"]
+    N_exc = network_params["N_exc"]
+    N_inh = network_params["N_inh"]
+    N = N_exc + N_inh
+    T = max(simulation_params["t_sim"] - t_offset, 0.0)
+
+    proj = projections(network_params)
+    n_recurrent = sum(pr["n_connections"] for pr in proj)
+    n_models = {}
+    for pr in proj:
+        n_models[pr["synapse_model"]] = n_models.get(pr["synapse_model"], 0) + pr["n_connections"]
+    n_rec_pop = int(N_exc*network_params["f"]*rec["fraction_pop_recorded"])
+    n_external = external_connections(network_params, stimuli) + len(rec["pop_recorded"])*n_rec_pop
+    if simulation_params.get("rate_monitor") is not None:
+        # all the neurons are connected to the recorders of the rate monitor
+        sizes = population_sizes(network_params)
+        n_external += network_params["p"]*sizes["sel"] + sizes["nonsel"] + sizes["inh"]
+    n_models["static_synapse"] = n_models.get("static_synapse", 0) + n_external
+
+    # memory of the kernel, the connections are stored on the thread of their target
+    mem_connections = sum(BYTES_PER_CONNECTION[model]*n for model, n in n_models.items())
+    mem_nodes = BYTES_PER_NODE*N
+    mem_generation = BYTES_PER_GENERATED_CONNECTION*n_recurrent if simulation_params["connection_method"] == "arrays" else 0
+
+    # recordings
+    # without the STP recording the spikes are recorded from the beginning, to reconstruct the STP traces
+    rec_start = rec["spike_recording_params"]["start"] if rec["stp_recording"] else t_offset
+    T_rec = max(T - max(rec_start - t_offset, 0.0), 0.0)
+    n_spikes_recorded = rate_exc*len(rec["pop_recorded"])*n_rec_pop*T_rec/1000.0
+    if rec["stp_recording"]:
+        n_stp = len(rec["stp_pop_recorded"])*int(N_exc*network_params["f"]*rec["stp_fraction_recorded"])
+        mem_stp = 3*8*n_stp*int(np.ceil(T/rec["stp_record_interval"]))
+    else:
+        mem_stp = 0
+    mem_recording = BYTES_PER_SPIKE*n_spikes_recorded
+
+    # wall-clock time
+    exc_out = sum(pr["n_connections"] for pr in proj if pr["source"].startswith("E"))/max(N_exc, 1)
+    inh_out = sum(pr["n_connections"] for pr in proj if pr["source"].startswith("I"))/max(N_inh, 1)
+    n_spikes = (rate_exc*N_exc + rate_inh*N_inh)*T/1000.0
+    n_events = (rate_exc*N_exc*exc_out + rate_inh*N_inh*inh_out)*T/1000.0
+    steps = T/simulation_params["dt"]
+
+    mem_total = BYTES_BASE + BYTES_PER_THREAD*threads + mem_connections + mem_nodes + mem_generation + mem_recording
+    return {"projections": proj,
+            "n_connections": dict(n_models, total=n_recurrent + n_external),
+            "memory": {"total": mem_total,
+                       "per_thread": (mem_connections + mem_nodes)/threads + BYTES_PER_THREAD,
+                       "connections": mem_connections,
+                       "nodes": mem_nodes,
+                       "generation": mem_generation,
+                       "spike_recording": mem_recording},
+            "recording": {"n_spikes": n_spikes_recorded,
+                          "spike_files": BYTES_PER_SAVED_SPIKE*n_spikes_recorded,
+                          "stp_files": mem_stp},
+            "n_spikes": n_spikes,
+            "n_synaptic_events": n_events,
+            "time": {"build": calibration["connect"]*(n_recurrent + n_external)/threads,
+                     "simulate": (calibration["update"]*N*steps + calibration["deliver"]*n_events)/threads},
+            "calibration": calibration}
+
+
+def available_memory():
+    """
+    Returns the memory available to a new process [bytes], None if it cannot be measured.
+
+    """
+    try:
+        with open("/proc/meminfo", 'r') as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def calibrate(trace_files, calibration=None):
+    """
+    Calibrates the coefficients of the time model on the traces of previous runs (trace.json files).
+    Each group of coefficients is multiplied by the median ratio between the measured and the
+    estimated time of the spans: connect_populations for the build, the simulate spans (possibly
+    aggregated) of each simulate_network for the simulation. The number of connections, of spikes
+    and the simulated time are taken from the kernel statistics of connect_populations and
+    simulate_network.
+
+    Returns the calibrated coefficients.
+
+    """
+    calibration = dict(DEFAULT_CALIBRATION, **(calibration or {}))
+    build_ratios = []
+    sim_ratios = []
+    for fn in trace_files:
+        with open(fn, 'r') as fp:
+            trace = json.load(fp)
+        meta = trace["metadata"]
+        threads = meta["threads"]
+        N = meta["N_exc"] + meta["N_inh"]
+        # time spent in nest.Simulate since the end of the previous simulate_network
+        t_simulate = 0.0
+        for span in trace["spans"]:
+            if span["name"] == "simulate":
+                t_simulate += span["duration"]
+                continue
+            delta = span.get("kernel_delta")
+            if span["name"] == "simulate_network":
+                if delta and delta.get("biological_time", 0) > 0 and t_simulate > 0:
+                    outdegree = span["kernel"]["num_connections"]/N
+                    estimated = (calibration["update"]*N*delta["biological_time"]/meta["dt"]
+                                 + calibration["deliver"]*delta.get("local_spike_counter", 0)*outdegree)/threads
+                    sim_ratios.append(t_simulate/estimated)
+                t_simulate = 0.0
+            elif span["name"] == "connect_populations" and delta and delta.get("num_connections", 0) > 0:
+                estimated = calibration["connect"]*delta["num_connections"]/threads
+                build_ratios.append(span["duration"]/estimated)
+    if build_ratios:
+        calibration["connect"] *= float(np.median(build_ratios))
+    if sim_ratios:
+        factor = float(np.median(sim_ratios))
+        calibration["update"] *= factor
+        calibration["deliver"] *= factor
+    return calibration
@@ -0,0 +1,246 @@
+"""
+Instrumentation of the model phases
+===================================
+
+A Tracer records named, possibly nested, spans around the phases of a run
+(network build, connection of each block, simulation, STP recording, saving).
+For each span it stores
+
+    start, duration      wall-clock time [s], start relative to the creation of the tracer
+    cpu_time             CPU time of the process [s]
+    rss_start, rss_end   resident set size of the process [bytes] at the span boundaries
+    max_rss              peak resident set size of the process [bytes] at the end of the span
+    kernel               NEST kernel statistics at the end of the span: number of connections
+                         (in total and per synapse model), local spike counter and the kernel
+                         timers available in the NEST version in use
+    kernel_delta         change of the kernel counters and timers during the span
+
+The kernel statistics are collected only for the phases of the run, i.e. the
+spans up to a given depth, and only if NEST has already been imported, so
+that the tracer never imports it. The spans repeated many times (e.g. the
+steps of the STP recording or the blocks of the connection) can be
+aggregated: their count, wall-clock and CPU time are summed in a single
+record per name and parent span. Functions added with add_listener are
+called with the record of every span when the span ends, e.g. to print it
+or to forward it to another monitoring system. The trace is saved in JSON
+format by save.
+
+"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def rss():
+    """
+    Returns the resident set size of the process [bytes], None if it cannot be measured.
+
+    """
+    try:
+        with open("/proc/self/statm", 'r') as fp:
+            return int(fp.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss():
+    """
+    Returns the peak resident set size of the process [bytes], None if it cannot be measured.
+
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale
+
+
+def kernel_stats(synapse_models):
+    """
+    Returns the NEST kernel statistics, None if NEST has not been imported.
+
+    Parameters
+    ----------
+    synapse_models : list
+        Synapse models for which the number of connections is returned.
+
+    """
+    if "nest" not in sys.modules:
+        return None
+    import nest
+    status = nest.GetKernelStatus()
+    stats = {key: value for key, value in status.items()
+             if key.startswith("time_") and isinstance(value, (int, float))}
+    stats["biological_time"] = status.get("biological_time")
+    stats["local_spike_counter"] = status.get("local_spike_counter")
+    stats["num_connections"] = status.get("num_connections")
+    for model in synapse_models:
+        try:
+            stats["num_connections_" + model] = nest.GetDefaults(model, "num_connections")
+        except Exception:
+            # model not installed yet
+            pass
+    return stats
+
+
+def kernel_reset(before, after):
+    """
+    Returns True if the kernel statistics after show that the kernel was reset since the statistics before.
+
+    """
+    return any(after.get(key) is not None and before.get(key) is not None and after[key] < before[key]
+               for key in ["biological_time", "local_spike_counter", "num_connections"])
+
+
+class Tracer:
+    """
+    Collects the spans of a run.
+
+    Parameters
+    ----------
+    kernel : bool
+        If True, the NEST kernel statistics are collected at the span boundaries.
+    synapse_models : list
+        Synapse models for which the number of connections is collected.
+    kernel_depth : int
+        Maximum depth of the spans for which the kernel statistics are collected.
+
+    """
+    def __init__(self, kernel=True, synapse_models=("stp_synapse", "static_synapse"), kernel_depth=1):
+        self.kernel = kernel
+        self.synapse_models = list(synapse_models)
+        self.kernel_depth = kernel_depth
+        self.t0 = time.time()
+        self.spans = []
+        self.listeners = []
+        self._stack = []
+        # records of the aggregated spans, by id of the parent record (None for the spans without parent)
+        self._aggregates = {}
+
+
+    def add_listener(self, function):
+        """
+        Adds a function called with the record (a dict) of every span when the span ends.
+
+        """
+        self.listeners.append(function)
+
+
+    def _end(self, record):
+        self.spans.append(record)
+        for function in self.listeners:
+            function(record)
+
+
+    def _pending(self):
+        return [record for aggregates in self._aggregates.values() for record in aggregates.values()]
+
+
+    @contextmanager
+    def span(self, name, aggregate=False, **attrs):
+        """
+        Context manager recording a span. Additional keyword arguments are stored in the record.
+        The record is stored also if the span ends with an exception, with the error message.
+        If aggregate is True the span is added to the record of the spans with the same name and
+        parent ('count', 'duration' and 'cpu_time'), stored when the parent span ends.
+
+        """
+        parent = self._stack[-1] if self._stack else None
+        if aggregate:
+            aggregates = self._aggregates.setdefault(id(parent) if parent is not None else None, {})
+            if name not in aggregates:
+                aggregates[name] = {"name": name,
+                                    "parent": parent["name"] if parent is not None else None,
+                                    "depth": len(self._stack),
+                                    "start": time.time() - self.t0,
+                                    "aggregated": True,
+                                    "count": 0,
+                                    "duration": 0.0,
+                                    "cpu_time": 0.0}
+            record = aggregates[name]
+            cpu0 = time.process_time()
+            wall0 = time.time()
+            self._stack.append(record)
+            try:
+                yield record
+            except BaseException as e:
+                record["error"] = repr(e)
+                raise
+            finally:
+                self._stack.pop()
+                record["count"] += 1
+                record["duration"] += time.time() - wall0
+                record["cpu_time"] += time.process_time() - cpu0
+            return
+
+        record = {"name": name,
+                  "parent": self._stack[-1]["name"] if self._stack else None,
+                  "depth": len(self._stack),
+                  "start": time.time() - self.t0}
+        record.update(attrs)
+        record["rss_start"] = rss()
+        kernel = self.kernel and len(self._stack) <= self.kernel_depth
+        kernel_start = kernel_stats(self.synapse_models) if kernel else None
+        cpu0 = time.process_time()
+        wall0 = time.time()
+        self._stack.append(record)
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = repr(e)
+            raise
+        finally:
+            self._stack.pop()
+            record["duration"] = time.time() - wall0
+            record["cpu_time"] = time.process_time() - cpu0
+            record["rss_end"] = rss()
+            record["max_rss"] = max_rss()
+            if kernel:
+                record["kernel"] = kernel_stats(self.synapse_models)
+                # no differences across a reset of the kernel (e.g. the one of WMModel.prepare_nest)
+                if kernel_start is not None and record["kernel"] is not None and not kernel_reset(kernel_start, record["kernel"]):
+                    record["kernel_delta"] = {key: value - kernel_start[key] for key, value in record["kernel"].items()
+                                              if isinstance(kernel_start.get(key), (int, float)) and isinstance(value, (int, float))}
+            # the aggregated spans within this one end before it
+            for child in self._aggregates.pop(id(record), {}).values():
+                self._end(child)
+            self._end(record)
+
+
+    def totals(self):
+        """
+        Returns a dict with the overall wall-clock time [s] spent in the spans of each name.
+
+        """
+        totals = {}
+        for record in self.spans + self._pending():
+            totals[record["name"]] = totals.get(record["name"], 0.0) + record["duration"]
+        return totals
+
+
+    def save(self, fn, metadata=None):
+        """
+        Saves the trace, i.e. the spans in the order in which they ended, in JSON format.
+
+        Parameters
+        ----------
+        fn : str
+            File name.
+        metadata : dict
+            Additional information on the run stored with the trace.
+
+        """
+        trace = {"metadata": metadata or {},
+                 "created": self.t0,
+                 "totals": self.totals(),
+                 "spans": self.spans + self._pending()}
+        with open(fn, 'w') as fp:
+            json.dump(trace, fp, indent=1, default=str)
@@ -8,21 +8,18 @@ working memory model by Mongillo et al. (2018).
 """
 
 import numpy as np
-import random
-import matplotlib.pyplot as plt
-from matplotlib import gridspec
-import nest
+import math
 import os
 import shutil
 import sys
 import json
-import pandas as pd
 import time
 from copy import deepcopy
-from pynestml.codegeneration.nest_code_generator_utils import NESTCodeGeneratorUtils
 from model.default_params import default_network_params, default_simulation_params
 from model.default_params import update_params, check_params
-from model.model_helpers import get_weight, noise_params
+from model.model_helpers import get_weight, noise_params, piecewise_constant
+from model.stimulus import StimulusTimeline, shade_stimuli
+from model.instrumentation import Tracer
 
 
 
@@ -62,12 +59,39 @@ model stp_synapse:
 
 """
 
-#Generate the target directory with all the files necessary to implement the synapse model in NEST 3.X
+# NEST module implementing the synapse model, installed at the first call of install_stp_synapse
+stp_module = {}
 
-module_name, synapse_model_name = \
-        NESTCodeGeneratorUtils.generate_code_for(stp_synapse,
-                                                codegen_opts={"delay_variable": {"stp_synapse": "delay"},
-                                                            "weight_variable": {"stp_synapse": "w"}})
+
+def install_stp_synapse():
+    """
+    Installs the NESTML STP synapse module into NEST.
+    The target directory with all the files necessary to implement the synapse model in NEST 3.X
+    is generated only once and then taken from the on-disk cache (see model/nestml_cache.py).
+    NEST and NESTML are imported here, so that importing this module has no side effects.
+
+    Returns
+    -------
+    synapse_model_name : str
+        Name of the NESTML synapse model in NEST.
+
+    """
+    import nest
+    from model.nestml_cache import generate_code_for
+
+    if "module_name" not in stp_module:
+        module_name, synapse_model_name = \
+                generate_code_for(stp_synapse,
+                                  codegen_opts={"delay_variable": {"stp_synapse": "delay"},
+                                                "weight_variable": {"stp_synapse": "w"}})
+        stp_module.update({"module_name": module_name, "synapse_model_name": synapse_model_name})
+
+    # dynamic modules stay loaded after nest.ResetKernel
+    if not stp_module.get("installed", False):
+        nest.Install(stp_module["module_name"])
+        stp_module["installed"] = True
+
+    return stp_module["synapse_model_name"]
 
 
 
@@ -117,56 +141,158 @@ class WMModel:
                 print("Data directory already exists and cannot be overwritten.\nPlease remove the folder %s" % self.data_path)
                 sys.exit()
             if(self.simulation_params['overwrite_files']==True):
-                ow = input("Data directory {} will be overwritten. Press any key to continue.".format(self.data_path))
+                if(self.simulation_params['confirm_overwrite']==True):
+                    ow = input("Data directory {} will be overwritten. Press any key to continue.".format(self.data_path))
                 shutil.rmtree(self.simulation_params['data_path'])
                 os.mkdir(self.simulation_params['data_path'])
                 if(self.simulation_params['recording_params']["stp_recording"]==True):
                     os.mkdir(self.simulation_params['data_path']+"stp_params")
         else:
-            os.mkdir(self.simulation_params['data_path'])
+            os.makedirs(self.simulation_params['data_path'])
             if(self.simulation_params['recording_params']["stp_recording"]==True):
                 os.mkdir(self.simulation_params['data_path']+"stp_params")
             print('Data directory created.')
         print('Data will be written to %s' % self.data_path)
         
+        self.scale_network()
         self.c = self.network_params["c"]
         self.p = self.network_params["p"]
         self.f = self.network_params["f"]
+        if self.simulation_params["connection_method"] not in ["nest", "arrays"]:
+            raise ValueError("connection_method must be 'nest' or 'arrays'.")
+        # seed of the selective populations and of the connectivity generated with NumPy
+        self.structure_seed = self.simulation_params["structure_seed"]
+        if self.structure_seed is None:
+            self.structure_seed = self.simulation_params["master_seed"]
+        if self.simulation_params["connectivity_cache"] and self.simulation_params["connection_method"] != "arrays":
+            print("Warning: the connectivity cache is used only with connection_method 'arrays'.")
+
+        # timeline of the stimuli added with the add_* functions
+        self.stimuli = StimulusTimeline()
+
+        # time of the snapshot the simulation continues from (see load_snapshot), the NEST clock
+        # starts at zero, so all the device times are shifted back by this amount
+        self.t_offset = 0.0
+        # NEST time at which the current trial starts (see run_trials)
+        self.t_trial_start = 0.0
+
+        # online monitor of the population rates (see create_recording_devices)
+        self.rate_monitor = None
+        # criterion and time of the early termination of the last simulation (see check_early_stop)
+        self.early_stop = None
+        if(self.simulation_params["early_stop"] is not None):
+            from model.early_stop import validate
+            validate(self.simulation_params["early_stop"]["criteria"])
+            # the criteria are evaluated on the population rates
+            if(self.simulation_params["rate_monitor"] is None):
+                self.simulation_params["rate_monitor"] = {"bin_size": 5.0, "drain_interval": 50.0}
+
+        # spans of the phases of the run (see model/instrumentation.py and timed)
+        self.tracer = Tracer(kernel=self.simulation_params["trace"])
         
 
+    def scale_network(self):
+        """
+        Applies the scale factor to the network parameters. The numbers of neurons are multiplied by scale.
+        With indegree_scaling "fixed" the connection probability is divided by scale, so that
+        all the indegrees (and then the mean and the variance of the recurrent input) are the ones of the
+        network with scale 1.0; with "scaled" the connection probability is kept and the synaptic efficacies
+        are divided by scale, so that the mean recurrent input is the one of the network with scale 1.0
+        (its fluctuations are reduced by a factor sqrt(scale)). The external input is given as a mean
+        membrane potential per neuron and does not depend on the size of the network.
+        The parameters of the network with scale 1.0 are kept in network_params under the key 'reference_params'.
+
+        """
+        scale = self.network_params["scale"]
+        if scale <= 0.0:
+            raise ValueError("The scale factor must be positive.")
+        if self.network_params["indegree_scaling"] not in ["fixed", "scaled"]:
+            raise ValueError("indegree_scaling must be 'fixed' or 'scaled'.")
+        if scale == 1.0:
+            return
+        syn_params = self.network_params["syn_params"]
+        efficacies = ["J_IE", "J_EI", "J_II", "J_b", "J_p"]
+        self.network_params["reference_params"] = {"N_exc": self.network_params["N_exc"],
+                                                   "N_inh": self.network_params["N_inh"],
+                                                   "c": self.network_params["c"],
+                                                   "syn_params": {J: syn_params[J] for J in efficacies}}
+        self.network_params["N_exc"] = int(round(scale*self.network_params["N_exc"]))
+        self.network_params["N_inh"] = int(round(scale*self.network_params["N_inh"]))
+        if self.network_params["indegree_scaling"] == "fixed":
+            # effective connection probability, the indegrees are computed from reference_params (see connectivity.indegrees)
+            self.network_params["c"] = self.network_params["c"]/scale
+            if self.network_params["c"] > 1.0 and not syn_params["multapses"]:
+                raise ValueError("The indegrees of the network with scale 1.0 cannot be kept without multapses for scale {}.".format(scale))
+        else:
+            for J in efficacies:
+                syn_params[J] = syn_params[J]/scale
+        print("Network scaled by {}: N_exc = {}, N_inh = {}, c = {:.4g}.".format(scale, self.network_params["N_exc"], self.network_params["N_inh"], self.network_params["c"]))
+
+
     def print_params(self):
         print("Network parameters dict:", self.network_params)
         print("Simulation parameters dict:", self.simulation_params)
 
 
-    def save_params(self):
+    def save_params(self, path = None):
         """
         Save network and simulation dicts in json files.
 
-        """
+        Parameters
+        ----------
+            path : str
+                Directory in which the files are written. If None, the data directory.
 
-        print("Writing dict params to file...", end = " ")
-        with open(self.simulation_params['data_path'] + "network_params.json", 'w') as fp:
-            json.dump(self.network_params, fp)
-        with open(self.simulation_params['data_path'] + "simulation_params.json", 'w') as fp:
-            json.dump(self.simulation_params, fp)
+        """
+        with self.tracer.span("save_params"):
+            if path is None:
+                path = self.simulation_params['data_path']
+
+            print("Writing dict params to file...", end = " ")
+            with open(path + "network_params.json", 'w') as fp:
+                json.dump(self.network_params, fp)
+            with open(path + "simulation_params.json", 'w') as fp:
+                json.dump(self.simulation_params, fp)
         
-        print("Done")
+            print("Done")
 
 
-    def save_spike_data(self):
+    def save_spike_data(self, path = None):
         """
-        Save spike data in files named 'spikedataX.dat' where X is the pop recorded id
-        (i.e. the id of the excitatory selective sub-population)
+        Save spike data in binary files named 'spikedataX.npy' where X is the pop recorded id
+        (i.e. the id of the excitatory selective sub-population), each with a JSON header
+        'spikedataX.json' containing the population metadata and a time index (see model/spike_store.py).
+        Spike times are saved in the time of the stimulation protocol.
+        The population rates of the rate monitor, if enabled, are saved in 'population_rates.npz'
+        (see model/rate_monitor.py). If the trace is enabled, the trace of the run is saved as well (see save_trace).
+
+        Parameters
+        ----------
+            path : str
+                Directory in which the files are written. If None, the data directory.
 
         """
+        from model.spike_store import save_spikes
+        with self.tracer.span("save_spike_data"):
+            if path is None:
+                path = self.simulation_params['data_path']
 
-        if(self.simulation_params["recording_params"]["save_to_file"]):
-            for i, sr in enumerate(self.spike_recorders):
-                fn = "spikedata" + str(self.simulation_params["recording_params"]["pop_recorded"][i])+".dat"
-                spikes = np.array([sr.get("events")["senders"], sr.get("events")["times"]])
-                spikes = spikes.T
-                np.savetxt(self.simulation_params['data_path'] + fn, spikes)
+            if(self.simulation_params["recording_params"]["save_to_file"]):
+                N_neurons_recorded = int(self.network_params["N_exc"]*self.f*self.simulation_params["recording_params"]["fraction_pop_recorded"])
+                for i, sr in enumerate(self.spike_recorders):
+                    pop_id = self.simulation_params["recording_params"]["pop_recorded"][i]
+                    events = sr.get("events")
+                    metadata = {"n_neurons_recorded": N_neurons_recorded,
+                                "overlap": self.network_params["overlap"],
+                                "recording_start": self.spike_recording_start(),
+                                "t_sim": self.simulation_params["t_sim"],
+                                "early_stop": self.early_stop}
+                    save_spikes(path, pop_id, events["senders"], self.protocol_time(np.asarray(events["times"])),
+                                self.simulation_params["dt"], metadata)
+                if self.rate_monitor is not None:
+                    self.rate_monitor.save(path)
+        if(self.simulation_params["trace"]):
+            self.save_trace(path)
 
 
     def add_background_input(self, start=0.0, stop=1000.0, origin = 1000.0):
@@ -215,6 +341,8 @@ class WMModel:
                 }
 
             self.network_params.update({'item_loading': item_loading})
+            stim_params = self.network_params["stimulation_params"]
+            self.set_stimuli("item_loading", [(pop_id[i], origin[i], stim_params["T_cue"], stim_params["A_cue"]) for i in range(len(pop_id))])
         
         print("\nItems loading:")
         for i in range(len(pop_id)):
@@ -239,6 +367,8 @@ class WMModel:
 
 
         self.network_params.update({'nonspecific_readout_signals': nonspecific_readout_signal})
+        stim_params = self.network_params["stimulation_params"]
+        self.set_stimuli("nonspecific_readout_signal", [("exc", t, stim_params["T_reac"], stim_params["A_reac"]) for t in origin])
         
         print("\nNonspecific readout signals:")
         for i in range(len(origin)):
@@ -267,6 +397,8 @@ class WMModel:
             print("Nonspecific noise signal added at {} ms.\n".format(origin[i]))
 
         self.network_params.update({'nonspecific_noise': nonspecific_noise})
+        stim_params = self.network_params["stimulation_params"]
+        self.set_stimuli("nonspecific_noise", [("exc", t, stim_params["T_cue"], stim_params["A_cue"], frac) for t in origin])
 
     
     def add_periodic_sequence(self, intervals = [[1000.0, 1500.0]]):
@@ -294,6 +426,27 @@ class WMModel:
         print("Periodic sequences added at {} ms.\n".format(times))
 
         self.network_params.update({'periodic_sequence': periodic_sequence})
+        stim_params = self.network_params["stimulation_params"]
+        self.set_stimuli("periodic_sequence", [("exc", t, stim_params["T_period_reac"], stim_params["A_period_reac"]) for t in times])
+
+
+    def set_stimuli(self, kind, events):
+        """
+        Replaces the stimuli of the given kind in the stimulus timeline (see model/stimulus.py),
+        which is saved in network_params under the key 'stimulus_timeline'.
+
+        Parameters
+        ----------
+            kind : str
+                Kind of the stimuli.
+            events : list
+                List of (target, onset, duration, amplitude[, frac]) tuples.
+
+        """
+        self.stimuli.remove(kind)
+        for ev in events:
+            self.stimuli.add(kind, *ev)
+        self.network_params.update({'stimulus_timeline': self.stimuli.to_list()})
     
     
     def prepare_nest(self):
@@ -301,6 +454,7 @@ class WMModel:
         Prepare NEST Kernel.
 
         """
+        import nest
         nest.ResetKernel()
         nest.SetKernelStatus({"print_time" : True,
                               "resolution": self.simulation_params["dt"],
@@ -308,7 +462,7 @@ class WMModel:
                               "local_num_threads": self.simulation_params["threads"]})
         
         #implement STP synapse model
-        nest.Install(module_name)
+        synapse_model_name = install_stp_synapse()
         nest.CopyModel(synapse_model_name, "stp_synapse",
                             {"w": 1.0,
                             "delay": 1.0,})
@@ -320,6 +474,7 @@ class WMModel:
         Creates neuron populations.
 
         """
+        import nest
         print("Creating neuron populations...", end = ' ')
 
         # list of exc sub-populations
@@ -345,34 +500,22 @@ class WMModel:
         
         
         if(self.network_params["overlap"]):
-            # subpopulations chosen randomly
-            pop_index = np.arange(self.network_params["N_exc"])
-            # here we collect all the id of neurons belonging to selective populations
-            selective_pop_ids = []
+            # subpopulations chosen randomly, using a generator seeded by the structure seed
+            rng = np.random.default_rng(self.structure_seed)
+            n_sel = int(self.f*self.network_params["N_exc"])
+            # collect the ids of neurons belonging to selective populations
+            # each column is drawn without repetition within the same selective population
+            sel_ids = np.zeros((n_sel, self.p), dtype=np.int64)
             for i in range(self.p):
-                #print("Getting selective population {}".format(i))
-                pop_id_dum = pop_index
-                ids = []
-                for j in range(int(self.f*self.network_params["N_exc"])):
-                    id = int(random.choice(pop_id_dum))
-                    selective_pop_ids.append(id)
-                    ids.append(id)
-                    # delete the id to avoid repetition within the same selective population
-                    pop_id_dum = np.delete(pop_id_dum, np.where(pop_id_dum==id))
-                dum = self.exc_population[np.sort(ids)]
+                sel_ids[:,i] = rng.choice(self.network_params["N_exc"], size=n_sel, replace=False)
+                dum = self.exc_population[np.sort(sel_ids[:,i])]
                 self.exc_populations.append(dum)
             
-            # collect the ids of neurons belonging to selective populaitons
-            sel_ids = np.zeros((int(self.f*self.network_params["N_exc"]), self.p))
-            #sel_ids = [selective_pop_ids[i*int(self.f*self.network_params["N_exc"]):(i+1)*int(self.f*self.network_params["N_exc"])] for i in range(self.p)]
-            for i in range(self.p):
-                sel_ids[:,i] = selective_pop_ids[i*int(self.f*self.network_params["N_exc"]):(i+1)*int(self.f*self.network_params["N_exc"])]
-            # the ids not present in selective_pop_ids go to the non-selective population
-            ids = list(set(selective_pop_ids))
-            nonselec_ids = pop_index
-            for i in ids:
-                nonselec_ids = np.delete(nonselec_ids, np.where(nonselec_ids==i))
-            dum = self.exc_population[np.sort(nonselec_ids)]
+            # the ids not present in sel_ids go to the non-selective population
+            nonselec_mask = np.ones(self.network_params["N_exc"], dtype=bool)
+            nonselec_mask[sel_ids.ravel()] = False
+            nonselec_ids = np.nonzero(nonselec_mask)[0]
+            dum = self.exc_population[nonselec_ids]
             self.exc_populations.append(dum)
 
             if(self.simulation_params["recording_params"]["save_to_file"]):
@@ -404,14 +547,14 @@ class WMModel:
                 excitatory noise for inh pop
 
         """
+        import nest
 
         eta_exc = self.network_params["eta_exc"]
         eta_inh = self.network_params["eta_inh"]
-        eta_exc_end = self.network_params["eta_exc_end"]
         Sigma_exc = self.network_params["Sigma_exc"]
         Sigma_inh = self.network_params["Sigma_inh"]
-        start = self.network_params["background_input"]["start"]
-        stop = self.network_params["background_input"]["stop"]
+        start = max(self.nest_time(self.network_params["background_input"]["start"]), self.t_trial_start)
+        stop = max(self.nest_time(self.network_params["background_input"]["stop"]), start)
 
         mean_I_ext_exc, stdI_ext_exc = noise_params(eta_exc, Sigma_exc, self.network_params["neur_params"]["tau"][0], dt=self.network_params["stimulation_params"]["dt_external_stim"])
 
@@ -435,129 +578,145 @@ class WMModel:
         #print("I EXC [pA]: {:.2f} +/- {:.2f}".format(mean_I_ext_exc, stdI_ext_exc))
         #print("I INH [pA]: {:.2f} +/- {:.2f}".format(-mean_I_ext_inh, stdI_ext_inh))
 
-        mean_I_ext_exc_end, stdI_ext_exc_end = noise_params(eta_exc_end, 0.0, self.network_params["neur_params"]["tau"][1], dt=self.network_params["stimulation_params"]["dt_external_stim"])
-
-        ng_offset = nest.Create("noise_generator")
-        nest.SetStatus(ng_offset, {"mean" : mean_I_ext_exc_end,
-                                  "std" : stdI_ext_exc_end,
-                                  "dt" : self.network_params["stimulation_params"]["dt_external_stim"],
-                                  "origin" : self.simulation_params["eta_end_origin"]})
-
+        self.add_background_offset()
 
         self.exc_bkg_input = ng_exc_E
         self.inh_bkg_input = ng_inh_I
-        self.exc_offset = ng_offset
 
         
-    def create_item_loading_signals(self):
+    def add_background_offset(self):
+        """
+        Adds the offset that diminishes the background excitatory input from eta_end_origin on,
+        deterministic and never switched off.
+
         """
-        Computes item loading signals.
+        mean_I_ext_exc_end, stdI_ext_exc_end = noise_params(self.network_params["eta_exc_end"], 0.0, self.network_params["neur_params"]["tau"][1], dt=self.network_params["stimulation_params"]["dt_external_stim"])
+        self.add_current_pulse("exc", self.simulation_params["eta_end_origin"], math.inf, mean_I_ext_exc_end)
 
-        Returns the list item_loading_signals contaning the item loading input currents.
 
+    def add_current_pulse(self, target, t_on, t_off, amplitude):
         """
+        Adds a deterministic rectangular current pulse to the stimuli of a target group.
+        All the pulses of a target group are delivered by a single step_current_generator
+        created by create_current_sources.
 
-        self.item_loading_signals = []
+        Parameters
+        ----------
+            target : str or int
+                "exc" for the whole excitatory population, the id of the selective population otherwise.
+            t_on : float
+                Pulse onset (in ms).
+            t_off : float
+                Pulse offset (in ms), math.inf if the pulse is never switched off.
+            amplitude : float
+                Current amplitude (in pA).
 
-        eta_exc = self.network_params["eta_exc"]
-        Sigma_exc = 0.0 #self.network_params["Sigma_exc"] #0.0
-        origin = self.network_params["item_loading"]["origin"]
-
-        for item in range(self.network_params["item_loading"]["nstim"]):
-            cue, std_cue = noise_params(eta_exc*(self.network_params["stimulation_params"]["A_cue"]-1.0), Sigma_exc, self.network_params["neur_params"]["tau"][0], dt=self.network_params["stimulation_params"]["dt_external_stim"])
-            I_cue = nest.Create("noise_generator")
-            nest.SetStatus(I_cue, {"mean" : cue,
-                                   "std" : std_cue,
-                                   "dt" : self.network_params["stimulation_params"]["dt_external_stim"],
-                                   "origin" : origin[item],
-                                   "start" : 0.0,
-                                   "stop" : self.network_params["stimulation_params"]["T_cue"]})
-            
-            self.item_loading_signals.append(I_cue)
+        """
+        self.current_pulses.setdefault(target, []).append((t_on, t_off, amplitude))
+
+
+    def nest_time(self, t):
+        """
+        Converts a time of the stimulation protocol into the time of the NEST kernel, which
+        differs if the simulation continues from a snapshot or runs several trials.
 
-        
-    def create_nonspecific_readout_signals(self):
         """
-        Computes the signals injected into the exc populations to reactivate the selective population.
+        return t - self.t_offset + self.t_trial_start
 
-        Returns the list nonspecific_readout_signals contaning the nonspecific readout signal inputs.
 
+    def protocol_time(self, t):
         """
+        Converts a time of the NEST kernel into the time of the stimulation protocol (inverse of nest_time).
 
-        self.nonspecific_readout_signals = []
+        """
+        return t + self.t_offset - self.t_trial_start
 
-        eta_exc = self.network_params["eta_exc"]
-        Sigma_exc = 0.0 #self.network_params["Sigma_exc"] #0.0
-        origin = self.network_params["nonspecific_readout_signals"]["origin"]
 
-        # create the stimulus
-        for i in range(self.network_params["nonspecific_readout_signals"]["nstim"]):
-            cue, std_cue = noise_params(eta_exc*(self.network_params["stimulation_params"]["A_reac"]-1.0), Sigma_exc, self.network_params["neur_params"]["tau"][0], dt=self.network_params["stimulation_params"]["dt_external_stim"])
-            I_cue = nest.Create("noise_generator")
-            nest.SetStatus(I_cue, {"mean" : cue,
-                                   "std" : std_cue,
-                                   "dt" : self.network_params["stimulation_params"]["dt_external_stim"],
-                                   "origin" : origin[i],
-                                   "start" : 0.0,
-                                   "stop" : self.network_params["stimulation_params"]["T_reac"]})
+    def spike_recording_start(self):
+        """
+        Returns the time [ms] from which the spikes are recorded. If the STP variables are not recorded
+        during the simulation, they are reconstructed from the spike trains (see model/stp_reconstruction.py),
+        which must contain every spike since the beginning of the simulation (or the snapshot): in this case
+        the spikes are recorded from the beginning, since the neurons fire before the recording start
+        of the parameters.
+
+        """
+        if self.simulation_params["recording_params"]["stp_recording"]:
+            return max(self.simulation_params["recording_params"]["spike_recording_params"]["start"], self.t_offset)
+        return self.t_offset
 
-            self.nonspecific_readout_signals.append(I_cue)
 
+    def current_steps(self, target):
+        """
+        Returns the times (in NEST time) and values of the piecewise-constant current
+        of the pulses of a target group. Pulses already active at the beginning of the simulation
+        (or of the trial) start with its first step.
 
-    def create_random_nonspecific_noise(self):
         """
-        Creation of the noisy input injected in a subset of the excitatory neurons
+        start = self.t_trial_start + self.simulation_params["dt"]
+        pulses = [(max(self.nest_time(t_on), start), self.nest_time(t_off), amplitude)
+                  for t_on, t_off, amplitude in self.current_pulses.get(target, []) if t_off > self.t_offset]
+        return piecewise_constant(pulses)
 
-        Returns the list random_noise contaning the nonspecific noise signal injected into a fraction of the excitatory neurons.
 
+    def create_stimuli(self):
         """
+        Computes the stimuli of the stimulus timeline. The deterministic stimuli (item loading, readout
+        signals and periodic sequence) are added as current pulses to their target group. The random
+        nonspecific noise targets a different random subset of neurons for every stimulus, so each of
+        them has its own generator.
+
+        Returns the list random_noise contaning the nonspecific noise signals injected into a fraction of the excitatory neurons.
+
+        """
+        import nest
 
         self.random_noise = []
+        self.random_noise_frac = []
 
         eta_exc = self.network_params["eta_exc"]
         Sigma_exc = 0.0 #self.network_params["Sigma_exc"] #0.0
-        origin = self.network_params["nonspecific_noise"]["origin"]
-
-        for i in range(self.network_params["nonspecific_noise"]["nstim"]):
-        # create the stimulus
-            cue, std_cue = noise_params(eta_exc*(self.network_params["stimulation_params"]["A_cue"]-1.0), Sigma_exc, self.network_params["neur_params"]["tau"][0], dt=self.network_params["stimulation_params"]["dt_external_stim"])
-            I_noise = nest.Create("noise_generator")
-            nest.SetStatus(I_noise, {"mean" : cue,
-                                     "std" : std_cue,
-                                     "dt" : self.network_params["stimulation_params"]["dt_external_stim"],
-                                     "origin" : origin[i],
-                                     "start" : 0.0,
-                                     "stop" : self.network_params["stimulation_params"]["T_cue"]})
-            
-            self.random_noise.append(I_noise)
-    
+        dt_stim = self.network_params["stimulation_params"]["dt_external_stim"]
+
+        self.stimuli.validate(self.p, self.simulation_params["t_sim"])
+        for ev in self.stimuli:
+            cue, std_cue = noise_params(eta_exc*(ev.amplitude-1.0), Sigma_exc, self.network_params["neur_params"]["tau"][0], dt=dt_stim)
+            if ev.kind == "nonspecific_noise":
+                if ev.onset + ev.duration <= self.t_offset:
+                    continue
+                origin = max(self.nest_time(ev.onset), self.t_trial_start)
+                I_noise = nest.Create("noise_generator")
+                nest.SetStatus(I_noise, {"mean" : cue,
+                                         "std" : std_cue,
+                                         "dt" : dt_stim,
+                                         "origin" : origin,
+                                         "start" : 0.0,
+                                         "stop" : self.nest_time(ev.onset + ev.duration) - origin})
+                self.random_noise.append(I_noise)
+                self.random_noise_frac.append(ev.frac)
+            else:
+                self.add_current_pulse(ev.target, ev.onset, ev.onset + ev.duration, cue)
 
-    def create_periodic_sequence(self):
+
+    def create_current_sources(self):
         """
-        Creation of the periodic sequence of nonspecific readout signals.
+        Compiles the current pulses of each target group into a single piecewise-constant
+        current source (step_current_generator), so that one device and one connection per
+        target neuron deliver all the deterministic stimuli of the group.
 
-        Returns the list periodic_sequence contaning the periodic signals to be injected into the network.
+        Returns the dict current_sources containing the current source of each target group.
 
         """
+        import nest
 
-        self.periodic_sequence = []
-
-        eta_exc = self.network_params["eta_exc"]
-        Sigma_exc = 0.0 #self.network_params["Sigma_exc"]
-        times = self.network_params["periodic_sequence"]["times"]
-
-        for i in range(len(times)):
-        # create the stimulus
-            cue, std_cue = noise_params(eta_exc*(self.network_params["stimulation_params"]["A_period_reac"]-1.0), Sigma_exc, self.network_params["neur_params"]["tau"][0], dt=self.network_params["stimulation_params"]["dt_external_stim"])
-            I_nspec_signal = nest.Create("noise_generator")
-            nest.SetStatus(I_nspec_signal, {"mean" : cue,
-                                    "std" : std_cue,
-                                    "dt" : self.network_params["stimulation_params"]["dt_external_stim"],
-                                    "origin" : times[i],
-                                    "start" : 0.0,
-                                    "stop" : self.network_params["stimulation_params"]["T_period_reac"]})
-            
-            self.periodic_sequence.append(I_nspec_signal)
+        self.current_sources = {}
+        for target in self.current_pulses:
+            times, values = self.current_steps(target)
+            if len(times) == 0:
+                continue
+            self.current_sources[target] = nest.Create("step_current_generator",
+                                                       params={"amplitude_times": times,
+                                                               "amplitude_values": values})
 
 
     def create_external_inputs(self):
@@ -567,14 +726,10 @@ class WMModel:
         """
 
         print("Creating network external inputs...", end = ' ')
+        self.current_pulses = {}
         self.create_background_input()
-        self.create_item_loading_signals()
-        if("nonspecific_readout_signals" in self.network_params):
-            self.create_nonspecific_readout_signals()
-        if("nonspecific_noise" in self.network_params):
-            self.create_random_nonspecific_noise()
-        if("periodic_sequence" in self.network_params):
-            self.create_periodic_sequence()
+        self.create_stimuli()
+        self.create_current_sources()
         print("Done")
 
     
@@ -583,25 +738,40 @@ class WMModel:
         Creation of the recording devices (i.e. spike recorders)
 
         """
+        import nest
 
         print("Creating network external inputs...", end = ' ')
         
         self.spike_recorders = []
         for sr in range(len(self.simulation_params["recording_params"]["pop_recorded"])):
             s = nest.Create("spike_recorder")
-            nest.SetStatus(s, {"start" : self.simulation_params["recording_params"]["spike_recording_params"]["start"]})
+            nest.SetStatus(s, {"start" : max(self.nest_time(self.spike_recording_start()), 0.0)})
 
             self.spike_recorders.append(s)
 
+        if(self.simulation_params["rate_monitor"] is not None):
+            from model.rate_monitor import RateMonitor
+            self.rate_monitor = RateMonitor(self.exc_populations + [self.inh_population],
+                                            ["sel_{}".format(i) for i in range(self.p)] + ["nonsel", "inh"],
+                                            self.t_offset, self.simulation_params["t_sim"],
+                                            self.simulation_params["rate_monitor"]["bin_size"])
+            self.rate_monitor.create()
+
         print("Done")
 
     
     def connect_populations(self):
         """
         Creation of the connections between neuron populations.
+        The time spent in each block of connections (e.g. connect_sel_sel, connect_nonsel_inh)
+        is recorded by the tracer.
 
         """
+        import nest
+        from model.connectivity import indegrees
 
+        # indegrees of the fixed_indegree rules (the ones of the network with scale 1.0 with indegree_scaling "fixed")
+        K = indegrees(self.network_params)
         #print option to be implemented
         more_print = False
         print("Connecting the neuron populations...", end = ' ')
@@ -613,7 +783,7 @@ class WMModel:
                 if more_print:
                     print("\tSource: selective population ", j+1)
                 con_dict = {'rule': 'fixed_indegree', 
-                            'indegree': int(self.f*self.c*self.network_params["N_exc"]),
+                            'indegree': K["sel"],
                             'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
                 if i==j:
                     syn_dict = {"synapse_model": 'stp_synapse',
@@ -624,7 +794,7 @@ class WMModel:
                                 "U": self.network_params["stp_params"]["U"],
                                 "u": self.network_params["stp_params"]["u0"],
                                 "x": self.network_params["stp_params"]["x0"]}
-                    nest.Connect(self.exc_populations[j], self.exc_populations[i], con_dict, syn_dict)
+                    self.timed_step("connect_sel_sel", nest.Connect, self.exc_populations[j], self.exc_populations[i], con_dict, syn_dict)
                 else:
                     syn_dict = {"synapse_model": 'stp_synapse',
                                 "weight": get_weight(self.network_params["syn_params"]["J_b"], self.network_params["neur_params"]["tau"][0]),
@@ -634,12 +804,12 @@ class WMModel:
                                 "U": self.network_params["stp_params"]["U"],
                                 "u": self.network_params["stp_params"]["u0"],
                                 "x": self.network_params["stp_params"]["x0"]}
-                    nest.Connect(self.exc_populations[j], self.exc_populations[i], con_dict, syn_dict)
+                    self.timed_step("connect_sel_sel", nest.Connect, self.exc_populations[j], self.exc_populations[i], con_dict, syn_dict)
             
             # indegrees from the other exc neurons
             if more_print:
                 print("\tSource: non-selective exc pop")
-            con_dict = {'rule': 'fixed_indegree', 'indegree': int((1.0-self.network_params["syn_params"]["gamma_0"])*self.c*(1.0-self.f*self.p)*self.network_params["N_exc"]),
+            con_dict = {'rule': 'fixed_indegree', 'indegree': K["nonsel_b"],
                         'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
             syn_dict = {"synapse_model": 'stp_synapse',
                         "weight": get_weight(self.network_params["syn_params"]["J_b"], self.network_params["neur_params"]["tau"][0]),
@@ -649,9 +819,9 @@ class WMModel:
                         "U": self.network_params["stp_params"]["U"],
                         "u": self.network_params["stp_params"]["u0"],
                         "x": self.network_params["stp_params"]["x0"]}
-            nest.Connect(self.exc_populations[-1], self.exc_populations[i], con_dict, syn_dict)
+            self.timed_step("connect_nonsel_sel", nest.Connect, self.exc_populations[-1], self.exc_populations[i], con_dict, syn_dict)
 
-            con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.network_params["syn_params"]["gamma_0"]*self.c*(1.0-self.f*self.p)*self.network_params["N_exc"]),
+            con_dict = {'rule': 'fixed_indegree', 'indegree': K["nonsel_p"],
                         'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
             syn_dict = {"synapse_model": 'stp_synapse',
                         "weight": get_weight(self.network_params["syn_params"]["J_p"], self.network_params["neur_params"]["tau"][0]),
@@ -661,17 +831,17 @@ class WMModel:
                         "U": self.network_params["stp_params"]["U"],
                         "u": self.network_params["stp_params"]["u0"],
                         "x": self.network_params["stp_params"]["x0"]}
-            nest.Connect(self.exc_populations[-1], self.exc_populations[i], con_dict, syn_dict)
+            self.timed_step("connect_nonsel_sel", nest.Connect, self.exc_populations[-1], self.exc_populations[i], con_dict, syn_dict)
 
             # indegrees from the inh pop
             if more_print:
                 print("\tSource: inh pop")
-            con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.c*self.network_params["N_inh"]),
+            con_dict = {'rule': 'fixed_indegree', 'indegree': K["inh"],
                         'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
             syn_dict = {"synapse_model": "static_synapse",
                         "weight": get_weight(-self.network_params["syn_params"]["J_EI"], self.network_params["neur_params"]["tau"][1]),
                         "delay": nest.random.uniform(min=self.network_params["syn_params"]["delay"][0], max=self.network_params["syn_params"]["delay"][1])}
-            nest.Connect(self.inh_population, self.exc_populations[i], con_dict, syn_dict)
+            self.timed_step("connect_inh_sel", nest.Connect, self.inh_population, self.exc_populations[i], con_dict, syn_dict)
 
         # connections for the inhibitory population
         if more_print:
@@ -680,32 +850,32 @@ class WMModel:
         for i in range(self.p):
             if more_print:
                 print("\tSource: selective population ", i+1)
-            con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.f*self.c*self.network_params["N_exc"]),
+            con_dict = {'rule': 'fixed_indegree', 'indegree': K["sel"],
                         'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
             syn_dict = {"synapse_model": "static_synapse",
                         "weight": get_weight(self.network_params["syn_params"]["J_IE"], self.network_params["neur_params"]["tau"][1]),
                         "delay": nest.random.uniform(min=self.network_params["syn_params"]["delay"][0], max=self.network_params["syn_params"]["delay"][1])}    
-            nest.Connect(self.exc_populations[i], self.inh_population, con_dict, syn_dict)
+            self.timed_step("connect_sel_inh", nest.Connect, self.exc_populations[i], self.inh_population, con_dict, syn_dict)
 
         # indegrees from the other exc neurons
         if more_print:
             print("\tSource: non-selective exc pop")
-        con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.c*(1.0-self.f*self.p)*self.network_params["N_exc"]),
+        con_dict = {'rule': 'fixed_indegree', 'indegree': K["nonsel"],
                     'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
         syn_dict = {"synapse_model": "static_synapse",
                     "weight": get_weight(self.network_params["syn_params"]["J_IE"], self.network_params["neur_params"]["tau"][0]),
                     "delay": nest.random.uniform(min=self.network_params["syn_params"]["delay"][0], max=self.network_params["syn_params"]["delay"][1])}  
-        nest.Connect(self.exc_populations[-1], self.inh_population, con_dict, syn_dict)
+        self.timed_step("connect_nonsel_inh", nest.Connect, self.exc_populations[-1], self.inh_population, con_dict, syn_dict)
 
         # indegrees from inh pop itself
         if more_print:
             print("\tSource: inh pop")
-        con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.c*self.network_params["N_inh"]),
+        con_dict = {'rule': 'fixed_indegree', 'indegree': K["inh"],
                     'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
         syn_dict = {"synapse_model": "static_synapse",
                     "weight": get_weight(-self.network_params["syn_params"]["J_II"], self.network_params["neur_params"]["tau"][1]),
                     "delay": nest.random.uniform(min=self.network_params["syn_params"]["delay"][0], max=self.network_params["syn_params"]["delay"][1])} 
-        nest.Connect(self.inh_population, self.inh_population, con_dict, syn_dict)
+        self.timed_step("connect_inh_inh", nest.Connect, self.inh_population, self.inh_population, con_dict, syn_dict)
 
         # connection for the non-specific exc population
 
@@ -717,7 +887,7 @@ class WMModel:
         for i in range(self.p):
             if more_print:
                 print("\tSource: selective population ", i+1)
-            con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.f*self.c*self.network_params["N_exc"]),
+            con_dict = {'rule': 'fixed_indegree', 'indegree': K["sel"],
                         'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
             syn_dict = {"synapse_model": 'stp_synapse',
                         "weight": get_weight(self.network_params["syn_params"]["J_b"], self.network_params["neur_params"]["tau"][0]),
@@ -727,12 +897,12 @@ class WMModel:
                         "U": self.network_params["stp_params"]["U"],
                         "u": self.network_params["stp_params"]["u0"],
                         "x": self.network_params["stp_params"]["x0"]}
-            nest.Connect(self.exc_populations[i], self.exc_populations[-1], con_dict, syn_dict)
+            self.timed_step("connect_sel_nonsel", nest.Connect, self.exc_populations[i], self.exc_populations[-1], con_dict, syn_dict)
 
         # indegrees from the rest of the exc pop
         if more_print:
             print("\tSource: non-selective exc pop")
-        con_dict = {'rule': 'fixed_indegree', 'indegree': int((1.0-self.network_params["syn_params"]["gamma_0"])*self.c*(1.0-self.f*self.p)*self.network_params["N_exc"]),
+        con_dict = {'rule': 'fixed_indegree', 'indegree': K["nonsel_b"],
                     'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
         syn_dict = {"synapse_model": 'stp_synapse',
                     "weight": get_weight(self.network_params["syn_params"]["J_b"], self.network_params["neur_params"]["tau"][0]),
@@ -742,9 +912,9 @@ class WMModel:
                     "U": self.network_params["stp_params"]["U"],
                     "u": self.network_params["stp_params"]["u0"],
                     "x": self.network_params["stp_params"]["x0"]}
-        nest.Connect(self.exc_populations[-1], self.exc_populations[-1], con_dict, syn_dict)
+        self.timed_step("connect_nonsel_nonsel", nest.Connect, self.exc_populations[-1], self.exc_populations[-1], con_dict, syn_dict)
 
-        con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.network_params["syn_params"]["gamma_0"]*self.c*(1.0-self.f*self.p)*self.network_params["N_exc"]),
+        con_dict = {'rule': 'fixed_indegree', 'indegree': K["nonsel_p"],
                     'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
         syn_dict = {"synapse_model": 'stp_synapse',
                     "weight": get_weight(self.network_params["syn_params"]["J_p"], self.network_params["neur_params"]["tau"][0]),
@@ -754,67 +924,147 @@ class WMModel:
                     "U": self.network_params["stp_params"]["U"],
                     "u": self.network_params["stp_params"]["u0"],
                     "x": self.network_params["stp_params"]["x0"]}
-        nest.Connect(self.exc_populations[-1], self.exc_populations[-1], con_dict, syn_dict)
+        self.timed_step("connect_nonsel_nonsel", nest.Connect, self.exc_populations[-1], self.exc_populations[-1], con_dict, syn_dict)
 
         # indegrees from the inh pop
         if more_print:
             print("\tSource: inh pop")
-        con_dict = {'rule': 'fixed_indegree', 'indegree': int(self.c*self.network_params["N_inh"]),
+        con_dict = {'rule': 'fixed_indegree', 'indegree': K["inh"],
                     'allow_autapses': self.network_params["syn_params"]["autapses"], 'allow_multapses': self.network_params["syn_params"]["multapses"]}
         syn_dict = {"synapse_model": "static_synapse",
                     "weight": get_weight(-self.network_params["syn_params"]["J_EI"], self.network_params["neur_params"]["tau"][1]),
                     "delay": nest.random.uniform(min=self.network_params["syn_params"]["delay"][0], max=self.network_params["syn_params"]["delay"][1])}
-        nest.Connect(self.inh_population, self.exc_populations[-1], con_dict, syn_dict)
+        self.timed_step("connect_inh_nonsel", nest.Connect, self.inh_population, self.exc_populations[-1], con_dict, syn_dict)
 
         print("Done")
     
     
+    def connect_populations_cached(self):
+        """
+        Connects the neuron populations using the connectivity cache (see model/connectivity_cache.py).
+        If the connectivity of the network is in the cache the connections are created in bulk from
+        the stored arrays, otherwise they are generated by generate_connectivity and then stored.
+        The connectivity is generated with NumPy in both cases, so the random numbers drawn afterwards
+        by the kernel (e.g. delays of the external inputs, noise) do not depend on the cache.
+
+        """
+        from model.connectivity_cache import cache_key, load_connectivity, save_connectivity
+        key = cache_key(self.connectivity_params())
+        entry = load_connectivity(key)
+        if entry is None:
+            print("Connectivity not found in cache.")
+            classes, arrays = self.generate_connectivity()
+            self.connect_from_arrays(classes, arrays)
+            save_connectivity(key, classes, arrays["source"], arrays["target"], arrays["delay"], arrays["cls"],
+                              structure=self.connectivity_params())
+        else:
+            print("Using cached connectivity {}.".format(key[:16]))
+            self.connect_from_arrays(*entry)
+
+
+    def generate_connectivity(self):
+        """
+        Generates the recurrent connectivity with NumPy (see model/connectivity.py), using a generator
+        seeded by the structure seed (master_seed unless structure_seed is given). The number of Python calls grows linearly with the number of
+        memories p and the connections are created by connect_from_arrays with one kernel call per
+        connection class, instead of the p*p nest.Connect calls of connect_populations.
+
+        Returns the connection classes and the dict of the connection arrays.
+
+        """
+        from model.connectivity import generate_connectivity
+        print("Generating connectivity...", end = ' ')
+        t0 = time.time()
+        rng = np.random.default_rng([self.structure_seed, 1])
+        exc_populations = [np.asarray(pop.tolist()) for pop in self.exc_populations]
+        classes, arrays = generate_connectivity(exc_populations, np.asarray(self.inh_population.tolist()),
+                                                self.network_params, self.simulation_params["dt"], rng)
+        print("Done in {:.3} s ({} connections).".format(time.time() - t0, len(arrays["source"])))
+        return classes, arrays
+
+
+    def connect_from_arrays(self, classes, arrays):
+        """
+        Creates the connections between the neurons from the arrays of the connectivity cache,
+        with a single bulk call for each connection class, whose time is recorded by the tracer
+        (e.g. connect_exc_exc_baseline). The parameters of the stp synapses are taken from the current stp_params.
+
+        """
+        import nest
+        print("Connecting the neuron populations from arrays...", end = ' ')
+        dt = self.simulation_params["dt"]
+        cls = np.asarray(arrays["cls"])
+        for k, c in enumerate(classes):
+            sel = np.nonzero(cls == k)[0]
+            n = len(sel)
+            syn_dict = {"synapse_model": c["synapse_model"],
+                        "weight": np.full(n, c["weight"]),
+                        "delay": arrays["delay"][sel]*dt}
+            if c["synapse_model"] == "stp_synapse":
+                syn_dict.update({"tau_rec": np.full(n, self.network_params["stp_params"]["tau_D"]),
+                                 "tau_fac": np.full(n, self.network_params["stp_params"]["tau_F"]),
+                                 "U": np.full(n, self.network_params["stp_params"]["U"]),
+                                 "u": np.full(n, self.network_params["stp_params"]["u0"]),
+                                 "x": np.full(n, self.network_params["stp_params"]["x0"])})
+            self.timed_step("connect_" + c.get("name", "class_{}".format(k)), nest.Connect,
+                            arrays["source"][sel].astype(np.int64), arrays["target"][sel].astype(np.int64),
+                            conn_spec="one_to_one", syn_spec=syn_dict)
+        print("Done")
+
+
     def connect_external_inputs(self):
         """
         Creation of the connections between neurons and external inputs.
 
         """
+        import nest
         print("Connecting external inputs...", end = ' ')
         
         # background input connection
         nest.Connect(self.exc_bkg_input, self.exc_population, syn_spec={"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])})
         nest.Connect(self.inh_bkg_input, self.inh_population, syn_spec={"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])})
-        # connect offset to diminish bkg exc input
-        nest.Connect(self.exc_offset, self.exc_population, syn_spec={"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])})
-
-        # item loading connection
-        #self.item_loading_signals
-        for i in range(self.network_params["item_loading"]["nstim"]):
-            nest.Connect(self.item_loading_signals[i], self.exc_populations[self.network_params["item_loading"]["pop_id"][i]],
-                         syn_spec={"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])})
-
-        # nonspecific readout signals connection
-        if("nonspecific_readout_signals" in self.network_params):
-            for i in range(self.network_params["nonspecific_readout_signals"]["nstim"]):
-                nest.Connect(self.nonspecific_readout_signals[i], self.exc_population, 
-                            syn_spec={"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])})
-
-        # random nonspecific noise
-        if("nonspecific_noise" in self.network_params):
-            con_dict = {'rule': 'fixed_total_number', 'N': int(self.network_params["nonspecific_noise"]["frac"]*self.network_params["N_exc"])}
-            syn_dict = {"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])}
-            for i in range(self.network_params["nonspecific_noise"]["nstim"]):
-                nest.Connect(self.random_noise[i], self.exc_population, con_dict, syn_dict)
-        
-        if("periodic_sequence" in self.network_params):
-            for i in range(len(self.network_params["periodic_sequence"]["times"])):
-                nest.Connect(self.periodic_sequence[i], self.exc_population, 
-                             syn_spec={"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])})
+        # deterministic stimuli (offset, item loading, readout signals, periodic sequence),
+        # one current source per target group
+        for target, source in self.current_sources.items():
+            self.connect_current_source(target, source)
 
+        self.connect_random_noise()
 
         print("Done")
 
 
+    def connect_current_source(self, target, source):
+        """
+        Connects the current source of a target group to its neurons.
+
+        """
+        import nest
+        if target == "exc":
+            target_nodes = self.exc_population
+        else:
+            target_nodes = self.exc_populations[target]
+        nest.Connect(source, target_nodes,
+                     syn_spec={"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])})
+
+
+    def connect_random_noise(self):
+        """
+        Connects the random nonspecific noise generators to a random subset of the excitatory neurons.
+
+        """
+        import nest
+        syn_dict = {"delay": nest.random.uniform(min=self.network_params["syn_params"]["delay_ext"][0], max=self.network_params["syn_params"]["delay_ext"][1])}
+        for I_noise, frac in zip(self.random_noise, self.random_noise_frac):
+            con_dict = {'rule': 'fixed_total_number', 'N': int(frac*self.network_params["N_exc"])}
+            nest.Connect(I_noise, self.exc_population, con_dict, syn_dict)
+
+
     def connect_recording_devices(self):
         """
         Creation of the connections between neurons and recording devices.
 
         """
+        import nest
         print("Connecting recording devices...", end = ' ')
         #self.spike_recorders
         for i in range(len(self.spike_recorders)):
@@ -822,6 +1072,8 @@ class WMModel:
             N_neurons_recorded = int(self.network_params["N_exc"]*self.f*self.simulation_params["recording_params"]["fraction_pop_recorded"])
             #print(self.exc_populations[pop_id][0:N_neurons_recorded])
             nest.Connect(self.exc_populations[pop_id][0:N_neurons_recorded], self.spike_recorders[i])
+        if self.rate_monitor is not None:
+            self.rate_monitor.connect()
 
         print("Done")
     
@@ -831,142 +1083,610 @@ class WMModel:
         Network build, in which neurons, external inputs and recording devices are created and connected.
 
         """
-        self.prepare_nest()
-        print("\n### NETWORK BUILD ###\n")
-        t0 = time.time()
-        print("Creating nodes...", end = " ")
-        self.create_populations()
-        self.create_external_inputs()
-        self.create_recording_devices()
-        t1 = time.time()
-        print("Nodes created in {:.2} s.".format(t1-t0))
-        print("Connecting nodes...")
-        self.connect_populations()
-        self.connect_external_inputs()
-        self.connect_recording_devices()
-        t2 = time.time()
-        print("Nodes connected in {:.3} s.".format(t2-t1))
-        print("Network built in {:.3} s.".format(t2-t0))
+        with self.tracer.span("build_network"):
+            if(self.simulation_params["resource_check"] is not None):
+                self.check_resources(self.dry_run(verbose=False), self.simulation_params["resource_check"])
+            self.timed("prepare_nest", self.prepare_nest)
+            if(self.simulation_params["snapshot"] is not None):
+                self.timed("load_snapshot", self.load_snapshot, self.simulation_params["snapshot"])
+            print("\n### NETWORK BUILD ###\n")
+            t0 = time.time()
+            print("Creating nodes...", end = " ")
+            self.timed("create_populations", self.create_populations)
+            self.timed("create_external_inputs", self.create_external_inputs)
+            self.timed("create_recording_devices", self.create_recording_devices)
+            t1 = time.time()
+            print("Nodes created in {:.2} s.".format(t1-t0))
+            print("Connecting nodes...")
+            if(self.simulation_params["connection_method"]=="arrays" and self.simulation_params["connectivity_cache"]==True):
+                self.timed("connect_populations", self.connect_populations_cached)
+            elif(self.simulation_params["connection_method"]=="arrays"):
+                self.timed("connect_populations", lambda: self.connect_from_arrays(*self.generate_connectivity()))
+            else:
+                self.timed("connect_populations", self.connect_populations)
+            self.timed("connect_external_inputs", self.connect_external_inputs)
+            self.timed("connect_recording_devices", self.connect_recording_devices)
+            t2 = time.time()
+            print("Nodes connected in {:.3} s.".format(t2-t1))
+            print("Network built in {:.3} s.".format(t2-t0))
+            if(self.simulation_params["snapshot"] is not None):
+                self.timed("apply_snapshot", self.apply_snapshot)
+            if(self.simulation_params["recording_params"]["stp_recording"]==True):
+                self.timed("prepare_stp_recording", self.prepare_stp_recording)
+
+
+    def dry_run(self, rate_exc=5.0, rate_inh=10.0, calibration=None, verbose=True):
+        """
+        Estimates the resources needed to build and simulate the network without building it
+        (see model/estimate.py): connections per projection and synapse model, memory in total
+        and per thread, volume of the recordings and wall-clock time of build and simulation.
+
+        Parameters
+        ----------
+            rate_exc, rate_inh : float
+                Expected mean firing rate of the excitatory and inhibitory neurons [spikes/s].
+            calibration : dict or list
+                Coefficients of the time model, or list of trace.json files of previous runs
+                on which they are calibrated (see model/estimate.py).
+            verbose : bool
+                If True, the estimate is printed.
+
+        Returns
+        -------
+            est : dict
+                The estimate.
+
+        """
+        from model.estimate import estimate, calibrate
+        if isinstance(calibration, (list, tuple)):
+            calibration = calibrate(calibration)
+        est = estimate(self.network_params, self.simulation_params, self.stimuli, self.t_offset,
+                       rate_exc, rate_inh, calibration)
+        if verbose:
+            print("\n### DRY RUN ###\n")
+            for pr in est["projections"]:
+                print("{:>14} -> {:<9} {:<15} {:>14,}".format(pr["source"], pr["target"], pr["synapse_model"], pr["n_connections"]))
+            print("Connections: {}".format(", ".join("{} {:,}".format(model, n) for model, n in est["n_connections"].items())))
+            print("Memory: {:.2f} GB ({:.2f} GB per thread), spike recording {:.1f} MB, STP files {:.1f} MB".format(
+                est["memory"]["total"]/1e9, est["memory"]["per_thread"]/1e9, est["recording"]["spike_files"]/1e6, est["recording"]["stp_files"]/1e6))
+            print("Estimated wall-clock time: build {:.1f} s, simulation {:.1f} s".format(est["time"]["build"], est["time"]["simulate"]))
+        return est
+
+
+    def check_resources(self, est, mode = "warn"):
+        """
+        Compares the memory estimated by dry_run with the memory available on the machine.
+
+        Parameters
+        ----------
+            est : dict
+                Estimate returned by dry_run.
+            mode : str
+                "warn" to print a warning, "refuse" to raise a MemoryError if the network does not fit the machine.
+
+        """
+        from model.estimate import available_memory
+        available = available_memory()
+        if available is None:
+            return
+        needed = est["memory"]["total"]
+        if needed > available:
+            message = "The network needs about {:.2f} GB, only {:.2f} GB are available.".format(needed/1e9, available/1e9)
+            if mode == "refuse":
+                raise MemoryError(message)
+            print("WARNING: " + message)
+        elif needed > 0.8*available:
+            print("WARNING: the network needs about {:.2f} GB, {:.0f}% of the available memory.".format(needed/1e9, 100.0*needed/available))
+
+
+    def timed(self, phase, function, *args, **kwargs):
+        """
+        Calls function with the given arguments within a span of the tracer named phase.
+
+        Returns the value returned by function.
+
+        """
+        with self.tracer.span(phase):
+            return function(*args, **kwargs)
+
+
+    def timed_step(self, phase, function, *args, **kwargs):
+        """
+        As timed, for the phases repeated many times in a run (e.g. the steps of the simulation):
+        the spans are aggregated in one record per phase, with their count and overall time.
+
+        """
+        with self.tracer.span(phase, aggregate=True):
+            return function(*args, **kwargs)
+
+
+    @property
+    def timings(self):
+        """
+        Wall-clock time [s] spent in each phase of the run, summed over the spans with the same name.
+
+        """
+        return self.tracer.totals()
+
+
+    def save_trace(self, path = None):
+        """
+        Save the trace of the phases of the run in the JSON file 'trace.json' (see model/instrumentation.py).
+
+        Parameters
+        ----------
+            path : str
+                Directory in which the file is written. If None, the data directory.
+
+        """
+        if path is None:
+            path = self.simulation_params['data_path']
+        metadata = {"threads": self.simulation_params["threads"],
+                    "dt": self.simulation_params["dt"],
+                    "t_sim": self.simulation_params["t_sim"],
+                    "N_exc": self.network_params["N_exc"],
+                    "N_inh": self.network_params["N_inh"],
+                    "p": self.p}
+        self.tracer.save(path + "trace.json", metadata)
 
 
     def simulate_network(self):
         """
         Network simulation. If STP params are not recorded the network is simply simulated.
         Otherwise the simulation proceeds in steps in order to record STP params.
+        If the rate monitor is enabled, the simulation proceeds in chunks (or in the steps of the
+        STP recording) and the spikes of the populations are binned after each of them; the stopping
+        criteria of early_stop, if any, are evaluated after each chunk (see check_early_stop).
 
         """
-        print("\n### NETWORK SIMULATION ###")
-
-        if(self.simulation_params["recording_params"]["stp_recording"]==False):
-            t0 = time.time()
-            nest.Simulate(self.simulation_params["t_sim"])
-            t1 = time.time()
-            print("Network simulated in {} s.".format(t1-t0))
-        else:
-            nest.SetKernelStatus({"print_time" : False})
-            t0 = 0.0
-            t_rec = 0.0
-            record_interval = self.simulation_params["recording_params"]["stp_record_interval"]
-            self.sim_steps = np.arange(record_interval, self.simulation_params["t_sim"]+record_interval, record_interval)
-            for s in range(len(self.sim_steps)):
-                print("\nStep {}/{} ({} s / {} s)".format(s+1, len(self.sim_steps), self.sim_steps[s], self.sim_steps[-1]))
-                dum_start = time.time()
-                nest.Simulate(record_interval)
-                t0 += time.time() - dum_start
+        import nest
+        with self.tracer.span("simulate_network") as span:
+            print("\n### NETWORK SIMULATION ###")
+            self.early_stop = None
+            if self.simulation_params["t_sim"] <= self.t_offset:
+                raise ValueError("t_sim must be larger than the time of the snapshot ({} ms).".format(self.t_offset))
+
+            if(self.simulation_params["recording_params"]["stp_recording"]==False and self.rate_monitor is None):
+                t0 = time.time()
+                self.timed("simulate", nest.Simulate, self.simulation_params["t_sim"] - self.t_offset)
+                t1 = time.time()
+                print("Network simulated in {} s.".format(t1-t0))
+            elif(self.simulation_params["recording_params"]["stp_recording"]==False):
+                t0 = time.time()
+                edges = np.append(np.arange(self.t_offset, self.simulation_params["t_sim"], self.simulation_params["rate_monitor"]["drain_interval"]),
+                                  self.simulation_params["t_sim"])
+                for t_chunk in np.diff(edges):
+                    self.timed_step("simulate", nest.Simulate, t_chunk)
+                    self.timed_step("rate_monitor", self.rate_monitor.drain, self.protocol_time)
+                    if self.check_early_stop():
+                        break
+                t1 = time.time()
+                print("Network simulated in {} s.".format(t1-t0))
+            else:
+                nest.SetKernelStatus({"print_time" : False})
+                t0 = 0.0
+                t_rec = 0.0
+                record_interval = self.simulation_params["recording_params"]["stp_record_interval"]
+                self.sim_steps = np.arange(self.t_offset+record_interval, self.simulation_params["t_sim"]+record_interval, record_interval)
+                self.open_stp_store()
+                for s in range(len(self.sim_steps)):
+                    print("\nStep {}/{} ({} s / {} s)".format(s+1, len(self.sim_steps), self.sim_steps[s], self.sim_steps[-1]))
+                    dum_start = time.time()
+                    self.timed_step("simulate", nest.Simulate, record_interval)
+                    t0 += time.time() - dum_start
+                    dum_start = time.time()
+                    self.timed_step("record_stp", self.record_std_params, dt = self.sim_steps[s])
+                    t_rec +=  time.time() - dum_start
+                    if self.rate_monitor is not None:
+                        self.timed_step("rate_monitor", self.rate_monitor.drain, self.protocol_time)
+                        if self.check_early_stop():
+                            break
                 dum_start = time.time()
-                self.record_std_params(dt = self.sim_steps[s])
+                self.timed_step("record_stp", self.close_stp_store)
                 t_rec +=  time.time() - dum_start
-            dum_start = time.time()
-            self.merge_std_data()
-            t_rec +=  time.time() - dum_start
-            print("\nRecording of STP params in {} s.".format(t_rec))
-            print("Network simulated in {} s.".format(t0))
-            print("Overall simulation took {} s.".format(t0+t_rec))
+                print("\nRecording of STP params in {} s.".format(t_rec))
+                print("Network simulated in {} s.".format(t0))
+                print("Overall simulation took {} s.".format(t0+t_rec))
+            span["early_stop"] = self.early_stop
+
+
+    def check_early_stop(self):
+        """
+        Evaluates the stopping criteria of the simulation parameter early_stop on the population rates
+        of the rate monitor (see model/early_stop.py). If one of them is met, its name and the time
+        at which the simulation stops are stored in early_stop.
+
+        Returns True if the simulation has to stop.
+
+        """
+        import nest
+        from model.early_stop import check
+        if(self.simulation_params["early_stop"] is None):
+            return False
+        t = self.protocol_time(nest.GetKernelStatus("biological_time"))
+        reason = check(self.simulation_params["early_stop"]["criteria"], self.rate_monitor, t)
+        if reason is None:
+            return False
+        self.early_stop = {"reason": reason, "time": t}
+        print("\nSimulation stopped at {} ms: {}.".format(t, reason))
+        return True
+
+
+    def connectivity_params(self):
+        """
+        Returns the parameters that determine the network connectivity, which must be the same
+        in the network that saves a snapshot and in the one that restores it, and which
+        identify the connectivity in the cache (see model/connectivity_cache.py).
+        The connectivity generated with NumPy depends on the structure seed, the one generated by
+        the kernel on master_seed.
+
+        """
+        if self.simulation_params["connection_method"] == "arrays":
+            seed = {"structure_seed": self.structure_seed}
+        else:
+            seed = {"master_seed": self.simulation_params["master_seed"], "structure_seed": self.structure_seed}
+        return {"N_exc": self.network_params["N_exc"],
+                "N_inh": self.network_params["N_inh"],
+                "p": self.p,
+                "f": self.f,
+                "c": self.c,
+                "overlap": self.network_params["overlap"],
+                "syn_params": self.network_params["syn_params"],
+                "tau": self.network_params["neur_params"]["tau"],
+                **seed,
+                "threads": self.simulation_params["threads"],
+                "dt": self.simulation_params["dt"],
+                "connection_method": self.simulation_params["connection_method"]}
+
+
+    def save_snapshot(self, fn = None):
+        """
+        Saves the dynamic state of the network at the current time in a .npz file, so that
+        the simulation can be continued from it by other instances of the model (e.g. to run
+        different stimulation protocols after the same spontaneous activity), setting
+        the simulation parameter 'snapshot' to the file name.
+        The snapshot contains the membrane potential and the synaptic currents of all the neurons
+        and the STP variables u, x and t_ls of the outgoing synapses of every excitatory neuron.
+
+        Parameters
+        ----------
+            fn : str
+                Name of the snapshot file. If None, 'snapshot.npz' in the data directory.
+
+        """
+        import nest
+        with self.tracer.span("save_snapshot"):
+            if fn is None:
+                fn = self.simulation_params['data_path'] + "snapshot.npz"
+            t = self.protocol_time(nest.GetKernelStatus("biological_time"))
+            print("Saving network snapshot at {} ms...".format(t), end = ' ')
+            neurons = self.exc_population + self.inh_population
+            state = neurons.get(["V_m", "I_syn_ex", "I_syn_in"])
+            conns, rows = self.first_stp_synapses(self.exc_population)
+            stp_state = conns.get(["u", "x", "t_ls"])
+            np.savez(fn, t = t,
+                     V_m = np.asarray(state["V_m"]),
+                     I_syn_ex = np.asarray(state["I_syn_ex"]),
+                     I_syn_in = np.asarray(state["I_syn_in"]),
+                     u = np.atleast_1d(stp_state["u"])[rows],
+                     x = np.atleast_1d(stp_state["x"])[rows],
+                     t_ls = self.protocol_time(np.atleast_1d(stp_state["t_ls"])[rows]),
+                     structure = json.dumps(self.connectivity_params()))
+            print("Done")
+
+
+    def load_snapshot(self, fn):
+        """
+        Loads a snapshot saved by save_snapshot and checks that it was taken from a network
+        with the same connectivity. The simulation continues from the snapshot time, the state
+        is set by apply_snapshot once the network is built.
+
+        """
+        with np.load(fn) as data:
+            self.snapshot = {key: data[key] for key in data.files}
+        structure = json.loads(str(self.snapshot["structure"]))
+        current = json.loads(json.dumps(self.connectivity_params()))
+        mismatch = [key for key in current if structure.get(key) != current[key]]
+        if mismatch:
+            raise ValueError("Snapshot {} was taken from a different network (parameters {} differ).".format(fn, mismatch))
+        self.t_offset = float(self.snapshot["t"])
+        print("Simulation continues from the snapshot at {} ms.".format(self.t_offset))
+
+
+    def apply_snapshot(self):
+        """
+        Sets the state of the neurons and of the stp synapses to the one of the loaded snapshot.
+        The state of the outgoing synapses of each excitatory neuron is set in a single bulk call.
+        The state of the refractory period, the spikes in transit (i.e. not yet delivered because of
+        the synaptic delays) and the state of the random generators of the noise sources cannot be
+        accessed in NEST and are not restored.
+
+        """
+        print("Restoring network snapshot...", end = ' ')
+        neurons = self.exc_population + self.inh_population
+        neurons.set({"V_m": self.snapshot["V_m"].tolist(),
+                     "I_syn_ex": self.snapshot["I_syn_ex"].tolist(),
+                     "I_syn_in": self.snapshot["I_syn_in"].tolist()})
+        conns, idx = self.stp_connections()
+        conns.set({"u": self.snapshot["u"][idx].tolist(),
+                   "x": self.snapshot["x"][idx].tolist(),
+                   "t_ls": self.nest_time(self.snapshot["t_ls"][idx]).tolist()})
+        print("Done")
+
+
+    def stp_connections(self):
+        """
+        Returns all the stp synapses of the network and, for each of them, the index of
+        its source in the excitatory population. The connections are cached, since
+        they are retrieved at every reset of the STP state.
+
+        """
+        import nest
+        if not hasattr(self, "stp_conns"):
+            self.stp_conns = nest.GetConnections(source=self.exc_population, synapse_model='stp_synapse')
+            # excitatory neurons have contiguous ids
+            self.stp_conns_source = np.asarray(self.stp_conns.get("source")) - self.exc_population.tolist()[0]
+        return self.stp_conns, self.stp_conns_source
+
+
+    def reset_state(self):
+        """
+        Resets the state of the neurons and of the stp synapses at the beginning of a trial, with one
+        bulk call for the neurons and one for the synapses. If a snapshot is loaded its state
+        is restored, otherwise the initial values of the parameters are used.
+
+        """
+        if hasattr(self, "snapshot"):
+            self.apply_snapshot()
+            return
+        print("Resetting network state...", end = ' ')
+        for population, i in [(self.exc_population, 0), (self.inh_population, 1)]:
+            population.set({"V_m": self.network_params["neur_params"]["V_m"][i],
+                            "I_syn_ex": 0.0,
+                            "I_syn_in": 0.0})
+        conns, idx = self.stp_connections()
+        conns.set({"u": self.network_params["stp_params"]["u0"],
+                   "x": self.network_params["stp_params"]["x0"],
+                   "t_ls": self.t_trial_start})
+        print("Done")
+
+
+    def update_external_inputs(self):
+        """
+        Re-times and re-targets the external inputs according to the current stimulus timeline,
+        without creating the network again. The background generators and the current sources
+        are reused (a current source is created only for a target group not stimulated before),
+        new generators are created only for the random nonspecific noise.
+
+        """
+        import nest
+        print("Updating network external inputs...", end = ' ')
+        start = max(self.nest_time(self.network_params["background_input"]["start"]), self.t_trial_start)
+        stop = max(self.nest_time(self.network_params["background_input"]["stop"]), start)
+        self.exc_bkg_input.set({"start": start, "stop": stop})
+        self.inh_bkg_input.set({"start": start, "stop": stop})
+
+        # the noise generators of the previous trial are switched off
+        for I_noise in self.random_noise:
+            I_noise.set({"start": 0.0, "stop": 0.0})
+        self.current_pulses = {}
+        self.add_background_offset()
+        self.create_stimuli()
+        self.connect_random_noise()
+
+        for target in set(self.current_pulses) | set(self.current_sources):
+            times, values = self.current_steps(target)
+            # the current of the previous trial is switched off at the beginning of the trial
+            t0 = self.t_trial_start + self.simulation_params["dt"]
+            if len(times) == 0 or times[0] > t0:
+                times = [t0] + times
+                values = [0.0] + values
+            if target in self.current_sources:
+                self.current_sources[target].set({"amplitude_times": times, "amplitude_values": values})
+            else:
+                self.current_sources[target] = nest.Create("step_current_generator",
+                                                           params={"amplitude_times": times,
+                                                                   "amplitude_values": values})
+                self.connect_current_source(target, self.current_sources[target])
+        print("Done")
+
+
+    def run_trials(self, trials, save = True):
+        """
+        Runs several trials in the network built by build_network, so that the network is created
+        and connected only once. Before every trial the stimuli of the trial are set, the external inputs
+        are re-timed (see update_external_inputs) and the state of the network is reset (see reset_state).
+        Each trial is simulated for t_sim (minus the snapshot time, if any), with stimulus times
+        relative to the beginning of the trial.
+        The spikes emitted at the end of a trial and not yet delivered because of the synaptic delays
+        reach their targets at the beginning of the following trial.
+
+        Parameters
+        ----------
+            trials : list
+                List of trials. Each trial is a list of calls to the add_* functions of the stimuli, as
+                {"method": "add_item_loading_signals", "kwargs": {"pop_id": [0], "origin": [1000.0]}}.
+            save : bool
+                If True, the parameters and the spike data of each trial are saved in
+                the sub-directory 'trial_XXXX' of the data directory.
+
+        Returns
+        -------
+            paths : list
+                Data directories of the trials.
+
+        """
+        import nest
+        if(self.simulation_params["recording_params"]["stp_recording"]==True):
+            raise ValueError("STP recording is not supported in multi-trial runs, the STP variables can be reconstructed from the spike data.")
+
+        paths = []
+        for n, trial in enumerate(trials):
+            print("\n### TRIAL {}/{} ###".format(n+1, len(trials)))
+            self.t_trial_start = nest.GetKernelStatus("biological_time")
+            self.stimuli = StimulusTimeline()
+            for key in ["item_loading", "nonspecific_readout_signals", "nonspecific_noise", "periodic_sequence", "stimulus_timeline"]:
+                self.network_params.pop(key, None)
+            for call in trial:
+                getattr(self, call["method"])(**call.get("kwargs", {}))
+
+            self.timed("update_external_inputs", self.update_external_inputs)
+            self.timed("reset_state", self.reset_state)
+            if self.rate_monitor is not None:
+                self.rate_monitor.reset()
+            for sr in self.spike_recorders:
+                sr.set({"n_events": 0,
+                        "start": max(self.nest_time(self.spike_recording_start()), self.t_trial_start)})
+            self.simulate_network()
+
+            path = self.simulation_params['data_path'] + "trial_{:04d}/".format(n)
+            if save:
+                os.makedirs(path, exist_ok=True)
+                self.save_params(path)
+                self.save_spike_data(path)
+                if(self.network_params["overlap"] and os.path.isfile(self.simulation_params['data_path'] + "selective_pop_ids.dat")):
+                    shutil.copy(self.simulation_params['data_path'] + "selective_pop_ids.dat", path)
+            paths.append(path)
+        return paths
+
+
+    def prepare_stp_recording(self):
+        """
+        Resolves the synapses sampled by record_std_params. For each recorded neuron the first
+        outgoing stp_synapse is taken, since the STP parameters are the same for all the synapses of the neuron.
+        The outgoing synapses of the sampled neurons of each population are cached in a single
+        SynapseCollection, together with the rows of the sampled synapses and preallocated arrays
+        for the recorded values, so that every recording step needs only one bulk call to the
+        kernel per population.
+
+        """
+        print("Resolving synapses for STP recording...", end = ' ')
+        dum = int(self.network_params["N_exc"]*self.f*self.simulation_params["recording_params"]["stp_fraction_recorded"])
+        self.stp_recorded = {}
+        for npop in self.simulation_params["recording_params"]["stp_pop_recorded"]:
+            neuronpop = self.exc_populations[npop][0:dum]
+            synapses, rows = self.first_stp_synapses(neuronpop)
+            ends = synapses.get(["source", "target"])
+            self.stp_recorded[npop] = {"neurons": neuronpop,
+                                       "synapses": synapses,
+                                       "rows": rows,
+                                       "source": np.atleast_1d(ends["source"])[rows],
+                                       "target": np.atleast_1d(ends["target"])[rows],
+                                       "x": np.zeros(dum),
+                                       "u": np.zeros(dum),
+                                       "t_last_spike": np.zeros(dum)}
+        print("Done")
+
+
+    def first_stp_synapses(self, neurons):
+        """
+        Returns the SynapseCollection of the outgoing stp_synapses of the neurons and the index in it
+        of the first synapse of each neuron, in the order of neurons. Since the STP variables depend
+        only on the presynaptic spikes, this synapse carries the STP state of all the outgoing
+        synapses of the neuron. The state is read with a bulk get on the collection, from which
+        the rows of the first synapses are taken.
+
+        """
+        import nest
+        neuron_ids = np.asarray(neurons.tolist())
+        conns = nest.GetConnections(source=neurons, synapse_model='stp_synapse')
+        conn_sources = np.atleast_1d(conns.get("source"))
+        # first connection of every source neuron, in the order of neurons
+        unique_sources, first_idx = np.unique(conn_sources, return_index=True)
+        pos = np.searchsorted(unique_sources, neuron_ids)
+        pos[pos == len(unique_sources)] = 0
+        if np.any(unique_sources[pos] != neuron_ids):
+            raise ValueError("Some neurons have no outgoing stp_synapse.")
+        return conns, first_idx[pos]
+
+
+    def open_stp_store(self):
+        """
+        Opens the columnar store of the STP recording (see model/stp_store.py), in which
+        a (time x neuron) array for each of x, u and t_last_spike is preallocated
+        for every selective population recorded.
+
+        """
+        from model.stp_store import STPWriter
+        if not hasattr(self, "stp_recorded"):
+            self.prepare_stp_recording()
+        self.stp_writers = {}
+        for npop, rec in self.stp_recorded.items():
+            self.stp_writers[npop] = STPWriter(self.simulation_params['data_path'] + "stp_params/", npop,
+                                               self.sim_steps, rec["source"], rec["target"])
 
 
     def record_std_params(self, dt = 0.0):
         """
         Recording function for the STP params. It is possible to record a fraction of the neuron population.
         Only a synapse per neuron is recorded since the STP parameters are the same for all the synapses of the neuron.
+        The synapses are resolved once by prepare_stp_recording and their state is read with a single bulk call.
 
-        Returns a csv file for every simulation step in the folder 'data_path/stp_params'
+        The values are appended as a new row of the STP store opened by open_stp_store.
         """
-        print("\nExtracting stp params...", end = ' ')
+        print("\nExtracting stp params at {} ms...".format(dt), end = ' ')
         start = time.time()
-        dum = int(self.network_params["N_exc"]*self.f*self.simulation_params["recording_params"]["stp_fraction_recorded"])
-        for npop in self.simulation_params["recording_params"]["stp_pop_recorded"]:
-            neuronpop = self.exc_populations[npop][0:dum]
-            x = []; u = []; target = []; source = []; t = []; t_lastspike =[]
-            for i in range(dum):
-                conn = nest.GetConnections(synapse_model='stp_synapse', source=neuronpop[i])[0]
-                x.append(conn.get("x"))
-                u.append(conn.get("u"))
-                target.append(conn.get("target"))
-                source.append(conn.get("source"))
-                t.append(dt)
-                t_lastspike.append(nest.GetStatus(neuronpop[i], "t_spike")[0])
-            dataset = {"time": t, "source": source, "target": target, "x": x, "u": u, "t_last_spike": t_lastspike}
-            data = pd.DataFrame(dataset)
-            data.to_csv(self.simulation_params['data_path'] +"stp_params/"+ "stp_pop_"+str(npop)+"_"+str(int(dt))+".csv", index=False)
+        for npop, rec in self.stp_recorded.items():
+            status = rec["synapses"].get(["x", "u"])
+            rec["x"][:] = np.atleast_1d(status["x"])[rec["rows"]]
+            rec["u"][:] = np.atleast_1d(status["u"])[rec["rows"]]
+            rec["t_last_spike"][:] = rec["neurons"].get("t_spike")
+            # t_spike is negative if the neuron has not fired since the kernel was reset
+            spiked = rec["t_last_spike"] >= 0.0
+            rec["t_last_spike"][spiked] = self.protocol_time(rec["t_last_spike"][spiked])
+            self.stp_writers[npop].append(rec["x"], rec["u"], rec["t_last_spike"])
         
         stop = time.time()
         print("Done in {} s: ".format(stop-start))
     
 
-    def merge_std_data(self):
+    def close_stp_store(self):
         """
-        Merges the STD csv files that are produced for every step into a single csv file per selective population recorded.
-        Finally removes the old csv data.
+        Flushes and closes the STP store.
 
         """
-        for npop in self.simulation_params["recording_params"]["stp_pop_recorded"]:
-            csvlist = [self.simulation_params['data_path'] +"stp_params/"+ "stp_pop_"+str(npop)+"_"+str(int(self.sim_steps[s]))+".csv" for s in range(len(self.sim_steps))]
-            df = pd.concat(map(pd.read_csv, csvlist), ignore_index=True)
-            df.to_csv(self.simulation_params['data_path'] +"stp_params/"+"stp_params_tot_"+str(npop)+".csv")
-            [os.remove(oldcsv) for oldcsv in csvlist]
+        for writer in self.stp_writers.values():
+            writer.close()
             
 
-    def raster_plot(self):
+    def raster_plot(self, mode="auto"):
         """
         Simple raster plot of the excitatory selective population.
         Also the external inputs are indicated by using vertical shading.
 
+        Parameters
+        ----------
+        mode : str
+            "markers" (a marker per spike), "density" (image of the binned spikes) or "auto",
+            in which the mode is chosen from the number of spikes (see model/raster.py).
+
         """
+        import matplotlib.pyplot as plt
+        from model.raster import draw_raster
         axfont=19
         title=20
         fig, ax = plt.subplots()
         plt.title("Raster plot", fontsize=title)
         colors = ["blue", "red", "green", "orange", "olive"]
+        layers = []
         for i in range(len(self.spike_recorders)):
             sr = self.spike_recorders[i].get("events")
-            ax.plot(sr["times"], sr["senders"], '.', color = colors[i%len(colors)], label="Selective population {}".format(self.simulation_params["recording_params"]["pop_recorded"][i]))
+            senders = np.asarray(sr["senders"])
+            layers.append({"y": senders, "times": self.protocol_time(np.asarray(sr["times"])),
+                           "y_range": (senders.min(), senders.max() + 1) if len(senders) > 0 else (0, 1),
+                           "color": colors[i%len(colors)],
+                           "label": "Selective population {}".format(self.simulation_params["recording_params"]["pop_recorded"][i])})
+        t_start = max(self.simulation_params["recording_params"]["spike_recording_params"]["start"], self.t_offset)
+        draw_raster(ax, layers, t_start, self.simulation_params["t_sim"], mode)
+        ranges = [layer["y_range"] for layer in layers if len(layer["y"]) > 0]
+        ax.set_ylim((min(r[0] for r in ranges), max(r[1] for r in ranges)) if ranges else (0, 1))
         ax.set_ylabel("# cell", fontsize=axfont)
         ax.set_xlabel("Time [ms]", fontsize=axfont)
         ax.tick_params(labelsize=axfont)
-        for i in range(self.network_params["item_loading"]["nstim"]):
-            if(i==0):
-                ax.axvspan(self.network_params["item_loading"]["origin"][i], self.network_params["item_loading"]["origin"][i]+self.network_params["stimulation_params"]["T_cue"], alpha=0.5, color='grey', label="Item Loading")
-            else:
-                ax.axvspan(self.network_params["item_loading"]["origin"][i], self.network_params["item_loading"]["origin"][i]+self.network_params["stimulation_params"]["T_cue"], alpha=0.5, color='grey')
-        if("nonspecific_readout_signals" in self.network_params):
-            for i in range(self.network_params["nonspecific_readout_signals"]["nstim"]):
-                if(i==0):
-                    ax.axvspan(self.network_params["nonspecific_readout_signals"]["origin"][i], self.network_params["nonspecific_readout_signals"]["origin"][i]+self.network_params["stimulation_params"]["T_reac"], alpha=0.5, color='cornflowerblue', label="Readout signal")
-                else:
-                    ax.axvspan(self.network_params["nonspecific_readout_signals"]["origin"][i], self.network_params["nonspecific_readout_signals"]["origin"][i]+self.network_params["stimulation_params"]["T_reac"], alpha=0.5, color='cornflowerblue')
-        if("nonspecific_noise" in self.network_params):
-            for i in range(self.network_params["nonspecific_noise"]["nstim"]):
-                if(i==0):
-                    ax.axvspan(self.network_params["nonspecific_noise"]["origin"][i], self.network_params["nonspecific_noise"]["origin"][i]+self.network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise', label="Noise")
-                else:
-                    ax.axvspan(self.network_params["nonspecific_noise"]["origin"][i], self.network_params["nonspecific_noise"]["origin"][i]+self.network_params["stimulation_params"]["T_cue"], alpha=0.5, color='turquoise')
-        if("periodic_sequence" in self.network_params):
-            for i in range(len(self.network_params["periodic_sequence"]["times"])):
-                if(i==0):
-                    ax.axvspan(self.network_params["periodic_sequence"]["times"][i], self.network_params["periodic_sequence"]["times"][i]+self.network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey', label="Periodic stimuli")
-                else:
-                    ax.axvspan(self.network_params["periodic_sequence"]["times"][i], self.network_params["periodic_sequence"]["times"][i]+self.network_params["stimulation_params"]["T_period_reac"], alpha=0.5, color='lightgrey')
-
+        shade_stimuli(ax, self.stimuli, {"item_loading": {"color": "grey", "label": "Item Loading"},
+                                         "nonspecific_readout_signal": {"color": "cornflowerblue", "label": "Readout signal"},
+                                         "nonspecific_noise": {"color": "turquoise", "label": "Noise"},
+                                         "periodic_sequence": {"color": "lightgrey", "label": "Periodic stimuli"}})
 
         lines, labels = ax.get_legend_handles_labels()
         ax.legend(lines, labels, fontsize=axfont, loc = 'upper right')
@@ -39,3 +39,45 @@ def noise_params(mu_ext, sigma_ext, tau_m, dt=0.1, C_m=250.):
     return (C_m / tau_m) * mu_ext, math.sqrt(2/(tau_m*dt))*C_m*sigma_ext
 
 
+
+
+def piecewise_constant(pulses):
+    """
+    Sums rectangular current pulses into a single piecewise-constant current,
+    as the one generated by a NEST step_current_generator.
+
+    Parameters
+    ----------
+    pulses
+        List of (t_on, t_off, amplitude) tuples. The pulse is active from t_on to t_off;
+        t_off can be math.inf for a pulse that is never switched off.
+
+    Output
+    -------
+    times
+        Sorted times at which the current changes.
+    values
+        Amplitude of the current from each of the times on.
+    """
+
+    edges = {}
+    for t_on, t_off, amplitude in pulses:
+        if t_off <= t_on:
+            continue
+        edges[t_on] = edges.get(t_on, 0.0) + amplitude
+        if not math.isinf(t_off):
+            edges[t_off] = edges.get(t_off, 0.0) - amplitude
+
+    times = []
+    values = []
+    current = 0.0
+    for t in sorted(edges):
+        current += edges[t]
+        # avoid residuals of the floating point sum when all the pulses are off
+        if abs(current) < 1e-12:
+            current = 0.0
+        if values and values[-1] == current:
+            continue
+        times.append(t)
+        values.append(current)
+    return times, values
@@ -0,0 +1,191 @@
+"""
+Persistent cache for NESTML-generated modules
+=============================================
+
+The NESTML code generation and compilation of the STP synapse takes much
+longer than building the network itself. This module keeps the compiled
+extension module on disk, in a directory keyed by a hash of the NESTML
+source, of the code generation options and of the NEST and NESTML versions,
+so that the module is built only once and later runs just install it.
+
+The cache directory defaults to ``~/.cache/wm_spiking_network/nestml`` and
+can be changed through the environment variable ``WM_NESTML_CACHE``.
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+NESTML_CACHE_DIR = os.environ.get("WM_NESTML_CACHE",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "wm_spiking_network", "nestml"))
+
+# suffix appended by NESTML to the name of the generated models
+NESTML_SUFFIX = "_nestml"
+
+
+def _package_version(name):
+    """
+    Returns the installed version of a Python distribution, None if it is not available.
+
+    """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def _nest_version():
+    """
+    Returns the version of the NEST simulator in use.
+
+    """
+    import nest
+    if hasattr(nest, "__version__"):
+        return str(nest.__version__)
+    if hasattr(nest, "build_info"):
+        return str(nest.build_info["version"])
+    return str(nest.version())
+
+
+def model_name_from_source(nestml_model):
+    """
+    Returns the name of the model defined in a NESTML source string.
+
+    """
+    match = re.search(r"^\s*model\s+(\w+)\s*:", nestml_model, re.MULTILINE)
+    if match is None:
+        raise ValueError("No NESTML model definition found in the given source.")
+    return match.group(1)
+
+
+def cache_key(nestml_model, codegen_opts=None):
+    """
+    Computes the hash identifying a compiled module.
+
+    Parameters
+    ----------
+    nestml_model : str
+        NESTML source of the model.
+    codegen_opts : dict
+        Code generation options passed to NESTML.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal SHA-256 digest of the source, options and NEST/NESTML versions.
+
+    """
+    h = hashlib.sha256()
+    h.update(nestml_model.encode("utf-8"))
+    h.update(json.dumps(codegen_opts or {}, sort_keys=True).encode("utf-8"))
+    h.update(str(_nest_version()).encode("utf-8"))
+    h.update(str(_package_version("pynestml")).encode("utf-8"))
+    return h.hexdigest()
+
+
+def generate_code_for(nestml_model, codegen_opts=None, cache_dir=None):
+    """
+    Cached replacement of ``NESTCodeGeneratorUtils.generate_code_for`` for a single model.
+    If the module is already in the cache the code generation is skipped, otherwise the
+    module is generated, compiled and stored in the cache.
+    In both cases the install directory is added to the library search path, so that
+    ``nest.Install(module_name)`` can be called right after.
+
+    Parameters
+    ----------
+    nestml_model : str
+        NESTML source of the model.
+    codegen_opts : dict
+        Code generation options passed to NESTML.
+    cache_dir : str
+        Cache directory. If None, NESTML_CACHE_DIR is used.
+
+    Returns
+    -------
+    module_name : str
+        Name of the module to be installed with nest.Install.
+    model_name : str
+        Name of the generated model in NEST.
+
+    """
+    cache_dir = cache_dir or NESTML_CACHE_DIR
+    key = cache_key(nestml_model, codegen_opts)
+    entry = os.path.join(cache_dir, key)
+    manifest_fn = os.path.join(entry, "module.json")
+
+    if not os.path.isfile(manifest_fn):
+        print("NESTML module not found in cache, generating code...")
+        _build_entry(nestml_model, codegen_opts, cache_dir, key)
+    else:
+        print("Using cached NESTML module {}".format(entry))
+
+    with open(manifest_fn, 'r') as fp:
+        manifest = json.load(fp)
+
+    _add_library_path(os.path.join(entry, "install"))
+
+    return manifest["module_name"], manifest["model_name"]
+
+
+def _build_entry(nestml_model, codegen_opts, cache_dir, key):
+    """
+    Generates and compiles the module in a temporary directory, then moves it into the cache.
+    The final rename is atomic, so concurrent processes building the same module do not
+    corrupt the cache: the first one to finish wins and the others discard their build.
+
+    """
+    from pynestml.frontend.pynestml_frontend import generate_nest_target
+
+    os.makedirs(cache_dir, exist_ok=True)
+    model_name = model_name_from_source(nestml_model)
+    module_name = "nestml_" + key[:16] + "_module"
+
+    tmp_entry = tempfile.mkdtemp(prefix=key[:16] + "_", dir=cache_dir)
+    try:
+        input_path = os.path.join(tmp_entry, model_name + ".nestml")
+        with open(input_path, 'w') as fp:
+            fp.write(nestml_model)
+
+        generate_nest_target(input_path=input_path,
+                             target_path=os.path.join(tmp_entry, "target"),
+                             install_path=os.path.join(tmp_entry, "install"),
+                             module_name=module_name,
+                             suffix=NESTML_SUFFIX,
+                             logging_level="WARNING",
+                             codegen_opts=codegen_opts)
+
+        manifest = {"module_name": module_name,
+                    "model_name": model_name + NESTML_SUFFIX,
+                    "codegen_opts": codegen_opts,
+                    "nest_version": _nest_version(),
+                    "pynestml_version": _package_version("pynestml")}
+        with open(os.path.join(tmp_entry, "module.json"), 'w') as fp:
+            json.dump(manifest, fp)
+
+        try:
+            os.rename(tmp_entry, os.path.join(cache_dir, key))
+        except OSError:
+            # another process already stored the same module
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        raise
+
+
+def _add_library_path(path):
+    """
+    Prepends path to the library search path used by nest.Install.
+
+    """
+    for var in ["LD_LIBRARY_PATH", "LTDL_LIBRARY_PATH"]:
+        paths = os.environ.get(var, "").split(os.pathsep)
+        if path not in paths:
+            os.environ[var] = os.pathsep.join([path] + [p for p in paths if p])
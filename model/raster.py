@@ -0,0 +1,104 @@
+"""
+Raster plots of large spike data
+================================
+
+Draws raster plots either with a marker per spike or, when the number of
+spikes is large, as a density image: the spikes are binned into a
+(neuron x time) grid of pixels, in chunks so that the temporary arrays do
+not grow with the number of spikes, and the grid is drawn with imshow in the
+color of the population, the opacity of each pixel being proportional to
+its spike count. The mode is chosen automatically from the number of spikes
+to be drawn.
+
+Each population is a layer, i.e. a dict with
+
+    y, times     position on the y axis (e.g. the neuron id) and time [ms] of the spikes
+    y_range      (y_min, y_max) of the rows of the layer
+    color        matplotlib color
+    label        label of the legend (optional)
+
+The stimuli are shaded by the caller after draw_raster, so that they are
+drawn on top of the spikes.
+
+"""
+
+import numpy as np
+
+# largest number of spikes drawn with markers in the automatic mode
+MARKER_LIMIT = 200000
+# number of spikes binned at a time in the density mode
+CHUNK_SIZE = 2**20
+
+
+def density(y, times, t_start, t_stop, y_range, width, height):
+    """
+    Returns the spike counts in a grid of height x width pixels covering [t_start, t_stop) and
+    [y_range[0], y_range[1]); spikes out of the grid are ignored.
+
+    """
+    y_min, y_max = y_range
+    counts = np.zeros(height*width, dtype=np.int64)
+    for i in range(0, len(times), CHUNK_SIZE):
+        t = np.asarray(times[i:i + CHUNK_SIZE], dtype=np.float64)
+        yy = np.asarray(y[i:i + CHUNK_SIZE], dtype=np.float64)
+        col = np.floor((t - t_start)*(width/(t_stop - t_start))).astype(np.int64)
+        row = np.floor((yy - y_min)*(height/(y_max - y_min))).astype(np.int64)
+        inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+        counts += np.bincount(row[inside]*width + col[inside], minlength=height*width)
+    return(counts.reshape(height, width))
+
+
+def draw_raster(ax, layers, t_start, t_stop, mode="auto", max_markers=MARKER_LIMIT, width=2000, height=1000):
+    """
+    Draws the raster plot of the layers on a matplotlib axis.
+
+    Parameters
+    ----------
+    ax : Axes
+        Axis on which the spikes are drawn.
+    layers : list
+        Populations to be drawn (see the module docstring).
+    t_start, t_stop : float
+        Time interval drawn [ms].
+    mode : str
+        "markers", "density" or "auto", in which the markers are used if the
+        layers contain at most max_markers spikes.
+    max_markers : int
+        Threshold of the automatic mode.
+    width, height : int
+        Maximum size of the density grid in pixels; a layer never has more rows than neurons.
+
+    Returns
+    -------
+    mode : str
+        Mode used, "markers" or "density".
+
+    """
+    if mode not in ["auto", "markers", "density"]:
+        raise ValueError("Unknown raster mode {}, available: auto, markers, density.".format(mode))
+    if mode == "auto":
+        n_spikes = sum(len(layer["times"]) for layer in layers)
+        mode = "markers" if n_spikes <= max_markers else "density"
+
+    if mode == "markers":
+        for layer in layers:
+            ax.plot(layer["times"], layer["y"], '.', color=layer["color"], label=layer.get("label"))
+        return(mode)
+
+    from matplotlib.colors import to_rgb
+    for layer in layers:
+        y_min, y_max = layer["y_range"]
+        rows = int(max(min(height, np.ceil(y_max - y_min)), 1))
+        counts = density(layer["y"], layer["times"], t_start, t_stop, layer["y_range"], width, rows)
+        image = np.zeros((rows, width, 4))
+        image[..., :3] = to_rgb(layer["color"])
+        if counts.any():
+            # saturation at the 99th percentile of the occupied pixels, so that isolated spikes stay visible
+            norm = max(np.percentile(counts[counts > 0], 99), 1)
+            image[..., 3] = np.minimum(counts/norm, 1.0)
+        ax.imshow(image, extent=(t_start, t_stop, y_min, y_max), origin="lower", aspect="auto",
+                  interpolation="nearest", zorder=0)
+        # proxy artist for the legend
+        ax.plot([], [], 's', color=layer["color"], label=layer.get("label"))
+    ax.set_xlim(t_start, t_stop)
+    return(mode)
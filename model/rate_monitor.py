@@ -0,0 +1,138 @@
+"""
+Online population rate monitor
+==============================
+
+Records the population activity of the whole network (every selective
+population, the non-selective and the inhibitory population) without
+storing the individual spikes. A spike recorder is connected to all the
+neurons of each population and is drained at every chunk of the simulation:
+its events are added to a preallocated (population x time bin) array of
+spike counts and then cleared, so that the memory used by the kernel does
+not grow with the simulated time.
+
+The counts are saved in the compressed file ``population_rates.npz`` with
+
+    counts      spike counts, array of shape (populations, bins)
+    names       names of the populations ("sel_0", ..., "nonsel", "inh")
+    sizes       number of neurons of each population
+    t_start     time of the beginning of the first bin [ms]
+    bin_size    width of the bins [ms]
+
+load_rates returns the bin centers and the population rates in spikes/s.
+
+"""
+
+import numpy as np
+
+RATE_FILE = "population_rates.npz"
+
+
+class RateMonitor:
+    """
+    Binned spike counts of the populations of the network.
+
+    Parameters
+    ----------
+    populations : list
+        NodeCollections of the monitored populations.
+    names : list
+        Names of the populations.
+    t_start, t_stop : float
+        Time interval monitored, in the time of the stimulation protocol [ms].
+    bin_size : float
+        Width of the bins [ms].
+
+    """
+    def __init__(self, populations, names, t_start, t_stop, bin_size):
+        self.populations = populations
+        self.names = list(names)
+        self.sizes = np.array([len(pop) for pop in populations])
+        self.t_start = t_start
+        self.bin_size = bin_size
+        n_bins = int(np.ceil((t_stop - t_start)/bin_size))
+        self.counts = np.zeros((len(populations), n_bins), dtype=np.uint32)
+        self.recorders = []
+
+
+    def create(self):
+        """
+        Creates a spike recorder for each population.
+
+        """
+        import nest
+        self.recorders = [nest.Create("spike_recorder") for pop in self.populations]
+
+
+    def connect(self):
+        """
+        Connects the neurons of each population to its spike recorder.
+
+        """
+        import nest
+        for pop, sr in zip(self.populations, self.recorders):
+            nest.Connect(pop, sr)
+
+
+    def drain(self, protocol_time):
+        """
+        Adds the spikes collected by the recorders to the counts and clears the recorders.
+
+        Parameters
+        ----------
+        protocol_time : function
+            Converts the times of the NEST kernel into the ones of the stimulation protocol.
+
+        """
+        n_bins = self.counts.shape[1]
+        for i, sr in enumerate(self.recorders):
+            times = np.asarray(sr.get("events", "times"))
+            sr.set({"n_events": 0})
+            if len(times) == 0:
+                continue
+            bins = np.floor((protocol_time(times) - self.t_start)/self.bin_size).astype(np.int64)
+            bins = bins[(bins >= 0) & (bins < n_bins)]
+            self.counts[i] += np.bincount(bins, minlength=n_bins).astype(np.uint32)
+
+
+    def reset(self, t_start=None):
+        """
+        Clears the counts and the recorders (e.g. at the beginning of a trial).
+
+        """
+        if t_start is not None:
+            self.t_start = t_start
+        self.counts[:] = 0
+        for sr in self.recorders:
+            sr.set({"n_events": 0})
+
+
+    def save(self, path):
+        """
+        Saves the counts in the file population_rates.npz in the directory path.
+
+        """
+        counts = self.counts
+        if counts.size > 0 and counts.max() < 2**16:
+            counts = counts.astype(np.uint16)
+        np.savez_compressed(path + RATE_FILE, counts=counts, names=np.array(self.names), sizes=self.sizes,
+                            t_start=self.t_start, bin_size=self.bin_size)
+
+
+def load_rates(path):
+    """
+    Loads the population rates saved by RateMonitor.save.
+
+    Returns
+    -------
+    times : ndarray
+        Centers of the bins [ms].
+    rates : dict
+        Rate of each population [spikes/s], arrays with the same length as times.
+
+    """
+    with np.load(path + RATE_FILE) as data:
+        bin_size = float(data["bin_size"])
+        times = float(data["t_start"]) + bin_size*(np.arange(data["counts"].shape[1]) + 0.5)
+        rates = {str(name): data["counts"][i]*1000.0/(bin_size*max(int(data["sizes"][i]), 1))
+                 for i, name in enumerate(data["names"])}
+    return times, rates
@@ -0,0 +1,115 @@
+"""
+Windowed firing rates
+=====================
+
+Firing rates of the recorded neurons computed from the spike arrays returned
+by model/spike_store.py (sender ids and spike times [ms] in the columns,
+sorted by time). The spikes of each window are located by binary search on
+the spike times and counted per neuron with a single bincount over all the
+windows, so that the cost depends on the number of spikes within the windows
+and not on the length of the recording or on the number of neurons.
+
+A window (t_start, t_stop) contains the spikes with t_start < t < t_stop, as
+in the analysis of the publication.
+
+"""
+
+import numpy as np
+
+
+def window_counts(spikes, ids, windows):
+    """
+    Counts the spikes of each neuron in each time window.
+
+    Parameters
+    ----------
+    spikes : ndarray
+        Array of shape (number of spikes, 2) with senders and spike times [ms], sorted by time.
+    ids : array
+        Ids of the neurons. Spikes of other senders are ignored.
+    windows : array
+        Time windows (t_start, t_stop) [ms], array of shape (number of windows, 2).
+
+    Returns
+    -------
+    counts : ndarray
+        Spike counts, array of shape (number of windows, number of neurons).
+
+    """
+    ids = np.asarray(ids)
+    windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+    n_ids = len(ids)
+    n_win = len(windows)
+    times = spikes[:,1]
+    lo = np.searchsorted(times, windows[:,0], side='right')
+    hi = np.maximum(np.searchsorted(times, windows[:,1], side='left'), lo)
+    lengths = hi - lo
+
+    # positions of the spikes of all the windows, concatenated, and window of each of them
+    win = np.repeat(np.arange(n_win), lengths)
+    pos = np.arange(lengths.sum()) + np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+
+    # column of each sender in the sorted ids
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    senders = spikes[pos,0]
+    col = np.minimum(np.searchsorted(sorted_ids, senders), max(n_ids - 1, 0))
+    valid = sorted_ids[col] == senders if n_ids > 0 else np.zeros(len(senders), dtype=bool)
+    counts = np.bincount(win[valid]*n_ids + col[valid], minlength=n_win*n_ids).reshape(n_win, n_ids)
+
+    # back to the order of ids
+    result = np.empty_like(counts)
+    result[:, order] = counts
+    return(result)
+
+
+def firing_rates(spikes, ids, windows):
+    """
+    Returns the firing rate [spikes/s] of each neuron in each time window,
+    array of shape (number of windows, number of neurons).
+
+    """
+    windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+    durations = windows[:,1] - windows[:,0]
+    return(window_counts(spikes, ids, windows)*1000.0/durations[:,None])
+
+
+def rate_difference(spikes, ids, windows1, windows2):
+    """
+    Returns the difference between the firing rates [spikes/s] of each neuron in two sets of
+    time windows, e.g. the delay periods and the spontaneous activity of several trials.
+    The rate of a set is the number of spikes over the total duration of its windows.
+
+    """
+    windows1 = np.asarray(windows1, dtype=np.float64).reshape(-1, 2)
+    windows2 = np.asarray(windows2, dtype=np.float64).reshape(-1, 2)
+    counts = window_counts(spikes, ids, np.concatenate([windows1, windows2]))
+    rate1 = counts[:len(windows1)].sum(axis=0)*1000.0/np.sum(windows1[:,1] - windows1[:,0])
+    rate2 = counts[len(windows1):].sum(axis=0)*1000.0/np.sum(windows2[:,1] - windows2[:,0])
+    return(rate1 - rate2)
+
+
+def psth(spikes, ids, t_start, t_stop, bin_size):
+    """
+    Returns the population rate of the neurons ids [spikes/s per neuron] in bins of width
+    bin_size [ms] covering [t_start, t_stop).
+
+    Returns
+    -------
+    times : ndarray
+        Centers of the bins [ms].
+    rate : ndarray
+        Population rate in each bin.
+
+    """
+    ids = np.asarray(ids)
+    n_bins = int(np.ceil((t_stop - t_start)/bin_size))
+    times = spikes[:,1]
+    lo = np.searchsorted(times, t_start, side='left')
+    hi = np.searchsorted(times, t_stop, side='left')
+    chunk = spikes[lo:hi]
+    chunk = chunk[np.isin(chunk[:,0], ids)]
+    bins = np.minimum(((chunk[:,1] - t_start)/bin_size).astype(np.int64), n_bins - 1)
+    counts = np.bincount(bins, minlength=n_bins)
+    centers = t_start + bin_size*(np.arange(n_bins) + 0.5)
+    return(centers, counts*1000.0/(bin_size*max(len(ids), 1)))
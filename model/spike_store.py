@@ -0,0 +1,139 @@
+"""
+Binary spike store
+==================
+
+The spikes of each recorded selective population are saved in a binary
+file ``spikedataX.npy`` (X is the population id) holding a structured
+array sorted by time, with the sender id and the spike time in units of
+the simulation resolution stored as unsigned 32-bit integers. A small
+JSON header ``spikedataX.json`` contains the population metadata and a
+coarse time index, i.e. the position of the first spike of each time bin,
+so that a time window can be sliced from the memory-mapped file without
+reading the rest of it.
+
+"""
+
+import json
+import os
+import numpy as np
+
+SPIKE_DTYPE = np.dtype([("sender", "<u4"), ("step", "<u4")])
+
+# width of the bins of the time index [ms]
+INDEX_BIN = 100.0
+
+
+def spike_file_names(path, npop):
+    """
+    Returns the names of the data and header files of population npop.
+
+    """
+    base = os.path.join(path, "spikedata" + str(npop))
+    return base + ".npy", base + ".json"
+
+
+def save_spikes(path, npop, senders, times, dt, metadata=None, index_bin=INDEX_BIN):
+    """
+    Saves the spikes of a recorded population.
+
+    Parameters
+    ----------
+    path : str
+        Directory in which the files are written.
+    npop : int
+        Id of the selective population recorded.
+    senders : array
+        Ids of the neurons that emitted the spikes.
+    times : array
+        Spike times [ms], multiples of the resolution dt.
+    dt : float
+        Simulation resolution [ms].
+    metadata : dict
+        Additional population metadata stored in the header.
+    index_bin : float
+        Width of the bins of the time index [ms].
+
+    """
+    senders = np.asarray(senders)
+    steps = np.rint(np.asarray(times, dtype=np.float64)/dt)
+    if len(senders) > 0 and (senders.max() > np.iinfo(np.uint32).max or steps.max() > np.iinfo(np.uint32).max):
+        raise ValueError("Sender ids or spike times exceed the range of the binary spike format.")
+    data = np.empty(len(senders), dtype=SPIKE_DTYPE)
+    data["sender"] = senders
+    data["step"] = steps
+    data = data[np.argsort(data["step"], kind="stable")]
+
+    n_bins = int(np.ceil((data["step"][-1] + 1)*dt/index_bin)) if len(data) > 0 else 0
+    bin_edges = np.rint(np.arange(n_bins + 1)*index_bin/dt)
+    index = np.searchsorted(data["step"], bin_edges, side='left')
+
+    data_fn, header_fn = spike_file_names(path, npop)
+    np.save(data_fn, data)
+    header = {"pop": npop,
+              "dt": dt,
+              "n_spikes": int(len(data)),
+              "index_bin": index_bin,
+              "index": index.tolist()}
+    if metadata is not None:
+        header.update(metadata)
+    with open(header_fn, 'w') as fp:
+        json.dump(header, fp)
+
+
+def load_spike_header(path, npop):
+    """
+    Returns the header of the spike file of population npop.
+
+    """
+    data_fn, header_fn = spike_file_names(path, npop)
+    with open(header_fn, 'r') as fp:
+        return json.load(fp)
+
+
+def load_spikes(path, npop, t_start=None, t_stop=None):
+    """
+    Loads the spikes of population npop in the time window [t_start, t_stop).
+    The data file is memory-mapped and only the part of it belonging to the window is read.
+
+    Parameters
+    ----------
+    path : str
+        Directory containing the spike data.
+    npop : int
+        Id of the selective population recorded.
+    t_start : float
+        Beginning of the time window [ms]. If None, the window starts with the first spike.
+    t_stop : float
+        End of the time window [ms]. If None, the window ends with the last spike.
+
+    Returns
+    -------
+    spikes : ndarray
+        Array of shape (number of spikes, 2) with senders and spike times [ms] in the columns,
+        as the one saved in the former text format.
+
+    """
+    data_fn, header_fn = spike_file_names(path, npop)
+    header = load_spike_header(path, npop)
+    dt = header["dt"]
+    index = header["index"]
+    data = np.load(data_fn, mmap_mode='r')
+
+    lo, hi = 0, len(data)
+    if t_start is not None and len(index) > 0:
+        b = int(np.clip(np.floor(t_start/header["index_bin"]), 0, len(index) - 1))
+        lo = index[b]
+    if t_stop is not None and len(index) > 0:
+        b = int(np.ceil(t_stop/header["index_bin"]))
+        hi = index[b] if b < len(index) else len(data)
+    chunk = data[lo:hi]
+    steps = chunk["step"]
+    # refine the window inside the index bins
+    i0 = np.searchsorted(steps, np.ceil(t_start/dt - 1e-6), side='left') if t_start is not None else 0
+    i1 = np.searchsorted(steps, np.ceil(t_stop/dt - 1e-6), side='left') if t_stop is not None else len(chunk)
+    chunk = chunk[i0:i1]
+
+    spikes = np.empty((len(chunk), 2))
+    spikes[:, 0] = chunk["sender"]
+    spikes[:, 1] = chunk["step"]*dt
+    return spikes
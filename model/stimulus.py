@@ -0,0 +1,205 @@
+"""
+Stimulus timeline
+=================
+
+Sorted and validated list of the stimuli delivered to the network, shared
+by the model build (device compilation), the raster plots and the analysis.
+Each stimulus is a StimulusEvent with
+
+    kind       one of STIMULUS_KINDS
+    target     id of the selective population, or "exc" for the whole excitatory population
+    onset      stimulus onset [ms]
+    duration   stimulus duration [ms]
+    amplitude  contrast factor of the stimulus (the input current is eta_exc*(amplitude - 1))
+    frac       fraction of the target neurons stimulated
+
+The timeline is stored in network_params.json under the key "stimulus_timeline".
+Events are kept sorted by onset, so that the stimuli active in a time window
+are found by binary search.
+
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+STIMULUS_KINDS = ["item_loading", "nonspecific_readout_signal", "nonspecific_noise", "periodic_sequence"]
+
+StimulusEvent = namedtuple("StimulusEvent", ["kind", "target", "onset", "duration", "amplitude", "frac"])
+
+
+class StimulusTimeline:
+    def __init__(self, events=None):
+        """
+        Timeline of the stimuli.
+
+        Parameters
+        ----------
+        events : list
+            List of StimulusEvent or of dicts with the StimulusEvent fields.
+
+        """
+        self.events = []
+        self.onsets = []
+        # maximum duration of the events, bounds the search window of the queries
+        self.max_duration = 0.0
+        for ev in events or []:
+            if isinstance(ev, dict):
+                ev = StimulusEvent(**ev)
+            self.add(*ev)
+
+
+    def __len__(self):
+        return len(self.events)
+
+
+    def __iter__(self):
+        return iter(self.events)
+
+
+    def add(self, kind, target, onset, duration, amplitude, frac=1.0):
+        """
+        Adds a stimulus to the timeline, keeping the events sorted by onset.
+
+        """
+        if kind not in STIMULUS_KINDS:
+            raise ValueError("Unknown stimulus kind {}.".format(kind))
+        if target != "exc":
+            try:
+                target = int(target)
+            except (TypeError, ValueError):
+                raise ValueError("Stimulus target must be a population id or 'exc', got {}.".format(target))
+        if onset < 0.0 or duration <= 0.0:
+            raise ValueError("Stimulus onset must be non-negative and duration positive.")
+        if frac <= 0.0 or frac > 1.0:
+            raise ValueError("Fraction of stimulated neurons must be in (0, 1].")
+        ev = StimulusEvent(kind, target, float(onset), float(duration), float(amplitude), float(frac))
+        # events with the same onset keep the insertion order
+        i = bisect_right(self.onsets, ev.onset)
+        self.events.insert(i, ev)
+        self.onsets.insert(i, ev.onset)
+        self.max_duration = max(self.max_duration, ev.duration)
+        return ev
+
+
+    def remove(self, kind):
+        """
+        Removes all the stimuli of the given kind.
+
+        """
+        kept = [ev for ev in self.events if ev.kind != kind]
+        self.events = []
+        self.onsets = []
+        self.max_duration = 0.0
+        for ev in kept:
+            self.add(*ev)
+
+
+    def select(self, kind=None, target=None):
+        """
+        Returns the list of stimuli of the given kind and target, sorted by onset.
+
+        """
+        return [ev for ev in self.events if (kind is None or ev.kind == kind) and (target is None or ev.target == target)]
+
+
+    def active(self, t0, t1, kind=None):
+        """
+        Returns the stimuli active in the time window [t0, t1), sorted by onset.
+
+        """
+        lo = bisect_left(self.onsets, t0 - self.max_duration)
+        hi = bisect_left(self.onsets, t1)
+        return [ev for ev in self.events[lo:hi]
+                if ev.onset + ev.duration > t0 and (kind is None or ev.kind == kind)]
+
+
+    def first_onset(self, kind=None, after=-math.inf):
+        """
+        Returns the onset of the first stimulus of the given kind starting at or after the time after,
+        None if there is no such stimulus.
+
+        """
+        for ev in self.events[bisect_left(self.onsets, after):]:
+            if kind is None or ev.kind == kind:
+                return ev.onset
+        return None
+
+
+    def validate(self, p, t_sim=None):
+        """
+        Checks that the stimuli target existing populations and, if t_sim is given,
+        that they start within the simulated time.
+
+        """
+        for ev in self.events:
+            if ev.target != "exc" and not 0 <= ev.target < p:
+                raise ValueError("Stimulus {} targets population {}, but only {} selective populations exist.".format(ev.kind, ev.target, p))
+            if t_sim is not None and ev.onset >= t_sim:
+                print("Warning: stimulus {} at {} ms starts after the end of the simulation.".format(ev.kind, ev.onset))
+
+
+    def to_list(self):
+        """
+        Returns the timeline as a list of dicts, to be saved in json format.
+
+        """
+        return [ev._asdict() for ev in self.events]
+
+
+    @classmethod
+    def from_network_params(cls, network_params):
+        """
+        Returns the timeline stored in network_params. If it is not present (data produced
+        by older versions of the model) the timeline is built from the stimulus entries
+        'item_loading', 'nonspecific_readout_signals', 'nonspecific_noise' and 'periodic_sequence'.
+
+        """
+        if "stimulus_timeline" in network_params:
+            return cls(network_params["stimulus_timeline"])
+
+        timeline = cls()
+        stim = network_params["stimulation_params"]
+        if "item_loading" in network_params:
+            for pop_id, origin in zip(network_params["item_loading"]["pop_id"], network_params["item_loading"]["origin"]):
+                timeline.add("item_loading", int(pop_id), origin, stim["T_cue"], stim["A_cue"])
+        if "nonspecific_readout_signals" in network_params:
+            for origin in network_params["nonspecific_readout_signals"]["origin"]:
+                timeline.add("nonspecific_readout_signal", "exc", origin, stim["T_reac"], stim["A_reac"])
+        if "nonspecific_noise" in network_params:
+            for origin in network_params["nonspecific_noise"]["origin"]:
+                timeline.add("nonspecific_noise", "exc", origin, stim["T_cue"], stim["A_cue"],
+                             network_params["nonspecific_noise"]["frac"])
+        if "periodic_sequence" in network_params:
+            for t in network_params["periodic_sequence"]["times"]:
+                timeline.add("periodic_sequence", "exc", t, stim["T_period_reac"], stim["A_period_reac"])
+        return timeline
+
+
+def shade_stimuli(ax, timeline, styles, t0=-math.inf, t1=math.inf, alpha=0.5):
+    """
+    Shades the stimuli active in [t0, t1) on a matplotlib axis with vertical spans.
+
+    Parameters
+    ----------
+    ax : Axes
+        Axis on which the stimuli are drawn.
+    timeline : StimulusTimeline
+        Timeline of the stimuli.
+    styles : dict
+        Dictionary with the stimulus kinds to be drawn as keys. Each value is a dict with
+        the 'color' and 'label' of the kind and optionally a function 'band' that, given
+        the StimulusEvent, returns the (ymin, ymax) of the span in axis coordinates.
+
+    """
+    labelled = set()
+    events = timeline.events if math.isinf(t0) and math.isinf(t1) else timeline.active(t0, t1)
+    for ev in events:
+        if ev.kind not in styles:
+            continue
+        style = styles[ev.kind]
+        ymin, ymax = style["band"](ev) if "band" in style else (0.0, 1.0)
+        # only the first span of each kind is labelled in the legend
+        label = style.get("label") if ev.kind not in labelled else None
+        labelled.add(ev.kind)
+        ax.axvspan(ev.onset, ev.onset + ev.duration, ymin, ymax, alpha=alpha, color=style["color"], label=label)
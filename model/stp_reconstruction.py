@@ -0,0 +1,278 @@
+"""
+Offline reconstruction of STP traces
+====================================
+
+In the stp_synapse model the variables u and x change only when a
+presynaptic spike is received and relax exponentially in between, so the
+STP state of all the outgoing synapses of a neuron is fully determined by
+its spike train and by the STP parameters. This module computes the
+values of x and u at arbitrary times from recorded spike trains, vectorized
+over neurons, without the stepped STP recording during the simulation.
+
+The spike trains must contain every spike since the beginning of the
+simulation, since the spikes emitted before the start of the spike recording
+are not known. When the STP variables are not recorded, the model records
+the spikes from the beginning for this purpose; from_spike_data warns if the
+recording started later. If the simulation continued from a snapshot, the
+STP state saved in the snapshot is used as initial state.
+
+"""
+
+import json
+import os
+import numpy as np
+from model.spike_store import load_spikes, load_spike_header
+
+
+def spike_trains(senders, times, neuron_ids):
+    """
+    Arranges the spikes of a set of neurons in a padded matrix.
+
+    Parameters
+    ----------
+    senders : array
+        Ids of the neurons that emitted the spikes.
+    times : array
+        Spike times [ms].
+    neuron_ids : array
+        Ids of the neurons to be considered, one row of the output for each neuron.
+
+    Returns
+    -------
+    S : ndarray
+        Array of shape (len(neuron_ids), max number of spikes) containing the sorted
+        spike times of each neuron, padded with inf.
+
+    """
+    senders = np.asarray(senders)
+    times = np.asarray(times, dtype=np.float64)
+    neuron_ids = np.asarray(neuron_ids)
+    n = len(neuron_ids)
+    order = np.argsort(neuron_ids)
+    sorted_ids = neuron_ids[order]
+    pos = np.clip(np.searchsorted(sorted_ids, senders), 0, max(n-1, 0))
+    valid = (sorted_ids[pos] == senders) if n > 0 else np.zeros(len(senders), dtype=bool)
+    rows = order[pos[valid]]
+    t = times[valid]
+    o = np.lexsort((t, rows))
+    rows = rows[o]
+    t = t[o]
+    counts = np.bincount(rows, minlength=n)
+    K = int(counts.max()) if len(rows) > 0 else 0
+    first = np.cumsum(counts) - counts
+    rank = np.arange(len(rows)) - first[rows]
+    S = np.full((n, K), np.inf)
+    S[rows, rank] = t
+    return S
+
+
+class STPReconstruction:
+    def __init__(self, S, U, tau_D, tau_F, u0=None, x0=1.0, t0=0.0):
+        """
+        STP state of the outgoing synapses of a set of neurons, computed from their spike trains.
+        The update rule at each spike is the one of the stp_synapse model:
+
+            x = 1 + (x - 1)*exp(-dt/tau_D)
+            u = U + (u - U)*exp(-dt/tau_F)
+            u = u + U*(1 - u)
+            x = x - u*x
+
+        where dt is the time since the previous spike.
+
+        Parameters
+        ----------
+        S : ndarray
+            Padded spike time matrix returned by spike_trains.
+        U : float
+            Baseline utilization factor.
+        tau_D : float
+            Recovery time of synaptic resources [ms].
+        tau_F : float
+            Recovery time of utilization factor [ms].
+        u0 : float or array
+            Value of u at t0. If None, U is used.
+        x0 : float or array
+            Value of x at t0.
+        t0 : float or array
+            Time at which the initial values are given [ms]. Arrays give a value for each neuron.
+
+        """
+        self.U = U
+        self.tau_D = tau_D
+        self.tau_F = tau_F
+        n, K = S.shape
+        self.n_neurons = n
+        # state right after each spike, column 0 is the initial state
+        self.t_ls = np.empty((n, K+1))
+        self.x = np.empty((n, K+1))
+        self.u = np.empty((n, K+1))
+        self.t_ls[:, 0] = t0
+        self.x[:, 0] = x0
+        self.u[:, 0] = U if u0 is None else u0
+        for k in range(K):
+            s = S[:, k]
+            spiking = np.isfinite(s)
+            dt = np.where(spiking, s - self.t_ls[:, k], 0.0)
+            x = 1.0 + (self.x[:, k] - 1.0)*np.exp(-dt/tau_D)
+            u = U + (self.u[:, k] - U)*np.exp(-dt/tau_F)
+            u = u + U*(1.0 - u)
+            x = x - u*x
+            self.t_ls[:, k+1] = np.where(spiking, s, self.t_ls[:, k])
+            self.x[:, k+1] = np.where(spiking, x, self.x[:, k])
+            self.u[:, k+1] = np.where(spiking, u, self.u[:, k])
+        self.S = S
+
+
+    def last_spike_index(self, t):
+        """
+        Returns the (neuron x time) array with the number of spikes emitted
+        by each neuron up to (and including) the times t.
+
+        """
+        t = np.asarray(t, dtype=np.float64)
+        n, K = self.S.shape
+        if K == 0 or len(t) == 0:
+            return np.zeros((n, len(t)), dtype=np.int64)
+        # spike times of all the neurons in a single sorted array, one time window per neuron
+        finite_max = np.max(self.S[np.isfinite(self.S)], initial=0.0)
+        H = max(finite_max, np.max(t), 0.0) + 1.0
+        offset = np.arange(n)[:, None]*(H + 1.0)
+        keys = (np.where(np.isfinite(self.S), self.S, H) + offset).ravel()
+        qkeys = t[None, :] + offset
+        return np.searchsorted(keys, qkeys, side='right') - np.arange(n)[:, None]*K
+
+
+    def traces(self, t):
+        """
+        Computes the values of x and u of every neuron at the times t.
+
+        Returns
+        -------
+        x, u : ndarray
+            Arrays of shape (number of neurons, len(t)).
+
+        """
+        t = np.asarray(t, dtype=np.float64)
+        idx = self.last_spike_index(t)
+        rows = np.arange(self.n_neurons)[:, None]
+        dt = t[None, :] - self.t_ls[rows, idx]
+        x = 1.0 + (self.x[rows, idx] - 1.0)*np.exp(-dt/self.tau_D)
+        u = self.U + (self.u[rows, idx] - self.U)*np.exp(-dt/self.tau_F)
+        return x, u
+
+
+    def population_mean(self, t, block_size=10000):
+        """
+        Computes the average of x and u over the neurons at the times t.
+        The times are processed in blocks to bound the memory usage.
+
+        Returns
+        -------
+        xavg, uavg : ndarray
+            Arrays of length len(t).
+
+        """
+        stats = self.population_stats(t, block_size)
+        return stats["x"]["mean"], stats["u"]["mean"]
+
+
+    def population_stats(self, t, block_size=10000, std=False, percentiles=()):
+        """
+        Computes the average (and optionally the spread) of x, u and u*x over the neurons at the times t,
+        see the module-level function population_stats for the arguments and the returned dict.
+
+        """
+        t = np.asarray(t, dtype=np.float64)
+        return population_stats(lambda i0, i1: self.traces(t[i0:i1]), len(t), block_size, std, percentiles)
+
+
+def population_stats(traces, n_t, block_size=10000, std=False, percentiles=()):
+    """
+    Streaming statistics of the STP variables over the neurons. The traces are evaluated in
+    blocks of time steps, each holding all the neurons, so the memory usage does not depend on
+    the number of time steps and the statistics of every time step are exact.
+
+    Parameters
+    ----------
+    traces : function
+        traces(i0, i1) returns the arrays x and u of shape (number of neurons, i1 - i0) at the time steps [i0, i1).
+    n_t : int
+        Number of time steps.
+    block_size : int
+        Number of time steps of each block.
+    std : bool
+        If True, the standard deviation over the neurons is computed.
+    percentiles : list
+        Percentiles over the neurons to be computed (e.g. [5, 95]).
+
+    Returns
+    -------
+    stats : dict
+        For each of 'x', 'u' and 'ux', a dict with the arrays 'mean', 'std' (if requested)
+        and 'pQ' for each percentile Q.
+
+    """
+    stats = {}
+    for var in ["x", "u", "ux"]:
+        stats[var] = {"mean": np.empty(n_t)}
+        if std:
+            stats[var]["std"] = np.empty(n_t)
+        for q in percentiles:
+            stats[var]["p{:g}".format(q)] = np.empty(n_t)
+    for i0 in range(0, n_t, block_size):
+        i1 = min(i0 + block_size, n_t)
+        x, u = traces(i0, i1)
+        for var, values in [("x", x), ("u", u), ("ux", u*x)]:
+            stats[var]["mean"][i0:i1] = np.mean(values, axis=0)
+            if std:
+                stats[var]["std"][i0:i1] = np.std(values, axis=0)
+            if len(percentiles) > 0:
+                for q, values_q in zip(percentiles, np.percentile(values, percentiles, axis=0)):
+                    stats[var]["p{:g}".format(q)][i0:i1] = values_q
+    return stats
+
+
+def recorded_neuron_ids(data_path, network_params, simulation_params, npop):
+    """
+    Returns the NEST ids of the neurons of the selective population npop recorded by the spike recorders.
+
+    """
+    N_rec = int(network_params["N_exc"]*network_params["f"]*simulation_params["recording_params"]["fraction_pop_recorded"])
+    n_E = int(network_params["f"]*network_params["N_exc"])
+    if network_params["overlap"]:
+        sel_ids = np.loadtxt(os.path.join(data_path, "selective_pop_ids.dat"))
+        return (np.sort(sel_ids[:, npop]) + 1).astype(np.int64)[0:N_rec]
+    # the excitatory neurons are the first nodes created
+    return np.arange(npop*n_E + 1, npop*n_E + 1 + N_rec)
+
+
+def from_spike_data(data_path, npop):
+    """
+    Builds the STP reconstruction of the selective population npop from the
+    spike data and the parameters saved by the model in data_path.
+
+    """
+    with open(os.path.join(data_path, "network_params.json"), 'r') as fp:
+        network_params = json.load(fp)
+    with open(os.path.join(data_path, "simulation_params.json"), 'r') as fp:
+        simulation_params = json.load(fp)
+    spikes = load_spikes(data_path, npop)
+    ids = recorded_neuron_ids(data_path, network_params, simulation_params, npop)
+    S = spike_trains(spikes[:, 0].astype(np.int64), spikes[:, 1], ids)
+    stp_params = network_params["stp_params"]
+    snapshot = None
+    t_start = 0.0
+    if simulation_params.get("snapshot") is not None:
+        # the simulation continued from a snapshot, which contains the STP state of every excitatory neuron
+        with np.load(simulation_params["snapshot"]) as data:
+            snapshot = {key: data[key] for key in ["t", "u", "x", "t_ls"]}
+        t_start = float(snapshot["t"])
+    recording_start = load_spike_header(data_path, npop).get("recording_start", simulation_params["recording_params"]["spike_recording_params"]["start"])
+    if recording_start > t_start:
+        print("Warning: the spikes of population {} are recorded from {} ms, the STP traces miss the spikes "
+              "emitted since {} ms and are not reliable.".format(npop, recording_start, t_start))
+    if snapshot is not None:
+        return STPReconstruction(S, stp_params["U"], stp_params["tau_D"], stp_params["tau_F"],
+                                 u0=snapshot["u"][ids-1], x0=snapshot["x"][ids-1], t0=snapshot["t_ls"][ids-1])
+    return STPReconstruction(S, stp_params["U"], stp_params["tau_D"], stp_params["tau_F"],
+                             u0=stp_params["u0"], x0=stp_params["x0"])
@@ -0,0 +1,129 @@
+"""
+Columnar store for STP recordings
+=================================
+
+The STP variables of the recorded neurons are written step by step into
+preallocated (time x neuron) NumPy arrays saved in .npy format, one file
+per variable and per selective population:
+
+    stp_params/stp_pop_X_x.npy
+    stp_params/stp_pop_X_u.npy
+    stp_params/stp_pop_X_t_last_spike.npy
+    stp_params/stp_pop_X_ids.npy       (source and target of the sampled synapses)
+    stp_params/stp_pop_X.json          (recording times and number of steps written)
+
+The files can be memory-mapped on read, so no parsing or merging is needed.
+
+"""
+
+import json
+import os
+import numpy as np
+
+STP_VARIABLES = ["x", "u", "t_last_spike"]
+
+
+def stp_file_names(path, npop):
+    """
+    Returns a dict with the names of the files storing the STP recording of population npop.
+
+    """
+    base = os.path.join(path, "stp_pop_" + str(npop))
+    fn = {var: base + "_" + var + ".npy" for var in STP_VARIABLES}
+    fn.update({"ids": base + "_ids.npy", "meta": base + ".json"})
+    return fn
+
+
+class STPWriter:
+    def __init__(self, path, npop, times, source, target):
+        """
+        Append-only writer of the STP recording of a selective population.
+
+        Parameters
+        ----------
+        path : str
+            Directory in which the files are written.
+        npop : int
+            Id of the selective population recorded.
+        times : array
+            Recording times [ms], one per step.
+        source : array
+            Ids of the presynaptic neurons of the sampled synapses.
+        target : array
+            Ids of the postsynaptic neurons of the sampled synapses.
+
+        """
+        self.fn = stp_file_names(path, npop)
+        self.times = np.asarray(times, dtype=np.float64)
+        self.n_neurons = len(source)
+        self.n_written = 0
+
+        np.save(self.fn["ids"], np.array([source, target], dtype=np.int64))
+        shape = (len(self.times), self.n_neurons)
+        self.arrays = {var: np.lib.format.open_memmap(self.fn[var], mode='w+', dtype=np.float64, shape=shape)
+                       for var in STP_VARIABLES}
+        self.write_meta()
+
+
+    def write_meta(self):
+        meta = {"times": self.times.tolist(), "n_neurons": self.n_neurons, "n_written": self.n_written}
+        with open(self.fn["meta"], 'w') as fp:
+            json.dump(meta, fp)
+
+
+    def append(self, x, u, t_last_spike):
+        """
+        Writes the values of the next recording step.
+
+        """
+        if self.n_written >= len(self.times):
+            raise IndexError("All the {} recording steps have already been written.".format(len(self.times)))
+        step = self.n_written
+        self.arrays["x"][step, :] = x
+        self.arrays["u"][step, :] = u
+        self.arrays["t_last_spike"][step, :] = t_last_spike
+        self.n_written += 1
+
+
+    def close(self):
+        """
+        Flushes the arrays to disk and updates the number of steps written.
+
+        """
+        for arr in self.arrays.values():
+            arr.flush()
+        self.write_meta()
+        self.arrays = {}
+
+
+def load_stp_recording(path, npop, mmap=True):
+    """
+    Loads the STP recording of a selective population.
+
+    Parameters
+    ----------
+    path : str
+        Directory containing the STP recording.
+    npop : int
+        Id of the selective population recorded.
+    mmap : bool
+        If True the arrays are memory-mapped instead of read into memory.
+
+    Returns
+    -------
+    rec : dict
+        Dictionary with the recording times ('time'), the ids of the sampled synapses
+        ('source', 'target') and the (time x neuron) arrays 'x', 'u' and 't_last_spike'.
+        Only the steps actually written are returned.
+
+    """
+    fn = stp_file_names(path, npop)
+    with open(fn["meta"], 'r') as fp:
+        meta = json.load(fp)
+    n = meta["n_written"]
+    mmap_mode = 'r' if mmap else None
+    ids = np.load(fn["ids"], mmap_mode=mmap_mode)
+    rec = {"time": np.asarray(meta["times"])[:n], "source": ids[0], "target": ids[1]}
+    for var in STP_VARIABLES:
+        rec[var] = np.load(fn[var], mmap_mode=mmap_mode)[:n]
+    return rec
@@ -0,0 +1,216 @@
+"""
+Parameter sweeps
+================
+
+Runs a set of WMModel configurations concurrently in a process pool.
+Each sweep point overrides the network and simulation parameters of a base
+configuration, gets its own data directory and a seed derived from the
+master seed, and is simulated with a given number of NEST threads, so that
+e.g. a 32-core machine runs 8 jobs with 4 threads each. The seed of each
+point drives the dynamics (external input, noise), while the structure seed
+(selective populations and connectivity generated with connection_method
+"arrays") is shared by all the points unless a point overrides it, so that
+with the connectivity cache the network is generated only once per structure.
+
+A sweep point is a dict
+
+    {"network_spec": {...}, "sim_spec": {...}}
+
+and a grid is a dict mapping dotted parameter names to lists of values, e.g.
+
+    {"network_spec.eta_exc": [22.7, 23.7, 24.1],
+     "network_spec.stp_params.u0": [0.19, 0.3]}
+
+The stimulation protocol is a list of calls to the WMModel add_* methods,
+e.g. [{"method": "add_item_loading_signals", "kwargs": {"pop_id": [0], "origin": [3000.0]}}];
+the background input is always added for the whole simulation.
+
+The summary of the sweep is written to 'sweep_index.json' in the sweep directory
+and updated every time a point is completed.
+
+"""
+
+import itertools
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import deepcopy
+import multiprocessing
+import numpy as np
+
+from model.default_params import update_params, default_simulation_params
+
+
+def expand_grid(grid):
+    """
+    Returns the list of sweep points given by the cartesian product of the values in grid.
+
+    Parameters
+    ----------
+    grid : dict
+        Dictionary mapping dotted parameter names (starting with 'network_spec' or 'sim_spec')
+        to the list of values to be swept.
+
+    """
+    keys = list(grid.keys())
+    points = []
+    for values in itertools.product(*[grid[k] for k in keys]):
+        point = {"network_spec": {}, "sim_spec": {}}
+        for key, val in zip(keys, values):
+            path = key.split(".")
+            if path[0] not in point:
+                raise KeyError("Sweep parameter {} must start with 'network_spec' or 'sim_spec'.".format(key))
+            d = point[path[0]]
+            for k in path[1:-1]:
+                d = d.setdefault(k, {})
+            d[path[-1]] = val
+        points.append(point)
+    return points
+
+
+def point_seed(master_seed, index):
+    """
+    Derives the seed of the index-th sweep point from the master seed.
+    The seed is a valid NEST rng_seed, i.e. in [1, 2**31 - 1].
+
+    """
+    state = np.random.SeedSequence([master_seed, index]).generate_state(1)[0]
+    return int(state % (2**31 - 2)) + 1
+
+
+def run_point(index, network_spec, sim_spec, protocol):
+    """
+    Builds, simulates and saves a single sweep point. Executed in a worker process.
+
+    Returns a dict summarizing the run.
+
+    """
+    summary = {"index": index, "data_path": sim_spec["data_path"], "seed": sim_spec["master_seed"],
+               "structure_seed": sim_spec["structure_seed"], "network_spec": network_spec, "sim_spec": sim_spec,
+               "protocol": protocol}
+    t0 = time.time()
+    try:
+        from model.model import WMModel
+        network = WMModel(deepcopy(network_spec), deepcopy(sim_spec))
+        network.add_background_input(start=0.0, stop=network.simulation_params["t_sim"])
+        for call in protocol:
+            getattr(network, call["method"])(**call.get("kwargs", {}))
+        network.save_params()
+        network.build_network()
+        network.simulate_network()
+        network.save_spike_data()
+        summary["early_stop"] = network.early_stop
+        summary["status"] = "done"
+    except Exception:
+        summary["status"] = "failed"
+        summary["error"] = traceback.format_exc()
+    summary["wall_time"] = time.time() - t0
+    return summary
+
+
+def write_index(sweep_path, summaries):
+    """
+    Writes the summary of the sweep points to sweep_path/sweep_index.json.
+    The file is replaced atomically, so that it is always readable while the sweep runs.
+
+    """
+    fn = os.path.join(sweep_path, "sweep_index.json")
+    with open(fn + ".tmp", 'w') as fp:
+        json.dump(sorted(summaries.values(), key=lambda s: s["index"]), fp, indent=1)
+    os.replace(fn + ".tmp", fn)
+
+
+def run_sweep(points, sweep_path, network_spec=None, sim_spec=None, protocol=None,
+              jobs=1, threads_per_job=None, resume=True):
+    """
+    Runs the sweep points concurrently.
+
+    Parameters
+    ----------
+    points : list
+        List of sweep points (see expand_grid).
+    sweep_path : str
+        Directory in which the data of each point (in the sub-directory 'point_XXXX')
+        and the sweep index are saved.
+    network_spec : dict
+        Base network parameters, overwritten by the ones of each point.
+    sim_spec : dict
+        Base simulation parameters, overwritten by the ones of each point.
+    protocol : list
+        Stimulation protocol applied to every point.
+    jobs : int
+        Number of points simulated at the same time.
+    threads_per_job : int
+        Number of NEST threads of each job. If None, the value in sim_spec (or the default) is used.
+    resume : bool
+        If True, the points already completed according to the existing sweep index, with the same
+        parameters and protocol, are skipped; the points whose parameters changed are simulated again.
+
+    Returns
+    -------
+    summaries : list
+        Summary of each sweep point, sorted by index.
+
+    """
+    os.makedirs(sweep_path, exist_ok=True)
+    network_spec = network_spec or {}
+    sim_spec = sim_spec or {}
+    protocol = protocol or []
+    master_seed = sim_spec.get("master_seed", default_simulation_params["master_seed"])
+    structure_seed = sim_spec.get("structure_seed")
+    if structure_seed is None:
+        structure_seed = master_seed
+
+    done = {}
+    index_fn = os.path.join(sweep_path, "sweep_index.json")
+    if resume and os.path.isfile(index_fn):
+        with open(index_fn, 'r') as fp:
+            for s in json.load(fp):
+                if s["status"] == "done":
+                    done[s["index"]] = s
+
+    summaries = {}
+    tasks = []
+    for index, point in enumerate(points):
+        net = deepcopy(network_spec)
+        update_params(net, point.get("network_spec", {}))
+        sim = deepcopy(sim_spec)
+        update_params(sim, point.get("sim_spec", {}))
+        sim.update({"data_path": os.path.join(sweep_path, "point_{:04d}".format(index), ""),
+                    "overwrite_files": True,
+                    "confirm_overwrite": False})
+        if "master_seed" not in point.get("sim_spec", {}):
+            sim["master_seed"] = point_seed(master_seed, index)
+        if "structure_seed" not in point.get("sim_spec", {}):
+            sim["structure_seed"] = structure_seed
+        if threads_per_job is not None:
+            sim["threads"] = threads_per_job
+        # a point is skipped only if it was completed with the same parameters and protocol
+        # (compared after a round trip through JSON, as they are stored in the index)
+        if index in done and [done[index].get(key) for key in ["network_spec", "sim_spec", "protocol"]] == json.loads(json.dumps([net, sim, protocol])):
+            summaries[index] = done[index]
+            continue
+        tasks.append((index, net, sim, protocol))
+
+    print("Running {} sweep points ({} already done) with {} jobs.".format(len(tasks), len(summaries), jobs))
+    # NEST is not fork-safe, each worker starts a new interpreter
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(run_point, *task): task for task in tasks}
+        for future in as_completed(futures):
+            try:
+                s = future.result()
+            except Exception:
+                # the worker died (e.g. crash of the NEST kernel)
+                index, net, sim, protocol = futures[future]
+                s = {"index": index, "data_path": sim["data_path"], "seed": sim["master_seed"],
+                     "structure_seed": sim["structure_seed"], "network_spec": net, "sim_spec": sim,
+                     "protocol": protocol, "status": "failed",
+                     "error": traceback.format_exc(), "wall_time": 0.0}
+            summaries[s["index"]] = s
+            write_index(sweep_path, summaries)
+            print("Sweep point {} {} in {:.1f} s.".format(s["index"], s["status"], s["wall_time"]))
+
+    write_index(sweep_path, summaries)
+    return sorted(summaries.values(), key=lambda s: s["index"])
@@ -50,6 +50,7 @@ simulation_p = {
         # save spike data to file
         "save_to_file" : True,
         # save STP data to file
+        # not needed for the plots: analysis.py reconstructs the STP variables from the spike data
         "stp_recording" : False,
         # recording step for STP recording [ms]
         "stp_record_interval" : 10.0,
@@ -94,12 +95,25 @@ network.add_item_loading_signals(pop_id=[0], origin=[tpresim])
 
 # save used parameters into a json
 network.save_params()
+# to stop the simulation as soon as the item is lost (or kept), add to simulation_p e.g.
+#   "early_stop": {"criteria": [{"type": "rate_below", "pop": 0, "threshold": 5.0, "duration": 300.0, "after": tpresim + 350.0, "name": "item_lost"}]}
+# to estimate the memory and the run time of the network without building it, call
+#network.dry_run()
+# (the build stops with a MemoryError if the network does not fit the machine when "resource_check" is "refuse")
 # build network
 network.build_network()
 # simulate network
 network.simulate_network()
 # save data to file
 network.save_spike_data()
+# to run several protocols after the same spontaneous activity, simulate only the presimulation time
+# (t_sim = tpresim) with the background input, save the state of the network with
+#network.save_snapshot()
+# and then run each protocol with "snapshot": <data_path>/snapshot.npz in simulation_p:
+# the simulation continues from tpresim, so the stimulus times are the same as above.
+# to run many trials with a single network build, build the network and then call e.g.
+#network.run_trials([[{"method": "add_item_loading_signals", "kwargs": {"pop_id": [i], "origin": [tpresim]}}] for i in range(5)])
+# the data of each trial are saved in the trial_XXXX sub-directories of the data directory.
 # plots a raster plot of all the neurons recorded
 network.raster_plot()
 plt.show()
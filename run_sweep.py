@@ -0,0 +1,43 @@
+from model.sweep import expand_grid, run_sweep
+import argparse
+import json
+import os
+
+# Script needed to run a parameter sweep of the model.
+# The sweep is described by a JSON file containing:
+#   "network_spec", "sim_spec": base network and simulation parameters (as in run_model.py)
+#   "grid": dotted parameter names and the list of values to be swept, e.g.
+#           {"network_spec.eta_exc": [22.7, 23.7, 24.1], "network_spec.stp_params.u0": [0.19]}
+#   "points": alternatively (or in addition), an explicit list of {"network_spec": ..., "sim_spec": ...} overrides
+#   "protocol": list of stimuli, e.g. [{"method": "add_item_loading_signals", "kwargs": {"pop_id": [0], "origin": [3000.0]}}]
+# Example, on a 32-core machine:
+#   python run_sweep.py sweep.json --sweep-path data/sweep_fig2 --jobs 8 --threads-per-job 4
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a parameter sweep of the working memory model.")
+    parser.add_argument("spec", help="JSON file describing the sweep")
+    parser.add_argument("--sweep-path", default=os.path.join(os.getcwd(), 'data', 'sweep'),
+                        help="directory in which the data of the sweep points are saved")
+    parser.add_argument("--jobs", type=int, default=1, help="number of sweep points simulated at the same time")
+    parser.add_argument("--threads-per-job", type=int, default=None, help="number of NEST threads of each job")
+    parser.add_argument("--no-resume", action="store_true", help="simulate again the points already completed")
+    args = parser.parse_args()
+
+    with open(args.spec, 'r') as fp:
+        spec = json.load(fp)
+
+    points = expand_grid(spec["grid"]) if "grid" in spec else []
+    points += spec.get("points", [])
+
+    summaries = run_sweep(points, args.sweep_path,
+                          network_spec=spec.get("network_spec"),
+                          sim_spec=spec.get("sim_spec"),
+                          protocol=spec.get("protocol"),
+                          jobs=args.jobs,
+                          threads_per_job=args.threads_per_job,
+                          resume=not args.no_resume)
+
+    failed = [s["index"] for s in summaries if s["status"] != "done"]
+    print("{} of {} sweep points completed.".format(len(summaries) - len(failed), len(points)))
+    if failed:
+        print("Failed points: {}. See sweep_index.json for the errors.".format(failed))
@@ -12,8 +12,12 @@ import nest
 import nest.voltage_trace
 import numpy as np
 import matplotlib.pyplot as plt
+import os
+import sys
 
-from pynestml.codegeneration.nest_code_generator_utils import NESTCodeGeneratorUtils
+# the NESTML module cache is shared with the network model
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from model.nestml_cache import generate_code_for
 
 stp_synapse= """
 # Synapse model of STP with NESTML
@@ -50,9 +54,9 @@ model stp_synapse:
 """
 
 module_name, synapse_model_name = \
-        NESTCodeGeneratorUtils.generate_code_for(stp_synapse,
-                                                codegen_opts={"delay_variable": {"stp_synapse": "delay"},
-                                                            "weight_variable": {"stp_synapse": "w"}})
+        generate_code_for(stp_synapse,
+                          codegen_opts={"delay_variable": {"stp_synapse": "delay"},
+                                        "weight_variable": {"stp_synapse": "w"}})
 
 nest.ResetKernel()
 nest.Install(module_name)